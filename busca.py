@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""
+Busca textual sobre os índices FTS5 da migração 10 (tokenizer trigram):
+`busca_usuarios` (nome, email) e `busca_agendamentos` (convenio, notas).
+
+O trigram casa qualquer trecho do texto, sem diferenciar maiúsculas, mas
+precisa de ao menos 3 caracteres; termos menores não usam o índice.
+
+Os seletores de paciente/médico usam outra via, `usuarios_por_prefixo`:
+início do nome sem acento/maiúsculas sobre o índice (tipo_busca, nome_busca)
+da migração 11, paginado por keyset.
+"""
+import base64
+import json
+
+from databaser import FONTES_CONSULTAS_QUENTES, conectar
+from normalizacao import nome_busca
+
+MIN_CARACTERES = 3
+LIMITE_PADRAO = 20
+LIMITE_MAX = 100
+
+TIPOS_USUARIO = {
+    "paciente": ("paciente",),
+    "medico": ("medico", "médico"),
+    "recepcionista": ("recepcionista", "recepcionista master"),
+}
+
+
+def termo_fts(texto):
+    """Texto do usuário como frase FTS5 (sem operadores), ou None se curto demais."""
+    texto = " ".join((texto or "").split())
+    if len(texto) < MIN_CARACTERES:
+        return None
+    return '"' + texto.replace('"', '""') + '"'
+
+
+def _limite(limite):
+    try:
+        return max(1, min(int(limite), LIMITE_MAX))
+    except (TypeError, ValueError):
+        return LIMITE_PADRAO
+
+
+def _sql_usuarios(termo, tipo, limite):
+    sql = """
+        SELECT u.id, u.nome, u.email, u.tipo_usuario
+        FROM busca_usuarios
+        JOIN usuarios u ON u.id = busca_usuarios.rowid
+        WHERE busca_usuarios MATCH ?
+    """
+    params = [termo]
+    if tipo in TIPOS_USUARIO:
+        tipos = TIPOS_USUARIO[tipo]
+        sql += f" AND LOWER(u.tipo_usuario) IN ({', '.join('?' for _ in tipos)})"
+        params.extend(tipos)
+    sql += " ORDER BY busca_usuarios.rank, u.nome LIMIT ?"
+    params.append(_limite(limite))
+    return sql, params
+
+
+def buscar_usuarios(texto, tipo=None, limite=LIMITE_PADRAO):
+    """Usuários cujo nome ou e-mail contém `texto`, filtrados por tipo."""
+    termo = termo_fts(texto)
+    if termo is None:
+        return []
+    conn = conectar()
+    try:
+        return [dict(row) for row in conn.execute(*_sql_usuarios(termo, tipo, limite))]
+    finally:
+        conn.close()
+
+
+def _codificar_cursor(nome, usuario_id):
+    bruto = json.dumps([nome, usuario_id], ensure_ascii=False).encode("utf-8")
+    return base64.urlsafe_b64encode(bruto).decode("ascii").rstrip("=")
+
+
+def _decodificar_cursor(texto):
+    if not texto:
+        return None
+    try:
+        bruto = base64.urlsafe_b64decode(texto + "=" * (-len(texto) % 4))
+        nome, usuario_id = json.loads(bruto.decode("utf-8"))
+        return str(nome), int(usuario_id)
+    except (ValueError, TypeError):
+        return None
+
+
+def _sql_prefixo(tipo, prefixo, cursor, limite):
+    condicoes = ["tipo_busca = ?"]
+    params = [tipo]
+    prefixo = nome_busca(prefixo)
+    if prefixo:
+        # faixa [prefixo, prefixo com o último caractere seguinte) usa o índice
+        condicoes.append("nome_busca >= ? AND nome_busca < ?")
+        params.extend([prefixo, prefixo[:-1] + chr(ord(prefixo[-1]) + 1)])
+    if cursor:
+        condicoes.append("(nome_busca, id) > (?, ?)")
+        params.extend(cursor)
+    params.append(limite + 1)
+    sql = f"""SELECT id, nome, nome_busca FROM usuarios
+              WHERE {' AND '.join(condicoes)}
+              ORDER BY nome_busca, id LIMIT ?"""
+    return sql, params
+
+
+def usuarios_por_prefixo(tipo, prefixo="", apos=None, limite=LIMITE_PADRAO):
+    """
+    Página de usuários do `tipo` ('paciente', 'medico', ...) cujo nome começa
+    com `prefixo`, em ordem alfabética. `apos` é o cursor devolvido pela página
+    anterior. Retorna (itens [{id, nome}], proximo_cursor ou None).
+    """
+    limite = _limite(limite)
+    conn = conectar()
+    try:
+        linhas = conn.execute(*_sql_prefixo(tipo, prefixo, _decodificar_cursor(apos), limite)).fetchall()
+    finally:
+        conn.close()
+
+    proximo = None
+    if len(linhas) > limite:
+        linhas = linhas[:limite]
+        proximo = _codificar_cursor(linhas[-1]["nome_busca"], linhas[-1]["id"])
+    return [{"id": row["id"], "nome": row["nome"]} for row in linhas], proximo
+
+
+def usuario_por_id(usuario_id, tipo):
+    """{id, nome} do usuário do `tipo`, para pré-selecionar um seletor; None se não existe."""
+    try:
+        usuario_id = int(usuario_id)
+    except (TypeError, ValueError):
+        return None
+    conn = conectar()
+    try:
+        row = conn.execute(
+            "SELECT id, nome FROM usuarios WHERE id=? AND tipo_busca=?", (usuario_id, tipo)
+        ).fetchone()
+    finally:
+        conn.close()
+    return dict(row) if row else None
+
+
+SQL_CONVENIOS = """
+    SELECT DISTINCT a.convenio
+    FROM busca_agendamentos JOIN agendamentos a ON a.id = busca_agendamentos.rowid
+    WHERE busca_agendamentos.convenio MATCH ?
+    ORDER BY a.convenio LIMIT ?
+"""
+
+SQL_NOTAS = """
+    SELECT a.id AS agendamento_id, a.data, a.hora,
+           pac.nome AS paciente, med.nome AS medico,
+           snippet(busca_agendamentos, 1, '[', ']', '…', 64) AS trecho
+    FROM busca_agendamentos
+    JOIN agendamentos a ON a.id = busca_agendamentos.rowid
+    JOIN usuarios pac ON pac.id = a.paciente_id
+    JOIN usuarios med ON med.id = a.medico_id
+    WHERE busca_agendamentos.notas MATCH ?
+    ORDER BY a.inicio_min DESC LIMIT ?
+"""
+
+
+def buscar_convenios(texto, limite=LIMITE_PADRAO):
+    """Nomes distintos de convênio que contêm `texto`."""
+    termo = termo_fts(texto)
+    if termo is None:
+        return []
+    conn = conectar()
+    try:
+        linhas = conn.execute(SQL_CONVENIOS, (termo, _limite(limite))).fetchall()
+    finally:
+        conn.close()
+    return [row["convenio"] for row in linhas]
+
+
+def buscar_notas(texto, limite=LIMITE_PADRAO):
+    """Agendamentos cujas notas clínicas contêm `texto`, com um trecho destacado."""
+    termo = termo_fts(texto)
+    if termo is None:
+        return []
+    conn = conectar()
+    try:
+        linhas = conn.execute(SQL_NOTAS, (termo, _limite(limite))).fetchall()
+    finally:
+        conn.close()
+    return [dict(row) for row in linhas]
+
+
+def _consultas_quentes():
+    termo = termo_fts("silva")
+    consultas = {
+        "busca_convenios": (SQL_CONVENIOS, (termo, LIMITE_PADRAO)),
+        "busca_notas": (SQL_NOTAS, (termo, LIMITE_PADRAO)),
+        "busca_usuarios": _sql_usuarios(termo, None, LIMITE_PADRAO),
+        "busca_usuarios_medico": _sql_usuarios(termo, "medico", LIMITE_PADRAO),
+    }
+    for nome, prefixo, cursor in (("", "", None), ("_prefixo", "jo", None), ("_prefixo_apos", "jo", ("joao", 1))):
+        consultas[f"seletor_usuarios{nome}"] = _sql_prefixo("paciente", prefixo, cursor, LIMITE_PADRAO)
+    return consultas
+
+
+FONTES_CONSULTAS_QUENTES.append(_consultas_quentes)
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+Fluxo de eventos das chamadas de pacientes (Server-Sent Events).
+
+Os eventos (criada, encaminhada, encerrada) são gravados em
+`chamadas_eventos` por triggers, e o id de cada um é o `id:` do SSE: o
+cliente que reconecta manda Last-Event-ID e recebe o que perdeu, seja qual
+for o worker. Dentro do processo, as rotas que mexem em chamadas chamam
+`publicar()` após o commit e os fluxos abertos acordam na hora; eventos
+gravados por outro worker chegam na próxima verificação (`espera_s`).
+"""
+import json
+import threading
+import time
+
+from databaser import FONTES_CONSULTAS_QUENTES, conectar
+
+SQL_EVENTOS = """
+    SELECT e.id, e.tipo, e.chamada_id, e.medico_id, e.criado_em,
+           c.agendamento_id, a.data, a.hora,
+           pac.nome AS paciente, med.nome AS medico, s.nome AS sala, pr.nome AS procedimento
+    FROM chamadas_eventos e
+    JOIN chamadas_pacientes c ON c.id = e.chamada_id
+    JOIN agendamentos a ON a.id = c.agendamento_id
+    JOIN usuarios pac ON pac.id = c.paciente_id
+    JOIN usuarios med ON med.id = c.medico_id
+    JOIN salas s ON s.id = a.sala_id
+    JOIN procedimentos pr ON pr.id = a.procedimento_id
+    WHERE e.id > ? {filtro}
+    ORDER BY e.id
+    LIMIT ?
+"""
+SQL_EVENTOS_TODOS = SQL_EVENTOS.format(filtro="")
+SQL_EVENTOS_MEDICO = SQL_EVENTOS.format(filtro="AND e.medico_id = ?")
+
+LOTE = 100
+
+FONTES_CONSULTAS_QUENTES.append(lambda: {
+    "eventos_chamadas": (SQL_EVENTOS_TODOS, (0, LOTE)),
+    "eventos_chamadas_medico": (SQL_EVENTOS_MEDICO, (0, 1, LOTE)),
+})
+
+
+class Canal:
+    """Pub/sub do processo: só sinaliza que há eventos novos; o conteúdo vem do banco."""
+
+    def __init__(self, espera_s=15.0, duracao_max_s=300.0):
+        self.espera_s = espera_s
+        self.duracao_max_s = duracao_max_s
+        self._cond = threading.Condition()
+        self.sinal = 0
+        self.assinantes = 0
+
+    def publicar(self):
+        with self._cond:
+            self.sinal += 1
+            self._cond.notify_all()
+
+    def aguardar(self, visto, timeout):
+        """Espera até `sinal` mudar de `visto` ou o timeout. Devolve o sinal atual."""
+        with self._cond:
+            self._cond.wait_for(lambda: self.sinal != visto, timeout)
+            return self.sinal
+
+    def assinar(self, delta):
+        with self._cond:
+            self.assinantes += delta
+
+    def estatisticas(self):
+        return {"sinal": self.sinal, "assinantes": self.assinantes}
+
+
+canal = Canal()
+
+
+def init_app(app):
+    app.config.setdefault("CHAMADAS_SSE_ESPERA_S", 15)         # heartbeat / checagem de outros workers
+    app.config.setdefault("CHAMADAS_SSE_DURACAO_MAX_S", 300)  # o navegador reconecta sozinho depois
+    canal.espera_s = float(app.config["CHAMADAS_SSE_ESPERA_S"])
+    canal.duracao_max_s = float(app.config["CHAMADAS_SSE_DURACAO_MAX_S"])
+
+
+def publicar():
+    canal.publicar()
+
+
+def limites_eventos(conn=None):
+    """(menor id, maior id) ainda guardados em chamadas_eventos; (0, 0) se vazio."""
+    propria = conn is None
+    conn = conn or conectar()
+    try:
+        row = conn.execute("SELECT MIN(id), MAX(id) FROM chamadas_eventos").fetchone()
+    finally:
+        if propria:
+            conn.close()
+    return (row[0] or 0, row[1] or 0)
+
+
+def eventos_apos(apos, medico_id=None, limite=LOTE):
+    conn = conectar()
+    try:
+        if medico_id is None:
+            linhas = conn.execute(SQL_EVENTOS_TODOS, (apos, limite)).fetchall()
+        else:
+            linhas = conn.execute(SQL_EVENTOS_MEDICO, (apos, medico_id, limite)).fetchall()
+    finally:
+        conn.close()
+    return [dict(row) for row in linhas]
+
+
+def _sse(evento=None, dados=None, id_=None, comentario=None):
+    if comentario is not None:
+        return f": {comentario}\n\n"
+    linhas = []
+    if id_ is not None:
+        linhas.append(f"id: {id_}")
+    if evento:
+        linhas.append(f"event: {evento}")
+    linhas.append("data: " + json.dumps(dados if dados is not None else {}, ensure_ascii=False))
+    return "\n".join(linhas) + "\n\n"
+
+
+def fluxo(apos=None, medico_id=None):
+    """
+    Gerador do corpo text/event-stream. `apos` é o último id já visto pelo
+    cliente (None: só eventos novos). Se o cliente ficou para trás da
+    retenção recebe `reset` e deve recarregar a página. Não usa o app
+    context: cada leitura pega e devolve uma conexão do pool.
+    """
+    menor, maior = limites_eventos()
+    yield "retry: 3000\n\n"
+    if apos is None or apos > maior:
+        apos = maior
+    elif menor and apos < menor - 1:
+        yield _sse("reset", {"motivo": "eventos anteriores já descartados"}, id_=maior)
+        apos = maior
+
+    canal.assinar(1)
+    try:
+        limite_tempo = time.monotonic() + canal.duracao_max_s
+        sinal = canal.sinal
+        while time.monotonic() < limite_tempo:
+            eventos = eventos_apos(apos, medico_id)
+            for evento in eventos:
+                apos = evento["id"]
+                yield _sse(evento["tipo"], evento, id_=apos)
+            if len(eventos) == LOTE:
+                continue  # ainda há atrasados; não espera
+            novo = canal.aguardar(sinal, min(canal.espera_s, max(limite_tempo - time.monotonic(), 0)))
+            if novo == sinal:
+                yield _sse(comentario="ping")  # mantém proxies abertos e detecta desconexão
+            sinal = novo
+    finally:
+        canal.assinar(-1)
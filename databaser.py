@@ -1,19 +1,317 @@
-import sqlite3, os
+import sqlite3, os, threading, json
+import click
+from collections import deque
+from contextvars import ContextVar
+from time import perf_counter
 from werkzeug.security import generate_password_hash
-from datetime import datetime, time, timedelta
+from datetime import date, datetime, time, timedelta
+from functools import lru_cache
+from flask import g, has_app_context
+
+from ocupacao import IndiceOcupacao, SALA, MEDICO
+from normalizacao import minutos_desde_epoca, sql_nome_busca
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DB_PATH = os.path.join(BASE_DIR, 'databaser.db')
 
+# valores padrão; podem ser sobrescritos em app.config (ver init_app)
+CONFIG_PADRAO = {
+    "DB_PATH": DB_PATH,
+    "DB_POOL_SIZE": 8,                 # conexões ociosas mantidas no pool
+    "DB_BUSY_TIMEOUT_MS": 5000,        # espera por lock antes de "database is locked"
+    "DB_JOURNAL_MODE": "WAL",
+    "DB_SYNCHRONOUS": "NORMAL",
+    "DB_MMAP_SIZE": 64 * 1024 * 1024,  # bytes
+    "DB_CACHE_SIZE_KIB": 8192,         # page cache por conexão
+    "DB_CACHED_STATEMENTS": 256,       # cache de statements do módulo sqlite3
+}
+
+
+# ---------- medição de SQL por requisição ----------
+# acumulador [comandos, segundos] da requisição atual, instalado por
+# metricas.py; fora de uma requisição medida é None e nada é contado
+medicao_sql = ContextVar("medicao_sql", default=None)
+
+
+class CursorMedido(sqlite3.Cursor):
+    """
+    Cursor que soma comandos e tempo (execute + fetch) em `medicao_sql` e,
+    com rastreio_sql ligado, no Registro do comando atual deste cursor.
+    """
+    _registro = None
+
+    def _medir(self, metodo, args, comando, lote=False):
+        acc = medicao_sql.get()
+        rastreador = self.connection._rastreador
+        if acc is None and rastreador is None:
+            return metodo(self, *args)
+        if rastreador is not None:
+            if comando:
+                self._registro = rastreador.iniciar(*args, lote=lote)
+            anterior, rastreador.atual = rastreador.atual, self._registro
+        inicio = perf_counter()
+        try:
+            return metodo(self, *args)
+        finally:
+            duracao = perf_counter() - inicio
+            if acc is not None:
+                acc[0] += comando
+                acc[1] += duracao
+            if rastreador is not None:
+                rastreador.atual = anterior
+                if self._registro is not None:
+                    rastreador.concluir_trecho(self._registro, duracao)
+
+    def execute(self, *args):
+        return self._medir(sqlite3.Cursor.execute, args, 1)
+
+    def executemany(self, *args):
+        return self._medir(sqlite3.Cursor.executemany, args, 1, lote=True)
+
+    def fetchone(self):
+        return self._medir(sqlite3.Cursor.fetchone, (), 0)
+
+    def fetchmany(self, *args):
+        return self._medir(sqlite3.Cursor.fetchmany, args, 0)
+
+    def fetchall(self):
+        return self._medir(sqlite3.Cursor.fetchall, (), 0)
+
+
+# ---------- pool de conexões ----------
+# funções chamadas com cada conexão nova do pool (ex.: rastreio_sql.instalar)
+ganchos_conexao = []
+
+
+class ConexaoPool(sqlite3.Connection):
+    """
+    Conexão devolvida por `conectar()`. O `close()` não encerra a conexão:
+    dentro de um app context ela continua vinculada à requisição até o
+    teardown; fora dele volta para o pool.
+    """
+    _pool = None
+    _vinculada = False
+    _ociosa = False
+    _rastreador = None  # rastreio_sql.Rastreador quando SQL_RASTREIO está ligado
+
+    # execute/executemany do sqlite3.Connection criam o cursor em C, sem
+    # passar por cursor(); redirecionados para contar em CursorMedido
+    def cursor(self, factory=CursorMedido):
+        return super().cursor(factory)
+
+    def execute(self, *args):
+        return self.cursor().execute(*args)
+
+    def executemany(self, *args):
+        return self.cursor().executemany(*args)
+
+    def close(self):
+        if self._vinculada or self._ociosa:
+            return
+        if self._pool is not None:
+            self._pool.devolver(self)
+        else:
+            self.fechar()
+
+    def fechar(self):
+        sqlite3.Connection.close(self)
+
+
+class PoolConexoes:
+    def __init__(self, config=None):
+        self.config = dict(CONFIG_PADRAO)
+        if config:
+            self.config.update(config)
+        self._ociosas = deque()
+        self._lock = threading.Lock()
+
+    def _abrir(self):
+        cfg = self.config
+        conn = sqlite3.connect(
+            cfg["DB_PATH"],
+            timeout=cfg["DB_BUSY_TIMEOUT_MS"] / 1000,
+            cached_statements=cfg["DB_CACHED_STATEMENTS"],
+            check_same_thread=False,
+            factory=ConexaoPool,
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute(f"PRAGMA journal_mode={cfg['DB_JOURNAL_MODE']}")
+        conn.execute(f"PRAGMA synchronous={cfg['DB_SYNCHRONOUS']}")
+        conn.execute(f"PRAGMA busy_timeout={int(cfg['DB_BUSY_TIMEOUT_MS'])}")
+        conn.execute(f"PRAGMA mmap_size={int(cfg['DB_MMAP_SIZE'])}")
+        conn.execute(f"PRAGMA cache_size=-{int(cfg['DB_CACHE_SIZE_KIB'])}")
+        conn._pool = self
+        for gancho in ganchos_conexao:
+            gancho(conn)
+        return conn
+
+    def obter(self):
+        with self._lock:
+            conn = self._ociosas.pop() if self._ociosas else None
+        if conn is None:
+            return self._abrir()
+        conn._ociosa = False
+        return conn
+
+    def devolver(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        conn._vinculada = False
+        with self._lock:
+            if len(self._ociosas) < self.config["DB_POOL_SIZE"]:
+                conn._ociosa = True
+                self._ociosas.append(conn)
+                return
+        conn.fechar()
+
+    def fechar_todas(self):
+        with self._lock:
+            ociosas, self._ociosas = list(self._ociosas), deque()
+        for conn in ociosas:
+            conn.fechar()
+
+
+_pool = PoolConexoes()
+
+
+def configurar_pool(config=None):
+    """Recria o pool global com as chaves DB_* informadas."""
+    global _pool
+    antigo = _pool
+    _pool = PoolConexoes(config)
+    antigo.fechar_todas()
+    return _pool
+
+
 def conectar():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
+    """
+    Devolve a conexão da requisição atual (uma por app context, reaproveitada
+    por todas as chamadas, inclusive `horarios_disponiveis`). Fora de um app
+    context devolve uma conexão do pool, que retorna a ele no `close()`.
+    """
+    if not has_app_context():
+        return _pool.obter()
+    conn = g.get("_db_conn")
+    if conn is None:
+        conn = _pool.obter()
+        conn._vinculada = True
+        g._db_conn = conn
     return conn
 
-def criar_tabelas():
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
 
+def liberar_conexao(_exc=None):
+    conn = g.pop("_db_conn", None)
+    if conn is not None:
+        conn._pool.devolver(conn)
+
+
+def init_app(app):
+    for chave, valor in CONFIG_PADRAO.items():
+        app.config.setdefault(chave, valor)
+    configurar_pool({chave: app.config[chave] for chave in CONFIG_PADRAO})
+    app.teardown_appcontext(liberar_conexao)
+
+    app.config.setdefault("OCUPACAO_CAPACIDADE", 4096)  # entradas (recurso, dia)
+    app.config.setdefault("OCUPACAO_TTL_S", 30)          # limite de defasagem entre workers
+    ocupacao.capacidade = app.config["OCUPACAO_CAPACIDADE"]
+    ocupacao.ttl_s = app.config["OCUPACAO_TTL_S"]
+    ocupacao.invalidar()
+
+    @app.cli.command("migrar")
+    def migrar_comando():
+        """Aplica as migrações de schema pendentes."""
+        aplicadas = migrar()
+        if aplicadas:
+            click.echo(f"Migrações aplicadas: {', '.join(map(str, aplicadas))}")
+        click.echo(f"Schema na versão {versao_schema_atual()}.")
+
+    @app.cli.command("verificar-planos")
+    def verificar_planos_comando():
+        """Falha se alguma consulta quente cair em SCAN completo."""
+        falhas = verificar_planos()
+        for nome, linhas in falhas.items():
+            click.echo(f"[SCAN] {nome}: {'; '.join(linhas)}", err=True)
+        if falhas:
+            raise SystemExit(1)
+        click.echo(f"{len(consultas_quentes())} consultas verificadas, nenhuma com SCAN completo.")
+
+    @app.cli.command("recalcular-resumos")
+    def recalcular_resumos_comando():
+        """Reconstrói os contadores dos painéis a partir de agendamentos."""
+        click.echo(f"resumo_diario reconstruído com {recalcular_resumos()} linha(s).")
+
+
+# ---------- migrações de schema ----------
+# Cada passo roda uma única vez, em ordem, e fica registrado em schema_version.
+# Rotas nunca executam DDL: o schema é preparado no boot (main.py) ou via
+# `flask --app main migrar`.
+MIGRACOES = []
+
+
+def migracao(versao, descricao):
+    def registrar(fn):
+        MIGRACOES.append((versao, descricao, fn))
+        MIGRACOES.sort(key=lambda item: item[0])
+        return fn
+    return registrar
+
+
+def versao_schema(conn):
+    existe = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='schema_version'"
+    ).fetchone()
+    if not existe:
+        return 0
+    return conn.execute("SELECT COALESCE(MAX(versao), 0) FROM schema_version").fetchone()[0]
+
+
+def migrar(pool=None):
+    """
+    Aplica as migrações pendentes numa transação BEGIN IMMEDIATE (segura com
+    vários workers subindo ao mesmo tempo). Retorna a lista de versões aplicadas.
+    `pool` permite migrar outro banco (ex.: bancos temporários de ferramentas).
+    """
+    conn = (pool or _pool).obter()
+    aplicadas = []
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        cur = conn.cursor()
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS schema_version (
+                versao INTEGER PRIMARY KEY,
+                descricao TEXT NOT NULL,
+                aplicado_em TEXT NOT NULL
+            )
+        """)
+        atual = versao_schema(conn)
+        for versao, descricao, passo in MIGRACOES:
+            if versao <= atual:
+                continue
+            passo(cur)
+            cur.execute(
+                "INSERT INTO schema_version (versao, descricao, aplicado_em) VALUES (?, ?, ?)",
+                (versao, descricao, datetime.utcnow().isoformat()),
+            )
+            aplicadas.append(versao)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return aplicadas
+
+
+def versao_schema_atual():
+    conn = _pool.obter()
+    try:
+        return versao_schema(conn)
+    finally:
+        conn.close()
+
+
+@migracao(1, "estrutura inicial, colunas legadas e seeds")
+def _m001_estrutura_inicial(cur):
     # --- tabelas base ---
     cur.execute('''
         CREATE TABLE IF NOT EXISTS usuarios (
@@ -123,10 +421,795 @@ def criar_tabelas():
             ("Recepcionista Master", "recepcionistamaster@gmail.com", generate_password_hash("12345"), "recepcionista master")
         )
 
-    conn.commit()
+@migracao(2, "índices compostos de agendamentos")
+def _m002_indices_agendamentos(cur):
+    # conflito/ocupação por sala e por médico no dia (cobrem `hora` + rowid)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_agendamentos_sala_data_hora ON agendamentos(sala_id, data, hora)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_agendamentos_medico_data_hora ON agendamentos(medico_id, data, hora)")
+    # agenda do paciente já ordenada por data/hora
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_agendamentos_paciente_data_hora ON agendamentos(paciente_id, data, hora)")
+    # filtros por período e ORDER BY data, hora dos relatórios/painéis
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_agendamentos_data_hora ON agendamentos(data, hora)")
+    cur.execute("ANALYZE agendamentos")
+
+
+@migracao(3, "unicidade de horário por sala e por médico")
+def _m003_unicidade_horario(cur):
+    # bases antigas podem ter horários duplicados (o agendamento pela recepção
+    # nunca checou o médico). O primeiro agendamento de cada slot continua
+    # protegido; os demais ficam marcados como conflito_legado e fora dos
+    # índices únicos até serem remarcados.
+    cur.execute("ALTER TABLE agendamentos ADD COLUMN conflito_legado INTEGER NOT NULL DEFAULT 0")
+    for coluna in ("sala_id", "medico_id"):
+        cur.execute(f"""
+            UPDATE agendamentos SET conflito_legado=1
+            WHERE status <> 'cancelado' AND id NOT IN (
+                SELECT MIN(id) FROM agendamentos WHERE status <> 'cancelado'
+                GROUP BY {coluna}, data, hora
+            )
+        """)
+    cur.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS uq_agendamentos_sala_horario
+        ON agendamentos(sala_id, data, hora) WHERE status <> 'cancelado' AND conflito_legado = 0
+    """)
+    cur.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS uq_agendamentos_medico_horario
+        ON agendamentos(medico_id, data, hora) WHERE status <> 'cancelado' AND conflito_legado = 0
+    """)
+
+
+@migracao(4, "contadores dos painéis mantidos por triggers")
+def _m004_resumos(cur):
+    # contagem por dia/médico/status (painéis do dia) e por médico/status
+    # (totais históricos); status guardado já em minúsculas
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS resumo_diario (
+            data TEXT NOT NULL,
+            medico_id INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            total INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (data, medico_id, status)
+        ) WITHOUT ROWID
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS resumo_medico (
+            medico_id INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            total INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (medico_id, status)
+        ) WITHOUT ROWID
+    """)
+    # ranking de concluídos por médico no painel da recepção
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_resumo_medico_status ON resumo_medico(status, total)")
+    for nome, sql in TRIGGERS_RESUMO.items():
+        cur.execute(f"DROP TRIGGER IF EXISTS {nome}")
+        cur.execute(sql)
+    _recalcular_resumos(cur)
+
+
+def _resumo_delta(ref, delta):
+    return f"""
+        INSERT INTO resumo_diario (data, medico_id, status, total)
+        VALUES ({ref}.data, {ref}.medico_id, LOWER({ref}.status), {delta})
+        ON CONFLICT (data, medico_id, status) DO UPDATE SET total = total + ({delta});
+        INSERT INTO resumo_medico (medico_id, status, total)
+        VALUES ({ref}.medico_id, LOWER({ref}.status), {delta})
+        ON CONFLICT (medico_id, status) DO UPDATE SET total = total + ({delta});
+    """
+
+
+TRIGGERS_RESUMO = {
+    "trg_resumo_insert": f"""
+        CREATE TRIGGER trg_resumo_insert AFTER INSERT ON agendamentos
+        BEGIN {_resumo_delta("NEW", 1)} END
+    """,
+    "trg_resumo_delete": f"""
+        CREATE TRIGGER trg_resumo_delete AFTER DELETE ON agendamentos
+        BEGIN {_resumo_delta("OLD", -1)} END
+    """,
+    "trg_resumo_update": f"""
+        CREATE TRIGGER trg_resumo_update AFTER UPDATE OF data, medico_id, status ON agendamentos
+        WHEN OLD.data IS NOT NEW.data OR OLD.medico_id IS NOT NEW.medico_id
+             OR LOWER(OLD.status) IS NOT LOWER(NEW.status)
+        BEGIN {_resumo_delta("OLD", -1)} {_resumo_delta("NEW", 1)} END
+    """,
+}
+
+
+def _recalcular_resumos(cur):
+    cur.execute("DELETE FROM resumo_diario")
+    cur.execute("DELETE FROM resumo_medico")
+    cur.execute("""
+        INSERT INTO resumo_diario (data, medico_id, status, total)
+        SELECT data, medico_id, LOWER(status), COUNT(*)
+        FROM agendamentos GROUP BY data, medico_id, LOWER(status)
+    """)
+    cur.execute("""
+        INSERT INTO resumo_medico (medico_id, status, total)
+        SELECT medico_id, status, SUM(total) FROM resumo_diario GROUP BY medico_id, status
+    """)
+
+
+def recalcular_resumos():
+    """Reconstrói resumo_diario/resumo_medico a partir de agendamentos (backfill)."""
+    conn = _pool.obter()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        _recalcular_resumos(conn.cursor())
+        conn.commit()
+        return conn.execute("SELECT COUNT(*) FROM resumo_diario").fetchone()[0]
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+@migracao(5, "versões das listas de referência (cache entre processos)")
+def _m005_versoes_cache(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS versoes_cache (
+            nome TEXT PRIMARY KEY,
+            versao INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    """)
+    for nome in ("usuarios", "procedimentos", "salas", "convenios"):
+        cur.execute("INSERT OR IGNORE INTO versoes_cache (nome, versao) VALUES (?, 0)", (nome,))
+
+    incrementa = "UPDATE versoes_cache SET versao = versao + 1 WHERE nome = '{}';"
+    for tabela in ("usuarios", "procedimentos", "salas"):
+        for evento in ("INSERT", "UPDATE", "DELETE"):
+            nome = f"trg_versao_{tabela}_{evento.lower()}"
+            cur.execute(f"DROP TRIGGER IF EXISTS {nome}")
+            cur.execute(f"""
+                CREATE TRIGGER {nome} AFTER {evento} ON {tabela}
+                BEGIN {incrementa.format(tabela)} END
+            """)
+    gatilhos_convenio = {
+        "trg_versao_convenio_insert": "AFTER INSERT ON agendamentos WHEN NEW.convenio IS NOT NULL",
+        "trg_versao_convenio_update": "AFTER UPDATE OF convenio ON agendamentos WHEN OLD.convenio IS NOT NEW.convenio",
+        "trg_versao_convenio_delete": "AFTER DELETE ON agendamentos WHEN OLD.convenio IS NOT NULL",
+    }
+    for nome, quando in gatilhos_convenio.items():
+        cur.execute(f"DROP TRIGGER IF EXISTS {nome}")
+        cur.execute(f"CREATE TRIGGER {nome} {quando} BEGIN {incrementa.format('convenios')} END")
+    # SELECT DISTINCT convenio passa a percorrer só o índice
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_agendamentos_convenio ON agendamentos(convenio)")
+
+
+@migracao(6, "validação de data/hora/status na escrita e progresso do reparo offline")
+def _m006_validacao_agendamentos(cur):
+    # checkpoint do `flask --app main reparar-agendamentos` (retomável)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS reparo_progresso (
+            nome TEXT PRIMARY KEY,
+            ultimo_id INTEGER NOT NULL DEFAULT 0,
+            atualizado_em TEXT
+        )
+    """)
+    # linhas legadas continuam legíveis; só valores novos/alterados são checados
+    data_invalida = "NEW.data NOT GLOB '[0-9][0-9][0-9][0-9]-[0-1][0-9]-[0-3][0-9]'"
+    hora_invalida = "NEW.hora NOT GLOB '[0-2][0-9]:[0-5][0-9]'"
+    status_invalido = "NEW.status NOT IN ('agendado', 'em atendimento', 'concluido', 'cancelado')"
+    corpo = f"""
+        SELECT CASE
+            WHEN {{data}} THEN RAISE(ABORT, 'agendamentos.data inválida (esperado AAAA-MM-DD)')
+            WHEN {{hora}} THEN RAISE(ABORT, 'agendamentos.hora inválida (esperado HH:MM)')
+            WHEN {{status}} THEN RAISE(ABORT, 'agendamentos.status inválido')
+        END;
+    """
+    cur.execute("DROP TRIGGER IF EXISTS trg_valida_agendamento_insert")
+    cur.execute(f"""
+        CREATE TRIGGER trg_valida_agendamento_insert BEFORE INSERT ON agendamentos
+        BEGIN {corpo.format(data=data_invalida, hora=hora_invalida, status=status_invalido)} END
+    """)
+    cur.execute("DROP TRIGGER IF EXISTS trg_valida_agendamento_update")
+    cur.execute(f"""
+        CREATE TRIGGER trg_valida_agendamento_update BEFORE UPDATE OF data, hora, status ON agendamentos
+        BEGIN {corpo.format(
+            data=f"NEW.data IS NOT OLD.data AND {data_invalida}",
+            hora=f"NEW.hora IS NOT OLD.hora AND {hora_invalida}",
+            status=f"NEW.status IS NOT OLD.status AND {status_invalido}",
+        )} END
+    """)
+
+
+@migracao(7, "versão de dados de agendamentos (ETag de relatórios e disponibilidade)")
+def _m007_versao_agendamentos(cur):
+    cur.execute("INSERT OR IGNORE INTO versoes_cache (nome, versao) VALUES ('agendamentos', 0)")
+    incrementa = "UPDATE versoes_cache SET versao = versao + 1 WHERE nome = 'agendamentos';"
+    # notas e marcações internas não mudam relatórios nem horários livres
+    gatilhos = {
+        "trg_versao_agendamentos_insert": "AFTER INSERT ON agendamentos",
+        "trg_versao_agendamentos_update": (
+            "AFTER UPDATE OF paciente_id, medico_id, procedimento_id, sala_id, "
+            "data, hora, status, convenio ON agendamentos"
+        ),
+        "trg_versao_agendamentos_delete": "AFTER DELETE ON agendamentos",
+    }
+    for nome, quando in gatilhos.items():
+        cur.execute(f"DROP TRIGGER IF EXISTS {nome}")
+        cur.execute(f"CREATE TRIGGER {nome} {quando} BEGIN {incrementa} END")
+
+
+@migracao(8, "status_codigo: código inteiro gerado a partir de status, indexado com a data")
+def _m008_status_codigo(cur):
+    # coluna VIRTUAL: as gravações continuam escrevendo só `status`; o código
+    # segue a ordem de normalizacao.STATUS_AGENDAMENTO e é NULL para valores
+    # legados ainda não reparados
+    colunas = {row[1] for row in cur.execute("PRAGMA table_xinfo(agendamentos)")}
+    if "status_codigo" not in colunas:
+        cur.execute("""
+            ALTER TABLE agendamentos ADD COLUMN status_codigo INTEGER
+            GENERATED ALWAYS AS (CASE LOWER(TRIM(status))
+                WHEN 'agendado' THEN 0
+                WHEN 'em atendimento' THEN 1
+                WHEN 'concluido' THEN 2
+                WHEN 'cancelado' THEN 3
+            END) VIRTUAL
+        """)
+    # totais de relatório por período (GROUP BY status_codigo) só leem o índice
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_agendamentos_data_status ON agendamentos(data, status_codigo)")
+
+
+@migracao(9, "inicio_min: início do agendamento em minutos, base de filtros, ordenação e conflitos")
+def _m009_inicio_min(cur):
+    # coluna VIRTUAL calculada de data/hora (normalizacao.minutos_desde_epoca);
+    # NULL para legados ainda não reparados. Nenhuma escrita precisa mudar e as
+    # linhas existentes entram nos índices ao criá-los.
+    colunas = {row[1] for row in cur.execute("PRAGMA table_xinfo(agendamentos)")}
+    if "inicio_min" not in colunas:
+        cur.execute("""
+            ALTER TABLE agendamentos ADD COLUMN inicio_min INTEGER
+            GENERATED ALWAYS AS (CAST(strftime('%s', data || ' ' || hora) AS INTEGER) / 60) VIRTUAL
+        """)
+
+    # horários que só diferiam no texto ('09:00' x '09:00 ') passam a colidir:
+    # mantém o primeiro de cada slot, como na migração 3
+    for coluna in ("sala_id", "medico_id"):
+        cur.execute(f"""
+            UPDATE agendamentos SET conflito_legado=1
+            WHERE status <> 'cancelado' AND conflito_legado = 0 AND inicio_min IS NOT NULL
+              AND id NOT IN (
+                SELECT MIN(id) FROM agendamentos
+                WHERE status <> 'cancelado' AND conflito_legado = 0 AND inicio_min IS NOT NULL
+                GROUP BY {coluna}, inicio_min
+            )
+        """)
+
+    for antigo in ("uq_agendamentos_sala_horario", "uq_agendamentos_medico_horario",
+                   "idx_agendamentos_sala_data_hora", "idx_agendamentos_medico_data_hora",
+                   "idx_agendamentos_paciente_data_hora", "idx_agendamentos_data_hora",
+                   "idx_agendamentos_data_status"):
+        cur.execute(f"DROP INDEX IF EXISTS {antigo}")
+
+    cur.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS uq_agendamentos_sala_inicio
+        ON agendamentos(sala_id, inicio_min) WHERE status <> 'cancelado' AND conflito_legado = 0
+    """)
+    cur.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS uq_agendamentos_medico_inicio
+        ON agendamentos(medico_id, inicio_min) WHERE status <> 'cancelado' AND conflito_legado = 0
+    """)
+    # ocupação por sala/médico e agenda do paciente/médico, já ordenadas
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_agendamentos_sala_inicio ON agendamentos(sala_id, inicio_min)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_agendamentos_medico_inicio ON agendamentos(medico_id, inicio_min)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_agendamentos_paciente_inicio ON agendamentos(paciente_id, inicio_min)")
+    # períodos dos relatórios/painéis: seek, ORDER BY e totais por status só no índice
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_agendamentos_inicio_status ON agendamentos(inicio_min, status_codigo)")
+
+
+@migracao(10, "busca textual FTS5 (trigram) em usuários, convênios e notas")
+def _m010_busca_fts(cur):
+    # tabelas de conteúdo externo: o índice guarda só os trigramas, o texto
+    # continua em usuarios/agendamentos; triggers mantêm o índice em dia
+    indices = {
+        "busca_usuarios": ("usuarios", ("nome", "email")),
+        "busca_agendamentos": ("agendamentos", ("convenio", "notas")),
+    }
+    for indice, (tabela, colunas) in indices.items():
+        lista = ", ".join(colunas)
+        novos = ", ".join(f"NEW.{c}" for c in colunas)
+        velhos = ", ".join(f"OLD.{c}" for c in colunas)
+        cur.execute(f"""
+            CREATE VIRTUAL TABLE IF NOT EXISTS {indice} USING fts5(
+                {lista}, content='{tabela}', content_rowid='id', tokenize='trigram'
+            )
+        """)
+        remove = f"INSERT INTO {indice}({indice}, rowid, {lista}) VALUES ('delete', OLD.id, {velhos});"
+        insere = f"INSERT INTO {indice}(rowid, {lista}) VALUES (NEW.id, {novos});"
+        gatilhos = {
+            f"trg_{indice}_insert": (f"AFTER INSERT ON {tabela}", insere),
+            f"trg_{indice}_delete": (f"AFTER DELETE ON {tabela}", remove),
+            f"trg_{indice}_update": (f"AFTER UPDATE OF {lista} ON {tabela}", remove + insere),
+        }
+        for nome, (quando, corpo) in gatilhos.items():
+            cur.execute(f"DROP TRIGGER IF EXISTS {nome}")
+            cur.execute(f"CREATE TRIGGER {nome} {quando} BEGIN {corpo} END")
+        cur.execute(f"INSERT INTO {indice}({indice}) VALUES ('rebuild')")
+
+
+@migracao(11, "nome_busca/tipo_busca em usuarios para seleção por prefixo")
+def _m011_nome_busca(cur):
+    # colunas VIRTUAL: cadastro e edição de usuários não mudam
+    colunas = {row[1] for row in cur.execute("PRAGMA table_xinfo(usuarios)")}
+    if "nome_busca" not in colunas:
+        cur.execute(f"""
+            ALTER TABLE usuarios ADD COLUMN nome_busca TEXT
+            GENERATED ALWAYS AS ({sql_nome_busca('nome')}) VIRTUAL
+        """)
+    if "tipo_busca" not in colunas:
+        # 'Médico'/'médico'/'medico' -> 'medico'
+        cur.execute("""
+            ALTER TABLE usuarios ADD COLUMN tipo_busca TEXT
+            GENERATED ALWAYS AS (REPLACE(REPLACE(LOWER(TRIM(tipo_usuario)), 'é', 'e'), 'É', 'e')) VIRTUAL
+        """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_usuarios_tipo_nome_busca ON usuarios(tipo_busca, nome_busca)")
+
+
+CHAMADAS_EVENTOS_RETIDOS = 5000  # eventos mais antigos são descartados
+
+
+@migracao(12, "chamadas_eventos: log de chamadas de pacientes para o fluxo SSE")
+def _m012_chamadas_eventos(cur):
+    # log alimentado por triggers: o id do evento é o `id:` do SSE, então
+    # qualquer worker retoma um cliente a partir do Last-Event-ID
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS chamadas_eventos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chamada_id INTEGER NOT NULL,
+            medico_id INTEGER NOT NULL,
+            tipo TEXT NOT NULL, -- criada|encaminhada|encerrada
+            criado_em TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%S', 'now')),
+            FOREIGN KEY (chamada_id) REFERENCES chamadas_pacientes (id)
+        )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_chamadas_eventos_medico ON chamadas_eventos(medico_id, id)")
+
+    gatilhos = {
+        "trg_chamadas_evento_criada": (
+            "AFTER INSERT ON chamadas_pacientes",
+            "INSERT INTO chamadas_eventos (chamada_id, medico_id, tipo) VALUES (NEW.id, NEW.medico_id, 'criada');",
+        ),
+        "trg_chamadas_evento_status": (
+            """AFTER UPDATE OF status ON chamadas_pacientes
+               WHEN NEW.status IS NOT OLD.status AND NEW.status IN ('encaminhado', 'encerrado')""",
+            """INSERT INTO chamadas_eventos (chamada_id, medico_id, tipo)
+               VALUES (NEW.id, NEW.medico_id, CASE NEW.status WHEN 'encaminhado' THEN 'encaminhada' ELSE 'encerrada' END);""",
+        ),
+        # consulta concluída ou cancelada encerra a chamada que ainda estava aberta
+        "trg_chamadas_encerrar": (
+            """AFTER UPDATE OF status ON agendamentos
+               WHEN NEW.status IS NOT OLD.status AND NEW.status IN ('concluido', 'cancelado')""",
+            """UPDATE chamadas_pacientes SET status='encerrado'
+               WHERE agendamento_id=NEW.id AND status IN ('pendente', 'encaminhado');""",
+        ),
+        "trg_chamadas_eventos_retencao": (
+            "AFTER INSERT ON chamadas_eventos",
+            f"DELETE FROM chamadas_eventos WHERE id <= NEW.id - {CHAMADAS_EVENTOS_RETIDOS};",
+        ),
+    }
+    for nome, (quando, corpo) in gatilhos.items():
+        cur.execute(f"DROP TRIGGER IF EXISTS {nome}")
+        cur.execute(f"CREATE TRIGGER {nome} {quando} BEGIN {corpo} END")
+
+
+@migracao(13, "índice (medico_id, agendamento_id) em chamadas_pacientes")
+def _m013_chamadas_medico_agendamento(cur):
+    # chamada mais recente de cada consulta do dia na agenda do médico
+    # (MAX(id) sai do fim do intervalo do índice, que já inclui o rowid)
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_chamadas_medico_agendamento "
+        "ON chamadas_pacientes(medico_id, agendamento_id)"
+    )
+
+
+@migracao(14, "índice (procedimento_id, status_codigo) para os totais filtrados por procedimento")
+def _m014_procedimento_status(cur):
+    # totais da recepção filtrados só por procedimento: GROUP BY no próprio índice
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_agendamentos_procedimento_status "
+        "ON agendamentos(procedimento_id, status_codigo)"
+    )
+
+
+@migracao(15, "índices de agendamento_ajustes por agendamento e por status")
+def _m015_ajustes_indices(cur):
+    # ajustes do paciente (via agendamentos dele) e fila de pendentes da recepção
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_agendamento_ajustes_agendamento "
+        "ON agendamento_ajustes(agendamento_id)"
+    )
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_agendamento_ajustes_status ON agendamento_ajustes(status, id)")
+
+
+# ---------- versões de dados ----------
+def versoes_dados(conn=None):
+    """
+    {nome: versão} de `versoes_cache`, incrementadas por triggers a cada
+    escrita. Dentro de uma requisição são lidas uma única vez.
+    """
+    if has_app_context() and "_versoes_cache" in g:
+        return g._versoes_cache
+    propria = conn is None
+    conn = conn or conectar()
+    try:
+        versoes = {row["nome"]: row["versao"] for row in conn.execute("SELECT nome, versao FROM versoes_cache")}
+    finally:
+        if propria:
+            conn.close()
+    if has_app_context():
+        g._versoes_cache = versoes
+    return versoes
+
+
+# ---------- verificação de planos das consultas quentes ----------
+# intervalos em inicio_min são semiabertos: [início, fim)
+SQL_HORARIOS_OCUPADOS = """
+    SELECT 's' AS tipo, id, data, hora FROM agendamentos
+    WHERE sala_id=? AND inicio_min >= ? AND inicio_min < ? AND status <> 'cancelado'
+    UNION ALL
+    SELECT 'm' AS tipo, id, data, hora FROM agendamentos
+    WHERE medico_id=? AND inicio_min >= ? AND inicio_min < ? AND status <> 'cancelado'
+"""
+
+SQL_CONFLITO_PACIENTE = """
+    SELECT 1 FROM agendamentos
+    WHERE paciente_id=? AND inicio_min=? AND status <> 'cancelado'
+"""
+
+# horários já marcados para o paciente num intervalo (alternativas de série)
+SQL_OCUPADOS_PACIENTE = """
+    SELECT inicio_min FROM agendamentos
+    WHERE paciente_id=? AND inicio_min >= ? AND inicio_min < ? AND status <> 'cancelado'
+"""
+
+# totais sem filtro da recepção: somados dos contadores que os triggers
+# mantêm em resumo_medico (status em minúsculas, sem TRIM; o código sai de
+# normalizacao.STATUS_CODIGO como na coluna gerada status_codigo)
+SQL_TOTAIS_GERAIS = """
+    SELECT status, SUM(total) AS total FROM resumo_medico GROUP BY status
+"""
+
+# conflitos de todas as datas de uma série numa consulta só: as datas vão
+# como array JSON de inicio_min e cada lado do UNION ALL faz busca pontual no
+# próprio índice (sala_id|medico_id|paciente_id, inicio_min)
+SQL_CONFLITOS_SERIE = """
+    WITH alvo(inicio_min) AS (SELECT value FROM json_each(?))
+    SELECT 'sala' AS recurso, alvo.inicio_min FROM alvo
+    JOIN agendamentos a ON a.sala_id=? AND a.inicio_min=alvo.inicio_min AND a.status <> 'cancelado'
+    UNION ALL
+    SELECT 'medico' AS recurso, alvo.inicio_min FROM alvo
+    JOIN agendamentos a ON a.medico_id=? AND a.inicio_min=alvo.inicio_min AND a.status <> 'cancelado'
+    UNION ALL
+    SELECT 'paciente' AS recurso, alvo.inicio_min FROM alvo
+    JOIN agendamentos a ON a.paciente_id=? AND a.inicio_min=alvo.inicio_min AND a.status <> 'cancelado'
+"""
+
+# agenda do médico no dia + contadores do painel numa única passada: a
+# linha-base `t` garante um resultado mesmo sem consultas no dia; a chamada
+# mais recente de cada agendamento vem por busca pontual no índice
+# (medico_id, agendamento_id), limitada às consultas do próprio dia
+SQL_AGENDA_MEDICO_DIA = """
+    SELECT t.concluidos_totais, t.ultimo_evento, d.*
+    FROM (
+        SELECT COALESCE(MAX(total), 0) AS concluidos_totais,
+               (SELECT COALESCE(MAX(id), 0) FROM chamadas_eventos) AS ultimo_evento
+        FROM resumo_medico WHERE medico_id = :medico AND status = 'concluido'
+    ) t
+    LEFT JOIN (
+        SELECT a.id, a.data, a.hora, a.inicio_min, a.status, a.status_codigo, a.notas, a.convenio,
+               pac.nome AS paciente, pr.nome AS procedimento, s.nome AS sala,
+               c.status AS chamada_status, c.criado_em AS chamada_criada,
+               c.encaminhado_em AS chamada_encaminhada,
+               COUNT(*) OVER () AS total_hoje,
+               SUM(a.status_codigo = :concluido) OVER () AS concluidos_hoje,
+               SUM(a.status_codigo = :cancelado) OVER () AS cancelados_hoje
+        FROM agendamentos a
+        JOIN usuarios pac ON pac.id = a.paciente_id
+        JOIN procedimentos pr ON pr.id = a.procedimento_id
+        JOIN salas s ON s.id = a.sala_id
+        LEFT JOIN chamadas_pacientes c ON c.id = (
+            SELECT MAX(cc.id) FROM chamadas_pacientes cc
+            WHERE cc.medico_id = a.medico_id AND cc.agendamento_id = a.id
+        )
+        WHERE a.medico_id = :medico AND a.inicio_min >= :inicio AND a.inicio_min < :fim
+    ) d ON 1
+    ORDER BY d.inicio_min, d.id
+"""
+
+# nome -> (sql, parâmetros de exemplo) das consultas definidas neste módulo
+CONSULTAS_QUENTES = {
+    "horarios_disponiveis": (
+        SQL_HORARIOS_OCUPADOS,
+        (1, 28928160, 28972800, 1, 28928160, 28972800),
+    ),
+    "conflito_paciente": (
+        SQL_CONFLITO_PACIENTE,
+        (1, 28928640),
+    ),
+    "ocupados_paciente": (
+        SQL_OCUPADOS_PACIENTE,
+        (1, 28928160, 28972800),
+    ),
+    "conflitos_serie": (
+        SQL_CONFLITOS_SERIE,
+        ("[28928640, 28938720, 28948800]", 1, 1, 1),
+    ),
+    "visao_medico": (
+        SQL_AGENDA_MEDICO_DIA,
+        {"medico": 1, "inicio": 28928160, "fim": 28929600, "concluido": 2, "cancelado": 3},
+    ),
+}
+
+# módulos que montam SQL (rotas, busca, chamadas) registram aqui funções que
+# devolvem {nome: (sql, parâmetros)} geradas pelos próprios construtores,
+# para o gate verificar o SQL que de fato roda e não uma cópia
+FONTES_CONSULTAS_QUENTES = []
+
+
+def consultas_quentes():
+    """CONSULTAS_QUENTES mais as consultas de FONTES_CONSULTAS_QUENTES."""
+    consultas = dict(CONSULTAS_QUENTES)
+    for fonte in FONTES_CONSULTAS_QUENTES:
+        consultas.update(fonte())
+    return consultas
+
+
+def _scan_completo(detalhe, derivadas=()):
+    # "SCAN a" é varredura da tabela; "SCAN a USING [COVERING] INDEX ..." não.
+    # Percorrer uma subconsulta já materializada (ou co-rotina) também não:
+    # o acesso às tabelas dela aparece nas próprias linhas do plano.
+    if not detalhe.startswith("SCAN ") or "INDEX" in detalhe or "CONSTANT ROW" in detalhe:
+        return False
+    alvo = detalhe.split()[1]
+    return alvo not in derivadas and not alvo.startswith("(subquery")
+
+
+def verificar_planos(conn=None):
+    """
+    Roda EXPLAIN QUERY PLAN em cada consulta de consultas_quentes() e devolve
+    {nome: [linhas do plano com SCAN completo]} apenas para as que degradaram.
+    """
+    proprio = conn is None
+    if proprio:
+        conn = _pool.obter()
+    falhas = {}
+    try:
+        for nome, (sql, params) in consultas_quentes().items():
+            plano = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+            derivadas = {
+                linha.split()[1] for linha in plano if linha.startswith(("CO-ROUTINE ", "MATERIALIZE "))
+            }
+            scans = [linha for linha in plano if _scan_completo(linha, derivadas)]
+            if scans:
+                falhas[nome] = scans
+    finally:
+        if proprio:
+            conn.close()
+    return falhas
+
+
+# ---------- reserva atômica ----------
+class ConflitoHorario(Exception):
+    """Slot já ocupado; `recurso` é 'sala', 'medico' ou 'paciente'."""
+
+    def __init__(self, recurso):
+        super().__init__(recurso)
+        self.recurso = recurso
+
+
+# o SQLite cita as colunas do índice (ou o nome, em índices de expressão)
+_INDICES_HORARIO = (
+    ("agendamentos.sala_id, agendamentos.inicio_min", "sala"),
+    ("uq_agendamentos_sala_inicio", "sala"),
+    ("agendamentos.medico_id, agendamentos.inicio_min", "medico"),
+    ("uq_agendamentos_medico_inicio", "medico"),
+)
+
+
+def recurso_em_conflito(erro):
+    """
+    'sala'/'medico' se o IntegrityError veio de um dos índices únicos de
+    horário; None para qualquer outra violação (NOT NULL, FK, outro UNIQUE).
+    """
+    mensagem = str(erro)
+    if not mensagem.startswith("UNIQUE constraint failed"):
+        return None
+    for assinatura, recurso in _INDICES_HORARIO:
+        if assinatura in mensagem:
+            return recurso
+    return None
+
+
+def inserir_agendamento(conn, paciente_id, medico_id, procedimento_id, sala_id, data, hora,
+                        convenio=None, checar_paciente=False):
+    """
+    Insere o agendamento numa transação BEGIN IMMEDIATE. A unicidade de sala e
+    médico é garantida pelos índices únicos parciais; a do paciente (opcional)
+    é checada dentro da mesma transação. Levanta ConflitoHorario e devolve o id.
+    Não atualiza o índice de ocupação (fica a cargo de quem chama).
+    """
+    cur = conn.cursor()
+    cur.execute("BEGIN IMMEDIATE")
+    try:
+        if checar_paciente:
+            cur.execute(SQL_CONFLITO_PACIENTE, (paciente_id, minutos_desde_epoca(data, hora)))
+            if cur.fetchone():
+                raise ConflitoHorario("paciente")
+        cur.execute(
+            """INSERT INTO agendamentos
+               (paciente_id, medico_id, procedimento_id, sala_id, data, hora, convenio)
+               VALUES (?, ?, ?, ?, ?, ?, ?)""",
+            (paciente_id, medico_id, procedimento_id, sala_id, data, hora, convenio),
+        )
+        novo_id = cur.lastrowid
+        conn.commit()
+    except sqlite3.IntegrityError as e:
+        conn.rollback()
+        recurso = recurso_em_conflito(e)
+        if recurso is None:
+            raise
+        raise ConflitoHorario(recurso) from e
+    except Exception:
+        conn.rollback()
+        raise
+    return novo_id
+
+
+def inserir_serie(conn, paciente_id, medico_id, procedimento_id, sala_id, datas, hora,
+                  convenio=None, tudo_ou_nada=False, simular=False):
+    """
+    Agenda a mesma consulta em várias `datas` numa única transação BEGIN
+    IMMEDIATE: os conflitos de sala, médico e paciente de todas as datas saem
+    de uma consulta só (SQL_CONFLITOS_SERIE) e as datas livres entram num
+    único `executemany`. Com `tudo_ou_nada` qualquer conflito desfaz a série;
+    com `simular` nada é gravado. Devolve ([(data, id)], {data: recurso}), com
+    id None nas datas livres que não foram gravadas.
+    Não atualiza o índice de ocupação (fica a cargo de quem chama).
+    """
+    datas = list(dict.fromkeys(datas))
+    data_por_minuto = {minutos_desde_epoca(d, hora): d for d in datas}
+    cur = conn.cursor()
+    cur.execute("BEGIN IMMEDIATE")
+    try:
+        cur.execute(SQL_CONFLITOS_SERIE, (json.dumps(list(data_por_minuto)), sala_id, medico_id, paciente_id))
+        conflitos = {}
+        for row in cur.fetchall():
+            conflitos.setdefault(data_por_minuto[row["inicio_min"]], row["recurso"])
+        livres = [d for d in datas if d not in conflitos]
+        if simular or not livres or (tudo_ou_nada and conflitos):
+            conn.rollback()
+            return [(d, None) for d in livres], conflitos
+
+        cur.executemany(
+            """INSERT INTO agendamentos
+               (paciente_id, medico_id, procedimento_id, sala_id, data, hora, convenio)
+               VALUES (?, ?, ?, ?, ?, ?, ?)""",
+            [(paciente_id, medico_id, procedimento_id, sala_id, d, hora, convenio) for d in livres],
+        )
+        # com o lock de escrita da transação os ids AUTOINCREMENT saem em sequência
+        ultimo = cur.execute("SELECT last_insert_rowid()").fetchone()[0]
+        conn.commit()
+    except sqlite3.IntegrityError as e:
+        conn.rollback()
+        recurso = recurso_em_conflito(e)
+        if recurso is None:
+            raise
+        raise ConflitoHorario(recurso) from e
+    except Exception:
+        conn.rollback()
+        raise
+    primeiro = ultimo - len(livres) + 1
+    return [(d, primeiro + i) for i, d in enumerate(livres)], conflitos
+
+
+def minutos_ocupados_paciente(paciente_id, inicio, fim):
+    """inicio_min dos agendamentos ativos do paciente entre as datas `inicio` e `fim` (inclusive)."""
+    conn = conectar()
+    rows = conn.execute(SQL_OCUPADOS_PACIENTE, (
+        paciente_id, minutos_desde_epoca(inicio.isoformat()), minutos_desde_epoca(fim.isoformat()) + 24 * 60,
+    )).fetchall()
     conn.close()
+    return {row["inicio_min"] for row in rows}
+
 
 # ---------- util: calcular horários disponíveis ----------
+EXPEDIENTE_INICIO = time(8, 0)
+EXPEDIENTE_FIM = time(17, 0)
+MAX_DIAS_PERIODO = 62  # janela máxima aceita por horarios_disponiveis_periodo
+
+
+@lru_cache(maxsize=None)
+def grade_horarios(passo_min=30):
+    """Timeslots 'HH:MM' do expediente (08:00-17:00), calculados uma vez por passo."""
+    inicio = EXPEDIENTE_INICIO.hour * 60 + EXPEDIENTE_INICIO.minute
+    fim = EXPEDIENTE_FIM.hour * 60 + EXPEDIENTE_FIM.minute
+    return tuple(f"{m // 60:02d}:{m % 60:02d}" for m in range(inicio, fim + 1, passo_min))
+
+
+# bitmap de ocupação por (sala|médico, dia); capacidade/TTL via init_app
+ocupacao = IndiceOcupacao(grade_horarios(30))
+
+
+def horarios_disponiveis_periodo(medico_id:int, sala_id:int, inicio:date, fim:date, passo_min=30, ignorar_agendamento_id=None):
+    """
+    Versão por intervalo de `horarios_disponiveis`: os dias já presentes no
+    índice de ocupação (`ocupacao.py`) não tocam o banco; os demais vêm de uma
+    única consulta (sala OU médico) entre `inicio` e `fim` (inclusive).
+    Retorna dict {'YYYY-MM-DD': ['HH:MM', ...]} na ordem dos dias.
+    """
+    if fim < inicio:
+        raise ValueError("fim anterior ao início")
+    if (fim - inicio).days + 1 > MAX_DIAS_PERIODO:
+        raise ValueError(f"intervalo maior que {MAX_DIAS_PERIODO} dias")
+
+    medico_id, sala_id = int(medico_id), int(sala_id)
+    dias = [(inicio + timedelta(days=n)).isoformat() for n in range((fim - inicio).days + 1)]
+    chaves = [(tipo, recurso, dia) for dia in dias
+              for tipo, recurso in ((SALA, sala_id), (MEDICO, medico_id))]
+
+    # a mesma versão que entra no ETag das respostas (lida uma vez por requisição)
+    versao = versoes_dados().get("agendamentos")
+    entradas = ocupacao.consultar(chaves, versao)
+    faltando = sorted({chave[2] for chave in chaves if chave not in entradas})
+    if faltando:
+        entradas.update(_carregar_ocupacao(medico_id, sala_id, faltando[0], faltando[-1], versao))
+
+    grade = grade_horarios(passo_min)
+    ignorar = int(ignorar_agendamento_id) if ignorar_agendamento_id is not None else None
+    return {
+        dia: ocupacao.livres(
+            (entradas[(SALA, sala_id, dia)], entradas[(MEDICO, medico_id, dia)]),
+            ignorar_id=ignorar,
+            grade=grade,
+        )
+        for dia in dias
+    }
+
+
+def _carregar_ocupacao(medico_id, sala_id, inicio_str, fim_str, versao=None):
+    geracao = ocupacao.geracao
+    horas_por_chave = {}
+    d = datetime.strptime(inicio_str, "%Y-%m-%d").date()
+    ultimo = datetime.strptime(fim_str, "%Y-%m-%d").date()
+    while d <= ultimo:
+        horas_por_chave[(SALA, sala_id, d.isoformat())] = {}
+        horas_por_chave[(MEDICO, medico_id, d.isoformat())] = {}
+        d += timedelta(days=1)
+
+    de = minutos_desde_epoca(inicio_str)
+    ate = minutos_desde_epoca(fim_str) + 24 * 60
+    conn = conectar()
+    c = conn.cursor()
+    # o UNION ALL deixa cada lado usar o próprio índice (sala_id|medico_id, inicio_min)
+    c.execute(SQL_HORARIOS_OCUPADOS, (sala_id, de, ate, medico_id, de, ate))
+    for row in c.fetchall():
+        recurso = sala_id if row["tipo"] == SALA else medico_id
+        horas_por_chave.setdefault((row["tipo"], recurso, row["data"]), {})[row["id"]] = row["hora"]
+    conn.close()
+    return ocupacao.guardar(geracao, horas_por_chave, versao)
+
+
+def registrar_ocupacao(agendamento_id, antes=None, depois=None):
+    """
+    Atualiza o índice de ocupação após um commit em `agendamentos`.
+    `antes`/`depois`: (medico_id, sala_id, data, hora) ou None.
+    """
+    # versão já com o commit (o trigger a incrementou): lida uma vez e
+    # carimbada nas entradas atualizadas, que seguem válidas para o próximo ETag
+    conn = conectar()
+    row = conn.execute("SELECT versao FROM versoes_cache WHERE nome='agendamentos'").fetchone()
+    conn.close()
+    if has_app_context():
+        g.pop("_versoes_cache", None)
+    ocupacao.mover(agendamento_id, antes=antes, depois=depois, versao=row["versao"] if row else None)
+
+
+def invalidar_ocupacao():
+    ocupacao.invalidar()
+
+
 def horarios_disponiveis(medico_id:int, sala_id:int, dia_str:str, passo_min=30, ignorar_agendamento_id=None):
     """
     Gera timeslots entre 08:00-17:00 para a data dada,
@@ -135,27 +1218,8 @@ def horarios_disponiveis(medico_id:int, sala_id:int, dia_str:str, passo_min=30,
     é desconsiderado da checagem de conflito (útil para edições).
     Retorna lista de strings 'HH:MM'.
     """
-    conn = conectar()
-    c = conn.cursor()
-    # horários ocupados por sala OU por médico na mesma data
-    params = [dia_str, sala_id, medico_id]
-    query = """SELECT hora FROM agendamentos WHERE data=? AND (sala_id=? OR medico_id=?)"""
-    if ignorar_agendamento_id is not None:
-        query += " AND id<>?"
-        params.append(ignorar_agendamento_id)
-
-    c.execute(query, params)
-    ocupados = {row["hora"] for row in c.fetchall()}
-    conn.close()
-
-    inicio = time(8, 0); fim = time(17, 0)
-    t = datetime.strptime(f"{dia_str} {inicio.hour:02d}:{inicio.minute:02d}", "%Y-%m-%d %H:%M")
-    end = datetime.strptime(f"{dia_str} {fim.hour:02d}:{fim.minute:02d}", "%Y-%m-%d %H:%M")
-
-    livres = []
-    while t <= end:
-        hhmm = t.strftime("%H:%M")
-        if hhmm not in ocupados:
-            livres.append(hhmm)
-        t += timedelta(minutes=passo_min)
-    return livres
+    dia = datetime.strptime(dia_str, "%Y-%m-%d").date()
+    return horarios_disponiveis_periodo(
+        medico_id, sala_id, dia, dia,
+        passo_min=passo_min, ignorar_agendamento_id=ignorar_agendamento_id,
+    )[dia.isoformat()]
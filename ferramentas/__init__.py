@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+"""Ferramentas de operação e diagnóstico expostas como comandos `flask --app main ...`.
+
+Os módulos de cada ferramenta são importados dentro do próprio comando: o processo
+web só registra os comandos e nunca carrega carga, benchmark ou gerador de dados.
+"""
+import os
+import time
+
+import click
+
+from databaser import BASE_DIR
+
+
+BANCO_SINTETICO = os.path.join(BASE_DIR, "benchmarks", "clinica_sintetica.db")  # carga: relativo a hoje
+BANCO_BENCHMARK = os.path.join(BASE_DIR, "benchmarks", "clinica_benchmark.db")   # data de referência fixa
+
+
+def _garantir_banco_sintetico(banco, dataset):
+    from ferramentas.dados_sinteticos import gerar_clinica
+
+    if not os.path.exists(banco):
+        os.makedirs(os.path.dirname(os.path.abspath(banco)), exist_ok=True)
+        click.echo(f"gerando {banco} ({dataset})...")
+        gerar_clinica(banco, **dataset)
+
+
+def init_app(app):
+    @app.cli.command("estresse-reserva")
+    @click.option("--threads", default=32, show_default=True, help="Reservas simultâneas por rodada.")
+    def estresse_reserva_comando(threads):
+        """Dispara reservas simultâneas do mesmo slot; exatamente uma deve vencer."""
+        from ferramentas.estresse_reserva import estressar_reserva
+
+        resultados = estressar_reserva(threads)
+        falhou = False
+        for rodada, r in resultados.items():
+            ok = r["vencedores"] == 1 and r["no_banco"] == 1 and not r["erros"]
+            falhou = falhou or not ok
+            click.echo(
+                f"[{'OK' if ok else 'FALHA'}] {rodada}: {r['vencedores']} reserva(s), "
+                f"{r['conflitos']} conflito(s), {len(r['erros'])} erro(s), {r['no_banco']} no banco"
+            )
+            for erro in r["erros"][:5]:
+                click.echo(f"    {erro}", err=True)
+        if falhou:
+            raise SystemExit(1)
+
+    @app.cli.command("verificar-regressoes")
+    @click.option("--caso", "casos", multiple=True, help="Roda só estas verificações (repetível).")
+    def verificar_regressoes_comando(casos):
+        """Reproduz, em bancos temporários, comportamentos já corrigidos; falha se algum voltar."""
+        from ferramentas.regressoes import VERIFICACOES, verificar_regressoes
+
+        desconhecidos = sorted(set(casos) - set(VERIFICACOES))
+        if desconhecidos:
+            raise click.BadParameter(
+                f"{', '.join(desconhecidos)} (conhecidos: {', '.join(sorted(VERIFICACOES))})", param_hint="--caso"
+            )
+        falhou = False
+        for nome, (ok, detalhe) in verificar_regressoes(app, casos).items():
+            falhou = falhou or not ok
+            click.echo(f"[{'OK' if ok else 'FALHA'}] {nome}: {detalhe}")
+        if falhou:
+            raise SystemExit(1)
+
+    @app.cli.command("reparar-agendamentos")
+    @click.option("--lote", default=500, show_default=True, help="Agendamentos por transação.")
+    @click.option("--reiniciar", is_flag=True, help="Ignora o checkpoint e recomeça do primeiro id.")
+    def reparar_agendamentos_comando(lote, reiniciar):
+        """Normaliza status/data/hora legados de agendamentos em lotes retomáveis."""
+        from ferramentas.reparo_agendamentos import reparar_agendamentos
+
+        def progresso(t):
+            click.echo(
+                f"{t['lidas']}/{t['pendentes']} lidos (até id {t['ultimo_id']}), "
+                f"{t['corrigidas']} corrigido(s), {t['marcadas_conflito']} conflito(s) legado(s), "
+                f"{t['revisao_manual']} para revisão manual"
+            )
+
+        totais = reparar_agendamentos(lote, reiniciar, progresso)
+        if not totais["lidas"]:
+            click.echo("Nada a reparar desde o último checkpoint.")
+
+    @app.cli.command("bench-senhas")
+    @click.option("--logins", default=64, show_default=True, help="Verificações de senha por rodada.")
+    @click.option("--concorrencia", default=16, show_default=True, help="Requisições simultâneas.")
+    @click.option("--processos", default=None, help="Lista separada por vírgula (padrão: 0,1,2,4..núcleos).")
+    def bench_senhas_comando(logins, concorrencia, processos):
+        """Mede logins/s com o hash na thread da requisição e em pools de processos."""
+        from ferramentas.bench_senhas import medir_logins
+
+        if processos:
+            quantidades = [int(p) for p in processos.split(",")]
+        else:
+            nucleos = os.cpu_count() or 1
+            quantidades = [0] + sorted({min(2 ** i, nucleos) for i in range(nucleos.bit_length() + 1)})
+        base = None
+        for r in medir_logins(quantidades, logins, concorrencia):
+            base = base or r["logins_s"]
+            rotulo = "na thread" if r["processos"] == 0 else f"{r['processos']} processo(s)"
+            click.echo(
+                f"{rotulo:>14}: {r['logins_s']:7.1f} logins/s "
+                f"({r['segundos']:.2f}s, {r['logins_s'] / base:.2f}x)"
+            )
+
+    @app.cli.command("gerar-dados")
+    @click.option("--banco", required=True, type=click.Path(dir_okay=False), help="Arquivo SQLite de destino.")
+    @click.option("--medicos", default=40, show_default=True)
+    @click.option("--pacientes", default=5000, show_default=True)
+    @click.option("--salas", default=12, show_default=True)
+    @click.option("--anos", default=2, show_default=True, help="Anos de histórico (mais 60 dias à frente).")
+    @click.option("--ocupacao", default=0.6, show_default=True, help="Chance de cada médico/horário estar agendado.")
+    @click.option("--semente", default=42, show_default=True)
+    @click.option("--referencia", default=None, help="Data AAAA-MM-DD tratada como hoje (padrão: hoje).")
+    def gerar_dados_comando(banco, medicos, pacientes, salas, anos, ocupacao, semente, referencia):
+        """Popula um banco com uma clínica sintética (não use o banco de produção)."""
+        from ferramentas.dados_sinteticos import gerar_clinica
+
+        if os.path.abspath(banco) == os.path.abspath(app.config["DB_PATH"]):
+            raise click.UsageError("--banco não pode ser o banco configurado da aplicação.")
+        inicio = time.perf_counter()
+        resultado = gerar_clinica(
+            banco, medicos, pacientes, salas, anos, ocupacao, semente, referencia,
+            progresso=lambda tabela, total: click.echo(f"{tabela}: {total} linha(s)"),
+        )
+        total = sum(resultado["linhas"].values())
+        click.echo(f"{total} linha(s) em {time.perf_counter() - inicio:.1f}s -> {banco} (senha dos usuários: sintetico)")
+
+    @app.cli.command("benchmark")
+    @click.option("--banco", default=BANCO_BENCHMARK, show_default=True,
+                  type=click.Path(dir_okay=False), help="Banco sintético; gerado com o volume padrão se não existir.")
+    @click.option("--referencia", default=None,
+                  help="Data tratada como hoje na geração do banco (padrão: a do DATASET_PADRAO).")
+    @click.option("--repeticoes", default=30, show_default=True)
+    @click.option("--aquecimento", default=3, show_default=True)
+    @click.option("--caso", "casos", multiple=True, help="Mede só estes casos (repetível).")
+    @click.option("--baseline", default=os.path.join(BASE_DIR, "benchmarks", "baseline.json"), show_default=True,
+                  type=click.Path(dir_okay=False))
+    @click.option("--salvar-baseline", "salvar_baseline_", is_flag=True, help="Grava os resultados como novo baseline.")
+    @click.option("--tolerancia", default=0.25, show_default=True, help="Aumento de p50 aceito com --falhar-em-regressao.")
+    @click.option("--falhar-em-regressao", is_flag=True,
+                  help="Termina com código 1 se algum p50 passar da tolerância (só vale com baseline desta máquina).")
+    def benchmark_comando(banco, referencia, repeticoes, aquecimento, casos, baseline, salvar_baseline_,
+                          tolerancia, falhar_em_regressao):
+        """p50/p95 das telas e APIs pesadas sobre a clínica sintética, comparados ao baseline."""
+        from ferramentas.benchmark import (
+            DATASET_PADRAO, assinatura_dataset, carregar_baseline, comparar, executar_benchmark, salvar_baseline
+        )
+
+        referencia = referencia or DATASET_PADRAO["referencia"]
+        _garantir_banco_sintetico(banco, {**DATASET_PADRAO, "referencia": referencia})
+        dataset = assinatura_dataset(banco)
+        anterior = carregar_baseline(baseline)
+        if anterior and anterior.get("dataset") != dataset:
+            if falhar_em_regressao:
+                raise click.UsageError(f"baseline medido com outro volume ({anterior.get('dataset')}); regrave-o")
+            click.echo(f"aviso: baseline medido com outro volume ({anterior.get('dataset')}); comparação aproximada", err=True)
+        resultados = executar_benchmark(app, banco, repeticoes, aquecimento, casos=casos, referencia=referencia)
+
+        def delta(valor):
+            return "      -" if valor is None else f"{valor:+7.1%}"
+
+        click.echo(f"{'caso':<24} {'p50 ms':>9} {'p95 ms':>9} {'Δp50':>7} {'Δp95':>7}")
+        linhas = comparar(resultados, anterior, tolerancia)
+        for linha in linhas:
+            click.echo(
+                f"{linha['caso']:<24} {linha['p50_ms']:9.2f} {linha['p95_ms']:9.2f} "
+                f"{delta(linha['delta_p50'])} {delta(linha['delta_p95'])}"
+                + ("  REGRESSÃO" if linha["regressao"] else "")
+            )
+        if salvar_baseline_:
+            salvar_baseline(baseline, resultados, dataset)
+            click.echo(f"baseline salvo em {baseline}")
+        elif falhar_em_regressao and any(linha["regressao"] for linha in linhas):
+            raise SystemExit(1)
+
+    @app.cli.command("carga")
+    @click.option("--banco", default=BANCO_SINTETICO, show_default=True, type=click.Path(dir_okay=False),
+                  help="Banco sintético de origem (a carga roda numa cópia).")
+    @click.option("--recepcionistas", default=8, show_default=True)
+    @click.option("--medicos", default=4, show_default=True)
+    @click.option("--pacientes", default=16, show_default=True)
+    @click.option("--duracao", default=30, show_default=True, help="Segundos de carga.")
+    @click.option("--processos", default=0, show_default=True, help="Servidor com N processos (0: threads).")
+    @click.option("--pensar-ms", default=0, show_default=True, help="Pausa de cada usuário entre ações.")
+    def carga_comando(banco, recepcionistas, medicos, pacientes, duracao, processos, pensar_ms):
+        """Usuários virtuais concorrentes contra um servidor WSGI local: latência, erros, locks e double-booking."""
+        from ferramentas.benchmark import DATASET_PADRAO
+        from ferramentas.carga import executar_carga
+
+        # a carga precisa de agenda de hoje em diante: mesmo volume, mas gerado na data corrente
+        _garantir_banco_sintetico(banco, {chave: valor for chave, valor in DATASET_PADRAO.items() if chave != "referencia"})
+        usuarios = {"recepcionista": recepcionistas, "medico": medicos, "paciente": pacientes}
+        r = executar_carga(banco, usuarios, duracao, processos, pensar_ms)
+
+        click.echo(f"{'operação':<20} {'n':>6} {'erros':>6} {'locks':>6} {'conflit':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+        requisicoes = erros = locks = 0
+        for nome, o in r["operacoes"].items():
+            requisicoes += o["n"]
+            erros += o["erros"]
+            locks += o["locks"]
+            click.echo(
+                f"{nome:<20} {o['n']:6d} {o['erros']:6d} {o['locks']:6d} {o['conflitos']:7d} "
+                f"{o['p50_ms']:8.1f} {o['p95_ms']:8.1f} {o['p99_ms']:8.1f}"
+            )
+        taxa = (lambda n: n / requisicoes if requisicoes else 0.0)
+        v = r["violacoes"]
+        click.echo(
+            f"{r['requisicoes_s']:.1f} req/s; erros {taxa(erros):.2%}; locks {taxa(locks):.2%} "
+            f"(+{r['locks_servidor']} no log do servidor); {r['novos_agendamentos']} agendamento(s) criado(s)"
+        )
+        ok = v["sala_id"] == 0 and v["medico_id"] == 0
+        click.echo(f"[{'OK' if ok else 'FALHA'}] double-booking: {v['sala_id']} slot(s) de sala, {v['medico_id']} de médico")
+        if not ok:
+            raise SystemExit(1)
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark de vazão de login: verificações de senha simultâneas (uma thread
+por requisição, como no servidor) com o hash na própria thread e com pools
+de 1..N processos. Com o pool a vazão deve crescer com o número de núcleos.
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.security import generate_password_hash
+
+from senhas import PoolSenhas
+
+SENHA = "senha-de-benchmark"
+
+
+def _medir(pool, senha_hash, logins, concorrencia):
+    pool.aquecer()  # sobe os processos antes de cronometrar
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(concorrencia) as clientes:
+        resultados = list(clientes.map(lambda _i: pool.verificar(senha_hash, SENHA), range(logins)))
+    duracao = time.perf_counter() - inicio
+    if not all(resultados):
+        raise RuntimeError("verificação de senha falhou durante o benchmark")
+    return {"processos": pool.processos, "segundos": duracao, "logins_s": logins / duracao}
+
+
+def medir_logins(processos, logins=64, concorrencia=16):
+    """
+    Mede a vazão para cada quantidade em `processos` (0 = hash na thread da
+    requisição). Devolve uma lista de dicts {processos, segundos, logins_s}.
+    """
+    senha_hash = generate_password_hash(SENHA)
+    resultados = []
+    for n in processos:
+        # fila do tamanho do lote: o benchmark mede vazão, não recusa
+        pool = PoolSenhas(n, fila_max=logins, timeout_s=300)
+        try:
+            resultados.append(_medir(pool, senha_hash, logins, concorrencia))
+        finally:
+            pool.encerrar()
+    return resultados
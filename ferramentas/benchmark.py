@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark das telas e APIs mais pesadas sobre a clínica sintética
+(ferramentas/dados_sinteticos.py), pelo test client do Flask: mede
+p50/p95 de cada caso e compara com um baseline salvo em JSON.
+
+O banco padrão é gerado numa data de referência fixa (DATASET_PADRAO), então
+é o mesmo em qualquer dia; os casos com data usam essa referência no lugar
+de hoje. As telas que a aplicação sempre monta para o dia corrente (agenda
+do médico, contagem do dia na recepção) medem um dia sem consultas.
+
+Durante a medição o pool global aponta para o banco sintético e o cache em
+disco dos relatórios fica desligado (o caso de exportação mede a geração
+do CSV, não o acerto de cache); tudo volta ao normal no fim.
+"""
+import json
+import os
+import random
+import sqlite3
+import statistics
+import time
+from datetime import date, timedelta
+
+import databaser
+import referencias
+from databaser import CONFIG_PADRAO, configurar_pool
+from ferramentas.dados_sinteticos import SENHA
+from relatorios_cache import cache as cache_relatorios
+
+DATASET_PADRAO = {
+    "medicos": 20, "pacientes": 3000, "salas": 8, "anos": 1, "ocupacao": 0.6, "semente": 42,
+    "referencia": "2025-01-06",
+}
+
+
+def _usuarios(conn):
+    def primeiro(sql):
+        return conn.execute(sql).fetchone()[0]
+    return {
+        "recepcionista": primeiro("SELECT email FROM usuarios WHERE email LIKE 'recepcionista%@sintetico.local' ORDER BY id LIMIT 1"),
+        "medico": primeiro("SELECT email FROM usuarios WHERE email LIKE 'medico%@sintetico.local' ORDER BY id LIMIT 1"),
+        # o paciente com mais consultas: pior caso da tela do paciente
+        "paciente": primeiro("""
+            SELECT u.email FROM usuarios u JOIN agendamentos a ON a.paciente_id = u.id
+            WHERE u.email LIKE 'paciente%@sintetico.local'
+            GROUP BY u.id ORDER BY COUNT(*) DESC, u.id LIMIT 1
+        """),
+    }
+
+
+def _casos(conn, rng, referencia):
+    """{nome: (perfil, função que devolve a próxima URL)}; `referencia` é o "hoje" do banco."""
+    medicos = [r[0] for r in conn.execute("SELECT id FROM usuarios WHERE email LIKE 'medico%@sintetico.local'")]
+    salas = [r[0] for r in conn.execute("SELECT id FROM salas")]
+    meses = [r[0] for r in conn.execute("SELECT DISTINCT substr(data, 1, 7) FROM agendamentos ORDER BY 1")]
+    hoje = date.fromisoformat(str(referencia))
+
+    def horarios():
+        dia = hoje + timedelta(days=rng.randint(0, 30))
+        return (f"/user/recepcionista/horarios_disponiveis?medico_id={rng.choice(medicos)}"
+                f"&sala_id={rng.choice(salas)}&dia={dia.isoformat()}")
+
+    def filtrados():
+        return f"/user/recepcionista?mes={rng.choice(meses)}&medico={rng.choice(medicos)}"
+
+    return {
+        "horarios_disponiveis": ("recepcionista", horarios),
+        "agendamentos_filtrados": ("recepcionista", filtrados),
+        "exportar_relatorio": ("recepcionista", lambda: f"/user/recepcionista/relatorios/exportar?escopo=mensal&mes={hoje:%Y-%m}"),
+        "visao_recepcionista": ("recepcionista", lambda: "/user/recepcionista"),
+        "visao_medico": ("medico", lambda: "/user/medico"),
+        "visao_paciente": ("paciente", lambda: "/user/paciente"),
+    }
+
+
+def _percentil(valores, p):
+    if len(valores) == 1:
+        return valores[0]
+    return statistics.quantiles(valores, n=100, method="inclusive")[p - 1]
+
+
+def _medir_caso(cliente, proxima_url, repeticoes, aquecimento):
+    tempos = []
+    for i in range(aquecimento + repeticoes):
+        url = proxima_url()
+        inicio = time.perf_counter()
+        resposta = cliente.get(url)
+        resposta.get_data()  # consome respostas em streaming (CSV)
+        duracao = time.perf_counter() - inicio
+        if resposta.status_code != 200:
+            raise RuntimeError(f"{url} respondeu {resposta.status_code}")
+        if i >= aquecimento:
+            tempos.append(duracao * 1000)
+    return {
+        "n": len(tempos),
+        "p50_ms": round(_percentil(tempos, 50), 3),
+        "p95_ms": round(_percentil(tempos, 95), 3),
+        "media_ms": round(statistics.fmean(tempos), 3),
+        "max_ms": round(max(tempos), 3),
+    }
+
+
+def executar_benchmark(app, caminho, repeticoes=30, aquecimento=3, semente=42, casos=None,
+                       referencia=DATASET_PADRAO["referencia"]):
+    """
+    Roda os casos (todos, ou os nomes em `casos`) contra o banco sintético em
+    `caminho`, gerado com a data `referencia`. Devolve
+    {nome: {n, p50_ms, p95_ms, media_ms, max_ms}}.
+    """
+    rng = random.Random(semente)
+    config_original = {chave: app.config[chave] for chave in CONFIG_PADRAO}
+    diretorio_cache = cache_relatorios.diretorio
+    configurar_pool({**config_original, "DB_PATH": caminho})
+    databaser.invalidar_ocupacao()
+    referencias.cache.limpar()
+    cache_relatorios.diretorio = None
+    try:
+        with app.app_context():
+            conn = databaser.conectar()
+            usuarios = _usuarios(conn)
+            selecionados = _casos(conn, rng, referencia)
+        if casos:
+            selecionados = {nome: caso for nome, caso in selecionados.items() if nome in casos}
+
+        clientes = {}
+        for perfil, email in usuarios.items():
+            cliente = app.test_client()
+            resposta = cliente.post("/user/", data={"email": email, "senha": SENHA})
+            if resposta.status_code != 302:
+                raise RuntimeError(f"login de {perfil} ({email}) falhou")
+            clientes[perfil] = cliente
+
+        return {
+            nome: _medir_caso(clientes[perfil], proxima_url, repeticoes, aquecimento)
+            for nome, (perfil, proxima_url) in selecionados.items()
+        }
+    finally:
+        cache_relatorios.diretorio = diretorio_cache
+        configurar_pool(config_original)
+        databaser.invalidar_ocupacao()
+        referencias.cache.limpar()
+
+
+# ---------- baseline ----------
+def assinatura_dataset(caminho):
+    """Contagens do banco medido; o baseline só vale para o mesmo volume."""
+    conn = sqlite3.connect(caminho)
+    try:
+        return {
+            tabela: conn.execute(f"SELECT COUNT(*) FROM {tabela}").fetchone()[0]
+            for tabela in ("usuarios", "agendamentos", "chamadas_pacientes", "agendamento_ajustes")
+        }
+    finally:
+        conn.close()
+
+
+def salvar_baseline(caminho, resultados, dataset):
+    os.makedirs(os.path.dirname(os.path.abspath(caminho)), exist_ok=True)
+    with open(caminho, "w", encoding="utf-8") as destino:
+        json.dump({"dataset": dataset, "casos": resultados}, destino, ensure_ascii=False, indent=2)
+
+
+def carregar_baseline(caminho):
+    try:
+        with open(caminho, encoding="utf-8") as origem:
+            return json.load(origem)
+    except (OSError, ValueError):
+        return None
+
+
+def comparar(resultados, baseline, tolerancia=0.25):
+    """
+    Linhas {caso, p50_ms, p95_ms, delta_p50, delta_p95, regressao}; delta é a
+    variação relativa ao baseline e regressão é p50 acima de 1 + tolerancia.
+    """
+    linhas = []
+    for nome, r in resultados.items():
+        base = (baseline or {}).get("casos", {}).get(nome)
+        linha = {"caso": nome, **r, "delta_p50": None, "delta_p95": None, "regressao": False}
+        if base:
+            linha["delta_p50"] = r["p50_ms"] / base["p50_ms"] - 1 if base["p50_ms"] else None
+            linha["delta_p95"] = r["p95_ms"] / base["p95_ms"] - 1 if base["p95_ms"] else None
+            linha["regressao"] = linha["delta_p50"] is not None and linha["delta_p50"] > tolerancia
+        linhas.append(linha)
+    return linhas
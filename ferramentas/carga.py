@@ -0,0 +1,338 @@
+# -*- coding: utf-8 -*-
+"""
+Teste de carga local do fluxo de agendamento. Sobe a aplicação num servidor
+WSGI de verdade (ferramentas/servidor_carga.py, com threads ou processos)
+sobre uma cópia do banco sintético e solta usuários virtuais concorrentes,
+cada um com a própria sessão:
+
+- recepcionista: consulta horários livres (horarios_api) e agenda por JSON
+  (agendar_consulta), escolhendo entre os primeiros horários livres como
+  faria uma pessoa, o que gera disputa pelo mesmo slot;
+- médico: abre a agenda do dia e chama pacientes (chamar_paciente);
+- paciente: abre o painel, consulta horários e pede ajuste (solicitar_ajuste).
+
+No fim relata percentis de latência por operação, taxas de erro e de
+"database is locked" e confere no banco se algum slot de sala ou médico
+ficou com dois agendamentos ativos.
+"""
+import http.client
+import json
+import os
+import random
+import shutil
+import socket
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+from urllib.parse import urlencode, urlsplit
+
+from databaser import BASE_DIR
+from ferramentas.dados_sinteticos import SENHA
+
+LOCK = b"database is locked"
+
+# destino do redirect de um login bem-sucedido; qualquer outro 302 (inclusive
+# o do errorhandler de SenhaIndisponivel) é falha
+PAINEIS = {"recepcionista": "/user/recepcionista", "medico": "/user/medico", "paciente": "/user/paciente"}
+
+
+class Coletor:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.operacoes = {}  # nome -> {"tempos": [...], "ok", "conflitos", "erros", "locks"}
+
+    def registrar(self, operacao, duracao, resultado, lock=False):
+        with self._lock:
+            item = self.operacoes.setdefault(
+                operacao, {"tempos": [], "ok": 0, "conflitos": 0, "erros": 0, "locks": 0}
+            )
+            item["tempos"].append(duracao * 1000)
+            item[resultado] += 1
+            item["locks"] += lock
+
+
+class Cliente:
+    """Conexão keep-alive com o cookie de sessão de um usuário virtual."""
+
+    def __init__(self, porta, coletor):
+        self.porta = porta
+        self.coletor = coletor
+        self.cookie = None
+        self.conn = None
+
+    def requisitar(self, operacao, metodo, caminho, form=None, json_=None, esperados=(200, 302), destino=None):
+        """
+        (status, corpo, ok) da requisição. Com `destino`, um redirect só conta como
+        ok se for para esse caminho (o de sessão perdida vai para o login).
+        """
+        corpo, cabecalhos = None, {}
+        if form is not None:
+            corpo = urlencode(form)
+            cabecalhos["Content-Type"] = "application/x-www-form-urlencoded"
+        elif json_ is not None:
+            corpo = json.dumps(json_)
+            cabecalhos["Content-Type"] = "application/json"
+        if self.cookie:
+            cabecalhos["Cookie"] = self.cookie
+
+        inicio = time.perf_counter()
+        try:
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection("127.0.0.1", self.porta, timeout=60)
+            self.conn.request(metodo, caminho, body=corpo, headers=cabecalhos)
+            resposta = self.conn.getresponse()
+            dados = resposta.read()
+        except (OSError, http.client.HTTPException):
+            self.conn = None  # servidor fechou a conexão: reabre na próxima
+            self.coletor.registrar(operacao, time.perf_counter() - inicio, "erros")
+            return None, b"", False
+        duracao = time.perf_counter() - inicio
+
+        novo_cookie = resposta.getheader("Set-Cookie")
+        if novo_cookie:
+            self.cookie = novo_cookie.split(";", 1)[0]
+        if resposta.getheader("Connection", "").lower() == "close":
+            self.conn.close()
+            self.conn = None
+
+        redirecionou_errado = (
+            destino is not None and resposta.status == 302
+            and urlsplit(resposta.getheader("Location", "")).path != destino
+        )
+        if resposta.status in esperados and not redirecionou_errado:
+            resultado = "ok"
+        elif resposta.status == 409:
+            resultado = "conflitos"
+        else:
+            resultado = "erros"
+        self.coletor.registrar(operacao, duracao, resultado, lock=LOCK in dados)
+        return resposta.status, dados, resultado == "ok"
+
+    def login(self, email, papel):
+        _status, _corpo, ok = self.requisitar(
+            "login", "POST", "/user/", form={"email": email, "senha": SENHA},
+            esperados=(302,), destino=PAINEIS[papel],
+        )
+        return ok
+
+
+# ---------- roteiros dos usuários virtuais ----------
+def _recepcionista(cliente, dados, rng, ate, pensar_s):
+    if not cliente.login(dados["recepcionista"], "recepcionista"):
+        return
+    hoje = date.today()
+    while time.monotonic() < ate:
+        medico, sala = rng.choice(dados["medicos"]), rng.choice(dados["salas"])
+        dia = (hoje + timedelta(days=rng.randint(1, 10))).isoformat()
+        status, corpo, _ok = cliente.requisitar(
+            "horarios_api", "GET", f"/user/recepcionista/horarios_disponiveis?medico_id={medico}&sala_id={sala}&dia={dia}",
+            esperados=(200,),
+        )
+        livres = json.loads(corpo) if status == 200 else []
+        if livres:
+            cliente.requisitar("agendar_consulta", "POST", "/user/agendar_consulta", json_={
+                "paciente_id": str(rng.choice(dados["pacientes"])), "medico_id": str(medico),
+                "procedimento_id": str(dados["procedimento"]), "sala_id": str(sala),
+                "data": dia, "hora": rng.choice(livres[:3]),
+            }, esperados=(200,))
+        time.sleep(pensar_s)
+
+
+def _medico(cliente, dados, rng, ate, pensar_s):
+    if not dados["agenda_medicos"]:
+        return  # ninguém com agenda hoje
+    email, agendamentos = rng.choice(dados["agenda_medicos"])
+    if not cliente.login(email, "medico"):
+        return
+    while time.monotonic() < ate:
+        cliente.requisitar("visao_medico", "GET", "/user/medico", esperados=(200,))
+        if agendamentos:
+            cliente.requisitar(
+                "chamar_paciente", "POST", f"/user/medico/agendamentos/{rng.choice(agendamentos)}/chamar",
+                destino=PAINEIS["medico"],
+            )
+        time.sleep(pensar_s)
+
+
+def _paciente(cliente, dados, rng, ate, pensar_s):
+    if not dados["agenda_pacientes"]:
+        return  # banco sem consultas futuras para remarcar
+    email, agendamentos = rng.choice(dados["agenda_pacientes"])
+    if not cliente.login(email, "paciente"):
+        return
+    while time.monotonic() < ate:
+        cliente.requisitar("visao_paciente", "GET", "/user/paciente", esperados=(200,))
+        agendamento_id, data = rng.choice(agendamentos)
+        dia = (date.fromisoformat(data) + timedelta(days=rng.randint(0, 7))).isoformat()
+        status, corpo, _ok = cliente.requisitar(
+            "paciente_horarios", "GET", f"/user/paciente/horarios_disponiveis?agendamento_id={agendamento_id}&dia={dia}",
+            esperados=(200,),
+        )
+        livres = json.loads(corpo) if status == 200 else []
+        if livres:
+            cliente.requisitar("solicitar_ajuste", "POST", f"/user/paciente/solicitar_ajuste/{agendamento_id}", form={
+                "novo_dia": dia, "nova_hora": rng.choice(livres), "motivo": "teste de carga",
+            }, destino=PAINEIS["paciente"])
+        time.sleep(pensar_s)
+
+
+ROTEIROS = {"recepcionista": _recepcionista, "medico": _medico, "paciente": _paciente}
+
+
+# ---------- preparação e verificação ----------
+def _dados(caminho, rng):
+    conn = sqlite3.connect(caminho)
+    hoje = date.today().isoformat()
+    try:
+        def coluna(sql, params=()):
+            return [linha[0] for linha in conn.execute(sql, params)]
+
+        agenda_medicos = {}
+        for email, ag_id in conn.execute("""
+            SELECT u.email, a.id FROM agendamentos a JOIN usuarios u ON u.id = a.medico_id
+            WHERE a.data = ? AND a.status IN ('agendado', 'em atendimento') AND u.email LIKE '%@sintetico.local'
+        """, (hoje,)):
+            agenda_medicos.setdefault(email, []).append(ag_id)
+        agenda_pacientes = {}
+        for email, ag_id, data in conn.execute("""
+            SELECT u.email, a.id, a.data FROM agendamentos a JOIN usuarios u ON u.id = a.paciente_id
+            WHERE a.data > ? AND a.status = 'agendado' AND u.email LIKE '%@sintetico.local'
+        """, (hoje,)):
+            agenda_pacientes.setdefault(email, []).append((ag_id, data))
+        pacientes = list(agenda_pacientes.items())
+        rng.shuffle(pacientes)
+        return {
+            "recepcionista": coluna("SELECT email FROM usuarios WHERE tipo_usuario='recepcionista' AND email LIKE '%@sintetico.local' LIMIT 1")[0],
+            "medicos": coluna("SELECT id FROM usuarios WHERE tipo_usuario='medico' AND email LIKE '%@sintetico.local'"),
+            "pacientes": coluna("SELECT id FROM usuarios WHERE tipo_usuario='paciente' AND email LIKE '%@sintetico.local'"),
+            "salas": coluna("SELECT id FROM salas"),
+            "procedimento": coluna("SELECT id FROM procedimentos ORDER BY id LIMIT 1")[0],
+            "agenda_medicos": list(agenda_medicos.items()),
+            "agenda_pacientes": pacientes[:500],
+            "agendamentos_antes": conn.execute("SELECT COUNT(*) FROM agendamentos").fetchone()[0],
+        }
+    finally:
+        conn.close()
+
+
+def violacoes_reserva(caminho):
+    """Slots de sala/médico com mais de um agendamento ativo (deve ser 0 e 0)."""
+    conn = sqlite3.connect(caminho)
+    try:
+        resultado = {}
+        for recurso in ("sala_id", "medico_id"):
+            resultado[recurso] = conn.execute(f"""
+                SELECT COUNT(*) FROM (
+                    SELECT 1 FROM agendamentos
+                    WHERE status <> 'cancelado' AND conflito_legado = 0
+                    GROUP BY {recurso}, data, hora HAVING COUNT(*) > 1
+                )
+            """).fetchone()[0]
+        resultado["agendamentos"] = conn.execute("SELECT COUNT(*) FROM agendamentos").fetchone()[0]
+        return resultado
+    finally:
+        conn.close()
+
+
+def _porta_livre():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _subir_servidor(tmp, banco, processos, env_extra):
+    porta = _porta_livre()
+    env = dict(os.environ)
+    env.update({
+        "FLASK_DB_PATH": banco,
+        "FLASK_METRICAS_DIR": "",
+        "FLASK_PERFIS_DIR": "",
+        "FLASK_RELATORIOS_CACHE_DIR": os.path.join(tmp, "cache_relatorios"),
+    })
+    env.update(env_extra or {})
+    log = open(os.path.join(tmp, "servidor.log"), "w+b")
+    processo = subprocess.Popen(
+        [sys.executable, "-m", "ferramentas.servidor_carga", "--porta", str(porta), "--processos", str(processos)],
+        cwd=BASE_DIR, env=env, stdout=log, stderr=subprocess.STDOUT,
+    )
+    limite = time.monotonic() + 60
+    while time.monotonic() < limite:
+        if processo.poll() is not None:
+            log.seek(0)
+            raise RuntimeError("servidor de carga não subiu:\n" + log.read().decode(errors="replace")[-2000:])
+        try:
+            socket.create_connection(("127.0.0.1", porta), timeout=1).close()
+            return processo, porta, log
+        except OSError:
+            time.sleep(0.2)
+    processo.kill()
+    raise RuntimeError("servidor de carga não respondeu em 60s")
+
+
+def executar_carga(banco, usuarios, duracao_s=30, processos=0, pensar_ms=0, semente=42, env_extra=None):
+    """
+    Roda `usuarios` ({"recepcionista": n, "medico": n, "paciente": n}) por
+    `duracao_s` contra uma cópia de `banco`. Devolve o relatório
+    {operacoes: {nome: {...}}, requisicoes_s, locks_servidor, violacoes, novos_agendamentos}.
+    """
+    rng = random.Random(semente)
+    tmp = tempfile.mkdtemp(prefix="carga-")
+    try:
+        copia = os.path.join(tmp, "carga.db")
+        origem, destino = sqlite3.connect(banco), sqlite3.connect(copia)
+        origem.backup(destino)  # cópia consistente mesmo com o WAL ativo
+        origem.close()
+        destino.close()
+        dados = _dados(copia, rng)
+
+        processo, porta, log = _subir_servidor(tmp, copia, processos, env_extra)
+        coletor = Coletor()
+        try:
+            ate = time.monotonic() + duracao_s
+            threads = []
+            for perfil, quantidade in usuarios.items():
+                for _ in range(quantidade):
+                    args = (Cliente(porta, coletor), dados, random.Random(rng.random()), ate, pensar_ms / 1000)
+                    threads.append(threading.Thread(target=ROTEIROS[perfil], args=args, daemon=True))
+            inicio = time.monotonic()
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            decorrido = time.monotonic() - inicio
+        finally:
+            processo.terminate()
+            try:
+                processo.wait(10)
+            except subprocess.TimeoutExpired:
+                processo.kill()
+            log.seek(0)
+            locks_servidor = log.read().count(LOCK)
+            log.close()
+
+        violacoes = violacoes_reserva(copia)
+        operacoes = {}
+        total = 0
+        for nome, item in sorted(coletor.operacoes.items()):
+            tempos = sorted(item.pop("tempos"))
+            total += len(tempos)
+            quantis = statistics.quantiles(tempos, n=100, method="inclusive") if len(tempos) > 1 else tempos * 99
+            operacoes[nome] = {
+                "n": len(tempos), **item,
+                "p50_ms": round(quantis[49], 2), "p95_ms": round(quantis[94], 2),
+                "p99_ms": round(quantis[98], 2), "max_ms": round(tempos[-1], 2),
+            }
+        return {
+            "operacoes": operacoes,
+            "requisicoes_s": total / decorrido if decorrido else 0.0,
+            "locks_servidor": locks_servidor,
+            "violacoes": violacoes,
+            "novos_agendamentos": violacoes["agendamentos"] - dados["agendamentos_antes"],
+        }
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
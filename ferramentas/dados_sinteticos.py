@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""
+Gerador de uma clínica sintética para benchmarks: médicos, pacientes,
+salas e anos de agendamentos (com chamadas e solicitações de ajuste) em
+proporções realistas. Tudo entra por `executemany` em transações grandes,
+passando pelos mesmos triggers da aplicação (contadores, FTS, versões), e
+a mesma semente e a mesma data de `referencia` (o "hoje" do banco) geram
+sempre o mesmo banco.
+"""
+import random
+from datetime import date, timedelta
+
+from werkzeug.security import generate_password_hash
+
+from databaser import PoolConexoes, grade_horarios, migrar
+
+SENHA = "sintetico"  # senha de todos os usuários gerados
+DIAS_FUTUROS = 60
+CONVENIOS = ("Unimed", "Bradesco Saúde", "SulAmérica", "Amil", "Hapvida", "Porto Saúde")
+PRENOMES = (
+    "Ana", "Álvaro", "Beatriz", "Bruno", "Caio", "Cecília", "Débora", "Eduardo", "Érica",
+    "Fábio", "Gabriela", "Heitor", "Íris", "João", "Júlia", "Lucas", "Márcia", "Otávio",
+    "Paula", "Raí", "Sérgio", "Tânia", "Úrsula", "Vinícius",
+)
+SOBRENOMES = (
+    "Araújo", "Barbosa", "Conceição", "Fernandes", "Gonçalves", "Lima", "Magalhães",
+    "Nascimento", "Oliveira", "Pereira", "Ribeiro", "Simões", "Souza", "Tavares",
+)
+NOTAS = ("Retorno em 30 dias.", "Solicitar exames de rotina.", "Paciente estável.", "Ajustar medicação.")
+
+# status por período: (status, peso)
+MIX_PASSADO = (("concluido", 78), ("cancelado", 15), ("agendado", 7))
+MIX_HOJE = (("concluido", 35), ("em atendimento", 10), ("agendado", 47), ("cancelado", 8))
+MIX_FUTURO = (("agendado", 92), ("cancelado", 8))
+
+
+def _sortear(rng, mix):
+    return rng.choices([s for s, _ in mix], weights=[p for _, p in mix])[0]
+
+
+def _nome(rng):
+    return f"{rng.choice(PRENOMES)} {rng.choice(SOBRENOMES)} {rng.choice(SOBRENOMES)}"
+
+
+def _proximo_id(cur, tabela):
+    return (cur.execute(f"SELECT COALESCE(MAX(id), 0) FROM {tabela}").fetchone()[0] or 0) + 1
+
+
+def _dias_uteis(inicio, fim, hoje):
+    # hoje sempre tem expediente: as telas do dia medem o mesmo volume em qualquer dia da semana
+    dia = inicio
+    while dia <= fim:
+        if dia.weekday() < 5 or dia == hoje:
+            yield dia
+        dia += timedelta(days=1)
+
+
+def gerar_clinica(caminho, medicos=40, pacientes=5000, salas=12, anos=2, ocupacao=0.6,
+                  semente=42, referencia=None, lote=20000, progresso=None):
+    """
+    Cria (ou completa) o banco em `caminho` e gera os dados. `ocupacao` é a
+    chance de cada par médico/horário estar agendado, limitada pelas salas
+    livres; `referencia` ('AAAA-MM-DD' ou date, padrão hoje) é o dia tratado
+    como hoje, com histórico antes dele e agenda depois. Devolve a contagem de linhas inseridas por tabela e os ids
+    usados ({"medicos": [...], "pacientes": [...], "salas": [...], ...}).
+    """
+    rng = random.Random(semente)
+    hoje = date.fromisoformat(str(referencia)) if referencia else date.today()
+    grade = grade_horarios(30)
+    pool = PoolConexoes({"DB_PATH": caminho, "DB_POOL_SIZE": 1})
+    try:
+        migrar(pool)
+        conn = pool.obter()
+        try:
+            return _gerar(conn, rng, hoje, grade, medicos, pacientes, salas, anos, ocupacao, lote, progresso)
+        finally:
+            conn.close()
+    finally:
+        pool.fechar_todas()
+
+
+def _inserir(conn, sql, linhas, lote, contagem, tabela, progresso):
+    for i in range(0, len(linhas), lote):
+        conn.execute("BEGIN IMMEDIATE")
+        conn.executemany(sql, linhas[i:i + lote])
+        conn.commit()
+    contagem[tabela] = contagem.get(tabela, 0) + len(linhas)
+    if progresso and linhas:
+        progresso(tabela, contagem[tabela])
+
+
+def _gerar(conn, rng, hoje, grade, n_medicos, n_pacientes, n_salas, anos, ocupacao, lote, progresso):
+    cur = conn.cursor()
+    contagem = {}
+    senha_hash = generate_password_hash(SENHA)
+    sufixo = f"{rng.randrange(16 ** 6):06x}"  # permite rodar de novo no mesmo banco
+
+    # ---------- cadastros ----------
+    proximo = _proximo_id(cur, "usuarios")
+    usuarios, ids = [], {"medicos": [], "pacientes": [], "recepcionistas": []}
+    for tipo, chave, quantidade in (
+        ("medico", "medicos", n_medicos),
+        ("paciente", "pacientes", n_pacientes),
+        ("recepcionista", "recepcionistas", 2),
+    ):
+        for i in range(quantidade):
+            usuarios.append((proximo, _nome(rng), f"{tipo}{i}.{sufixo}@sintetico.local", senha_hash, tipo))
+            ids[chave].append(proximo)
+            proximo += 1
+    _inserir(conn, "INSERT INTO usuarios (id, nome, email, senha, tipo_usuario) VALUES (?, ?, ?, ?, ?)",
+             usuarios, lote, contagem, "usuarios", progresso)
+
+    proximo = _proximo_id(cur, "salas")
+    salas = [(proximo + i, f"Sala {sufixo}-{i + 1}", 1) for i in range(n_salas)]
+    ids["salas"] = [s[0] for s in salas]
+    _inserir(conn, "INSERT INTO salas (id, nome, capacidade) VALUES (?, ?, ?)", salas, lote, contagem, "salas", progresso)
+
+    procedimentos = {row["nome"]: row["id"] for row in cur.execute("SELECT id, nome FROM procedimentos")}
+    particulares = [i for n, i in procedimentos.items() if n != "Consulta Convênio"] or list(procedimentos.values())
+    convenio_id = procedimentos.get("Consulta Convênio", particulares[0])
+
+    # ---------- agendamentos ----------
+    proximo_ag = _proximo_id(cur, "agendamentos")
+    proxima_chamada = _proximo_id(cur, "chamadas_pacientes")
+    agendamentos, chamadas, ajustes = [], [], []
+    inicio = hoje - timedelta(days=365 * anos)
+    fim = hoje + timedelta(days=DIAS_FUTUROS)
+    sql_agendamento = """
+        INSERT INTO agendamentos (id, paciente_id, medico_id, procedimento_id, sala_id, data, hora, status, convenio, notas)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """
+    sql_chamada = """
+        INSERT INTO chamadas_pacientes (id, agendamento_id, medico_id, paciente_id, status, criado_em, encaminhado_em)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """
+    sql_ajuste = """
+        INSERT INTO agendamento_ajustes (agendamento_id, novo_dia, nova_hora, motivo, status, criado_em)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """
+    for dia in _dias_uteis(inicio, fim, hoje):
+        data = dia.isoformat()
+        mix = MIX_PASSADO if dia < hoje else MIX_HOJE if dia == hoje else MIX_FUTURO
+        for hora in grade:
+            salas_livres = ids["salas"][:]
+            rng.shuffle(salas_livres)
+            ocupados = set()
+            medicos_hora = ids["medicos"][:]
+            rng.shuffle(medicos_hora)
+            for medico_id in medicos_hora:
+                if not salas_livres:
+                    break
+                if rng.random() >= ocupacao:
+                    continue
+                paciente_id = rng.choice(ids["pacientes"])
+                if paciente_id in ocupados:
+                    continue
+                ocupados.add(paciente_id)
+                status = _sortear(rng, mix)
+                # cancelados não ocupam a sala (fora do índice único)
+                sala_id = salas_livres[-1] if status == "cancelado" else salas_livres.pop()
+                convenio = rng.choice(CONVENIOS) if rng.random() < 0.4 else None
+                procedimento = convenio_id if convenio else rng.choice(particulares)
+                notas = rng.choice(NOTAS) if status == "concluido" and rng.random() < 0.3 else None
+                ag_id = proximo_ag
+                proximo_ag += 1
+                agendamentos.append((ag_id, paciente_id, medico_id, procedimento, sala_id, data, hora, status, convenio, notas))
+
+                momento = f"{data}T{hora}:00"
+                if status == "concluido" and rng.random() < 0.6:
+                    chamadas.append((proxima_chamada, ag_id, medico_id, paciente_id, "encerrado", momento, momento))
+                    proxima_chamada += 1
+                elif status == "em atendimento":
+                    estado = rng.choice(("pendente", "encaminhado"))
+                    chamadas.append((proxima_chamada, ag_id, medico_id, paciente_id, estado, momento,
+                                     momento if estado == "encaminhado" else None))
+                    proxima_chamada += 1
+
+                if status == "agendado" and dia >= hoje and rng.random() < 0.03:
+                    novo = dia + timedelta(days=rng.randint(1, 14))
+                    ajustes.append((ag_id, novo.isoformat(), rng.choice(grade), "Conflito de agenda",
+                                    "pendente", f"{hoje.isoformat()}T07:00:00"))
+                elif dia < hoje and rng.random() < 0.02:
+                    novo = dia + timedelta(days=rng.randint(1, 14))
+                    ajustes.append((ag_id, novo.isoformat(), rng.choice(grade), "Viagem",
+                                    rng.choice(("aceito", "negado")), f"{(dia - timedelta(days=3)).isoformat()}T10:00:00"))
+
+        if len(agendamentos) >= lote:
+            _inserir(conn, sql_agendamento, agendamentos, lote, contagem, "agendamentos", progresso)
+            _inserir(conn, sql_chamada, chamadas, lote, contagem, "chamadas_pacientes", progresso)
+            agendamentos, chamadas = [], []
+
+    _inserir(conn, sql_agendamento, agendamentos, lote, contagem, "agendamentos", progresso)
+    _inserir(conn, sql_chamada, chamadas, lote, contagem, "chamadas_pacientes", progresso)
+    _inserir(conn, sql_ajuste, ajustes, lote, contagem, "agendamento_ajustes", progresso)
+
+    conn.execute("ANALYZE")  # estatísticas do planner para o volume gerado
+    conn.commit()
+    return {"linhas": contagem, "ids": ids}
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""
+Teste de estresse da reserva atômica: várias threads, cada uma com a própria
+conexão, tentam reservar o mesmo slot ao mesmo tempo num banco temporário.
+"""
+import os
+import tempfile
+import threading
+
+from databaser import PoolConexoes, ConflitoHorario, inserir_agendamento, migrar
+
+DATA = "2030-01-07"
+
+
+def _preparar(pool, n):
+    conn = pool.obter()
+    cur = conn.cursor()
+    ids = {"medicos": [], "pacientes": [], "salas": []}
+    for i in range(n):
+        cur.execute(
+            "INSERT INTO usuarios (nome, email, senha, tipo_usuario) VALUES (?, ?, '-', 'medico')",
+            (f"Médico {i}", f"medico{i}@estresse.local"),
+        )
+        ids["medicos"].append(cur.lastrowid)
+        cur.execute(
+            "INSERT INTO usuarios (nome, email, senha, tipo_usuario) VALUES (?, ?, '-', 'paciente')",
+            (f"Paciente {i}", f"paciente{i}@estresse.local"),
+        )
+        ids["pacientes"].append(cur.lastrowid)
+        cur.execute("INSERT INTO salas (nome, capacidade) VALUES (?, 1)", (f"Sala estresse {i}",))
+        ids["salas"].append(cur.lastrowid)
+    cur.execute("SELECT id FROM procedimentos ORDER BY id LIMIT 1")
+    ids["procedimento"] = cur.fetchone()["id"]
+    conn.commit()
+    conn.close()
+    return ids
+
+
+def _rodada(pool, hora, tentativas, filtro):
+    barreira = threading.Barrier(len(tentativas))
+    resultado = {"vencedores": 0, "conflitos": 0, "erros": []}
+    lock = threading.Lock()
+
+    def reservar(args):
+        conn = pool.obter()
+        try:
+            barreira.wait()
+            inserir_agendamento(conn, *args)
+            chave = "vencedores"
+        except ConflitoHorario:
+            chave = "conflitos"
+        except Exception as e:  # lock não resolvido, etc.
+            with lock:
+                resultado["erros"].append(repr(e))
+            return
+        finally:
+            conn.close()
+        with lock:
+            resultado[chave] += 1
+
+    threads = [threading.Thread(target=reservar, args=(t,)) for t in tentativas]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    conn = pool.obter()
+    resultado["no_banco"] = conn.execute(
+        f"SELECT COUNT(*) FROM agendamentos WHERE data=? AND hora=? AND {filtro}", (DATA, hora)
+    ).fetchone()[0]
+    conn.close()
+    return resultado
+
+
+def estressar_reserva(threads=32):
+    """
+    Duas rodadas de `threads` reservas simultâneas em DATA: mesma sala com
+    médicos diferentes (09:00) e mesmo médico com salas diferentes (09:30).
+    Retorna {rodada: {vencedores, conflitos, erros, no_banco}}.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        pool = PoolConexoes({"DB_PATH": os.path.join(tmp, "estresse.db"), "DB_POOL_SIZE": threads})
+        try:
+            migrar(pool)
+            ids = _preparar(pool, threads)
+            proc = ids["procedimento"]
+            sala, medico = ids["salas"][0], ids["medicos"][0]
+            resultados = {
+                "mesma sala": _rodada(pool, "09:00", [
+                    (ids["pacientes"][i], ids["medicos"][i], proc, sala, DATA, "09:00")
+                    for i in range(threads)
+                ], f"sala_id={int(sala)}"),
+                "mesmo médico": _rodada(pool, "09:30", [
+                    (ids["pacientes"][i], medico, proc, ids["salas"][i], DATA, "09:30")
+                    for i in range(threads)
+                ], f"medico_id={int(medico)}"),
+            }
+        finally:
+            pool.fechar_todas()
+    return resultados
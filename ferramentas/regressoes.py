@@ -0,0 +1,362 @@
+# -*- coding: utf-8 -*-
+"""
+Verificações de regressão de comportamentos já corrigidos, cada uma num
+banco temporário migrado do zero: o pool global aponta para ele durante a
+verificação (como no benchmark) e as requisições passam pelo test client
+com a sessão já autenticada. `flask --app main verificar-regressoes`.
+"""
+import os
+import shutil
+import sqlite3
+import tempfile
+from contextlib import contextmanager
+
+import databaser
+import referencias
+from databaser import CONFIG_PADRAO, configurar_pool, migrar
+
+DIA = "2030-01-07"
+
+
+@contextmanager
+def _banco_temporario(app):
+    """Pool global num banco novo; devolve o caminho do arquivo."""
+    diretorio = tempfile.mkdtemp(prefix="regressao-")
+    caminho = os.path.join(diretorio, "clinica.db")
+    config_original = {chave: app.config[chave] for chave in CONFIG_PADRAO}
+    pool = configurar_pool({**config_original, "DB_PATH": caminho})
+    databaser.invalidar_ocupacao()
+    referencias.cache.limpar()
+    try:
+        migrar(pool)
+        yield caminho
+    finally:
+        configurar_pool(config_original)
+        databaser.invalidar_ocupacao()
+        referencias.cache.limpar()
+        shutil.rmtree(diretorio, ignore_errors=True)
+
+
+def _cadastrar(caminho, **quantidades):
+    """Insere médicos/pacientes/salas por uma conexão própria; devolve os ids."""
+    conn = sqlite3.connect(caminho)
+    try:
+        ids = {}
+        for tipo, n in quantidades.items():
+            ids[tipo] = []
+            for i in range(n):
+                if tipo == "salas":
+                    cur = conn.execute("INSERT INTO salas (nome, capacidade) VALUES (?, 1)", (f"Sala regressão {i}",))
+                else:
+                    cur = conn.execute(
+                        "INSERT INTO usuarios (nome, email, senha, tipo_usuario) VALUES (?, ?, '-', ?)",
+                        (f"{tipo} {i}", f"{tipo}{i}@regressao.local", tipo.rstrip("s")),
+                    )
+                ids[tipo].append(cur.lastrowid)
+        ids["procedimento"] = conn.execute("SELECT id FROM procedimentos ORDER BY id LIMIT 1").fetchone()[0]
+        conn.commit()
+        return ids
+    finally:
+        conn.close()
+
+
+def _cliente(app, tipo="recepcionista master", usuario_id=1):
+    cliente = app.test_client()
+    with cliente.session_transaction() as sessao:
+        sessao["usuario_id"] = usuario_id
+        sessao["usuario_nome"] = "Regressão"
+        sessao["usuario_tipo"] = tipo
+    return cliente
+
+
+def _get(app, cliente, url, **kwargs):
+    # app context próprio: dentro do `flask ...` as requisições do test client
+    # reaproveitariam o do comando (e com ele g, versões e conexão vinculada)
+    with app.app_context():
+        resposta = cliente.get(url, **kwargs)
+        resposta.get_data()
+    return resposta
+
+
+def _post(app, cliente, url, **kwargs):
+    with app.app_context():
+        resposta = cliente.post(url, **kwargs)
+        resposta.get_data()
+    return resposta
+
+
+# ---------- verificações ----------
+def etag_disponibilidade(app):
+    """
+    Escrita por outra conexão muda o ETag E o corpo de horarios_disponiveis
+    (sem esperar o TTL do índice de ocupação) e o ETag antigo não gera 304.
+    """
+    with _banco_temporario(app) as caminho:
+        ids = _cadastrar(caminho, medicos=1, pacientes=1, salas=1)
+        medico, sala = ids["medicos"][0], ids["salas"][0]
+        url = f"/user/recepcionista/horarios_disponiveis?medico_id={medico}&sala_id={sala}&dia={DIA}"
+        cliente = _cliente(app)
+
+        primeira = _get(app, cliente, url)
+        etag_antigo = primeira.headers.get("ETag")
+        if primeira.status_code != 200 or "08:00" not in primeira.get_json():
+            return False, f"resposta inicial inesperada: {primeira.status_code}"
+
+        conn = sqlite3.connect(caminho)
+        conn.execute(
+            """INSERT INTO agendamentos (paciente_id, medico_id, procedimento_id, sala_id, data, hora)
+               VALUES (?, ?, ?, ?, ?, '08:00')""",
+            (ids["pacientes"][0], medico, ids["procedimento"], sala, DIA),
+        )
+        conn.commit()
+        conn.close()
+
+        segunda = _get(app, cliente, url, headers={"If-None-Match": etag_antigo})
+        if segunda.status_code != 200:
+            return False, f"ETag anterior à escrita respondeu {segunda.status_code}"
+        if "08:00" in segunda.get_json():
+            return False, "ETag novo com o corpo antigo (08:00 ainda livre)"
+        terceira = _get(app, cliente, url, headers={"If-None-Match": segunda.headers.get("ETag")})
+        if terceira.status_code != 304:
+            return False, f"ETag atual respondeu {terceira.status_code} em vez de 304"
+        return True, "corpo e ETag acompanham a escrita externa; 304 só no ETag atual"
+
+
+def ocupacao_write_through(app):
+    """
+    Agendar pela rota atualiza as entradas do índice de ocupação já
+    carregadas e as carimba com a versão pós-commit: a próxima consulta as
+    reaproveita (sem recarregar do banco) e já mostra o horário ocupado.
+    """
+    from ocupacao import MEDICO, SALA
+
+    with _banco_temporario(app) as caminho:
+        ids = _cadastrar(caminho, medicos=1, pacientes=1, salas=1)
+        medico, sala = ids["medicos"][0], ids["salas"][0]
+        url = f"/user/recepcionista/horarios_disponiveis?medico_id={medico}&sala_id={sala}&dia={DIA}"
+        cliente = _cliente(app)
+        _get(app, cliente, url)
+
+        resposta = _post(app, cliente, "/user/agendar_consulta", json={
+            "paciente_id": str(ids["pacientes"][0]), "medico_id": str(medico), "sala_id": str(sala),
+            "procedimento_id": str(ids["procedimento"]), "data": DIA, "hora": "08:00",
+        })
+        if resposta.status_code != 200 or not resposta.get_json().get("ok"):
+            return False, f"agendamento falhou: {resposta.status_code} {resposta.get_data(as_text=True)[:80]}"
+
+        with app.app_context():
+            versao = databaser.versoes_dados().get("agendamentos")
+        chaves = [(SALA, sala, DIA), (MEDICO, medico, DIA)]
+        entradas = databaser.ocupacao.consultar(chaves, versao)
+        if len(entradas) != 2:
+            return False, f"entradas descartadas após a escrita local (versão {versao})"
+        if any("08:00" not in entrada.horas.values() for entrada in entradas.values()):
+            return False, "entradas mantidas sem o novo horário"
+        if "08:00" in _get(app, cliente, url).get_json():
+            return False, "08:00 continua livre após agendar"
+        return True, f"entradas seguem válidas na versão {versao} com 08:00 ocupado"
+
+
+def serie_simulada(app):
+    """
+    Simular uma série com procedimento textual ainda inexistente não grava
+    nada: nem agendamentos nem a linha nova em `procedimentos`.
+    """
+    with _banco_temporario(app) as caminho:
+        ids = _cadastrar(caminho, medicos=1, pacientes=1, salas=1)
+
+        def contagens():
+            conn = sqlite3.connect(caminho)
+            try:
+                return tuple(conn.execute(f"SELECT COUNT(*) FROM {t}").fetchone()[0]
+                             for t in ("procedimentos", "agendamentos"))
+            finally:
+                conn.close()
+
+        antes = contagens()
+        resposta = _post(app, _cliente(app), "/user/recepcionista/agendar_serie", json={
+            "paciente_id": ids["pacientes"][0], "medico_id": ids["medicos"][0], "sala_id": ids["salas"][0],
+            "procedimento_id": "Procedimento só da simulação", "inicio": DIA, "hora": "09:00",
+            "frequencia": "semanal", "ocorrencias": 3, "simular": True,
+        })
+        if resposta.status_code != 200 or len(resposta.get_json().get("livres", [])) != 3:
+            return False, f"simulação respondeu {resposta.status_code}: {resposta.get_data(as_text=True)[:80]}"
+        depois = contagens()
+        if depois != antes:
+            return False, f"(procedimentos, agendamentos) {antes} -> {depois} numa simulação"
+        return True, "3 ocorrências livres e nenhuma linha gravada"
+
+
+def conflito_integridade(app):
+    """
+    Só os índices únicos de horário viram ConflitoHorario (409/aviso de
+    horário ocupado); NOT NULL e outras violações seguem como IntegrityError.
+    """
+    with _banco_temporario(app) as caminho:
+        ids = _cadastrar(caminho, medicos=2, pacientes=1, salas=2)
+        (medico, outro_medico), (paciente,), (sala, outra_sala) = ids["medicos"], ids["pacientes"], ids["salas"]
+        procedimento = ids["procedimento"]
+        recursos = []
+        with app.app_context():
+            conn = databaser.conectar()
+            databaser.inserir_agendamento(conn, paciente, medico, procedimento, sala, DIA, "09:00")
+            for args in ((paciente, outro_medico, procedimento, sala), (paciente, medico, procedimento, outra_sala)):
+                try:
+                    databaser.inserir_agendamento(conn, *args, DIA, "09:00")
+                    recursos.append(None)
+                except databaser.ConflitoHorario as e:
+                    recursos.append(e.recurso)
+            try:
+                databaser.inserir_agendamento(conn, None, medico, procedimento, sala, DIA, "10:00")
+                return False, "agendamento sem paciente foi gravado"
+            except databaser.ConflitoHorario as e:
+                return False, f"NOT NULL de paciente_id virou conflito de {e.recurso}"
+            except sqlite3.IntegrityError:
+                pass
+        if recursos != ["sala", "medico"]:
+            return False, f"conflitos {recursos} em vez de ['sala', 'medico']"
+        # outro UNIQUE (nome de procedimento): quem remarca ou aceita ajuste não pode chamá-lo de horário ocupado
+        conn = sqlite3.connect(caminho)
+        try:
+            conn.execute("INSERT INTO procedimentos (nome) SELECT nome FROM procedimentos WHERE id = ?", (procedimento,))
+            return False, "nome de procedimento duplicado foi gravado"
+        except sqlite3.IntegrityError as e:
+            recurso = databaser.recurso_em_conflito(e)
+        finally:
+            conn.close()
+        if recurso is not None:
+            return False, f"UNIQUE de procedimentos.nome virou conflito de {recurso}"
+        return True, "sala e médico duplicados viram conflito; NOT NULL e outros UNIQUE seguem como IntegrityError"
+
+
+def alternativa_paciente(app):
+    """
+    A alternativa sugerida para uma ocorrência em conflito não cai num
+    horário em que o paciente já tem outra consulta (com outro médico e sala).
+    """
+    with _banco_temporario(app) as caminho:
+        ids = _cadastrar(caminho, medicos=2, pacientes=2, salas=2)
+        (medico, outro_medico), (paciente, outro_paciente) = ids["medicos"], ids["pacientes"]
+        (sala, outra_sala) = ids["salas"]
+        conn = sqlite3.connect(caminho)
+        conn.executemany(
+            """INSERT INTO agendamentos (paciente_id, medico_id, procedimento_id, sala_id, data, hora)
+               VALUES (?, ?, ?, ?, ?, ?)""",
+            [
+                (outro_paciente, outro_medico, ids["procedimento"], sala, DIA, "09:00"),  # sala ocupada
+                (paciente, outro_medico, ids["procedimento"], outra_sala, DIA, "08:30"),  # paciente ocupado
+            ],
+        )
+        conn.commit()
+        conn.close()
+
+        resposta = _post(app, _cliente(app), "/user/recepcionista/agendar_serie", json={
+            "paciente_id": paciente, "medico_id": medico, "sala_id": sala,
+            "procedimento_id": str(ids["procedimento"]), "inicio": DIA, "hora": "09:00",
+            "frequencia": "semanal", "ocorrencias": 1, "simular": True,
+        })
+        conflitos = (resposta.get_json() or {}).get("conflitos") or []
+        if len(conflitos) != 1 or not conflitos[0].get("alternativa"):
+            return False, f"esperava 1 conflito com alternativa: {resposta.get_data(as_text=True)[:120]}"
+        alternativa = conflitos[0]["alternativa"]
+        if alternativa == {"data": DIA, "hora": "08:30"}:
+            return False, "alternativa 08:30 coincide com outra consulta do paciente"
+        if alternativa != {"data": DIA, "hora": "09:30"}:
+            return False, f"alternativa inesperada: {alternativa}"
+        return True, "alternativa 09:30 (08:30 já é do paciente)"
+
+
+def periodo_invalido(app):
+    """
+    Data inicial/final ou mês inválidos no filtro não somem calados: a lista
+    avisa que o período não foi aplicado e a exportação responde 400.
+    """
+    with _banco_temporario(app):
+        cliente = _cliente(app)
+        for args in ("inicio=2030-13-01", "fim=07/01/2030", "mes=2030-1x"):
+            resposta = _get(app, cliente, f"/user/recepcionista?{args}")
+            if "Filtro de período inválido" not in resposta.get_data(as_text=True):
+                return False, f"lista com {args} sem aviso (HTTP {resposta.status_code})"
+            resposta = _get(app, cliente, f"/user/recepcionista/relatorios/exportar?{args}")
+            if resposta.status_code != 400:
+                return False, f"exportação com {args}: HTTP {resposta.status_code} em vez de 400"
+        resposta = _get(app, cliente, f"/user/recepcionista/relatorios/exportar?inicio={DIA}&fim={DIA}")
+        if resposta.status_code != 200:
+            return False, f"exportação com período válido: HTTP {resposta.status_code}"
+        return True, "aviso na lista e 400 na exportação para inicio, fim e mês inválidos"
+
+
+def paginacao_legados(app):
+    """
+    Legados com inicio_min NULL (data dd/mm/aaaa não reparada) atravessando a
+    fronteira de página: avançar e voltar pelos cursores passa por todos os
+    agendamentos, na ordem do ORDER BY, sem pular nem repetir nenhum.
+    """
+    from routes.user import _buscar_agendamentos_filtrados, _parametros_paginacao
+
+    with _banco_temporario(app) as caminho:
+        ids = _cadastrar(caminho, medicos=1, pacientes=1, salas=1)
+        conn = sqlite3.connect(caminho)
+        # banco anterior à validação: aceita a data legada como veio
+        conn.execute("DROP TRIGGER trg_valida_agendamento_insert")
+        for i in range(7):
+            data_ = f"0{i + 1}/02/2030" if i < 4 else f"2030-01-0{i + 1}"
+            conn.execute(
+                """INSERT INTO agendamentos (paciente_id, medico_id, procedimento_id, sala_id, data, hora)
+                   VALUES (?, ?, ?, ?, ?, '08:00')""",
+                (ids["pacientes"][0], ids["medicos"][0], ids["procedimento"], ids["salas"][0], data_),
+            )
+        conn.commit()
+        esperado = [row[0] for row in conn.execute(
+            "SELECT id FROM agendamentos ORDER BY inicio_min, id"
+        )]
+        legados = conn.execute("SELECT COUNT(*) FROM agendamentos WHERE inicio_min IS NULL").fetchone()[0]
+        conn.close()
+
+        with app.app_context():
+            vistos, args = [], {"por_pagina": "3"}
+            while True:
+                linhas, _totais, _filtros, paginacao = _buscar_agendamentos_filtrados({}, _parametros_paginacao(args))
+                vistos.extend(row["id"] for row in linhas)
+                if not paginacao["proximo"] or len(vistos) > len(esperado):
+                    break
+                args = {"por_pagina": "3", "apos": paginacao["proximo"]}
+            if vistos != esperado:
+                return False, f"avançando: {vistos} em vez de {esperado}"
+
+            # da última página de volta ao início
+            anteriores = esperado[:len(esperado) - len(linhas)]
+            voltando, antes = [], paginacao["anterior"]
+            while antes and len(voltando) <= len(esperado):
+                linhas, _totais, _filtros, paginacao = _buscar_agendamentos_filtrados(
+                    {}, _parametros_paginacao({"por_pagina": "3", "antes": antes})
+                )
+                voltando[:0] = [row["id"] for row in linhas]
+                antes = paginacao["anterior"]
+            if voltando != anteriores:
+                return False, f"voltando: {voltando} em vez de {anteriores}"
+        return True, f"{len(esperado)} agendamentos ({legados} legados) em páginas de 3, nos dois sentidos"
+
+
+VERIFICACOES = {
+    "alternativa_paciente": alternativa_paciente,
+    "conflito_integridade": conflito_integridade,
+    "etag_disponibilidade": etag_disponibilidade,
+    "ocupacao_write_through": ocupacao_write_through,
+    "paginacao_legados": paginacao_legados,
+    "periodo_invalido": periodo_invalido,
+    "serie_simulada": serie_simulada,
+}
+
+
+def verificar_regressoes(app, nomes=None):
+    """{nome: (ok, detalhe)} das verificações escolhidas (todas por padrão)."""
+    resultados = {}
+    for nome, verificar in VERIFICACOES.items():
+        if nomes and nome not in nomes:
+            continue
+        try:
+            resultados[nome] = verificar(app)
+        except Exception as e:
+            resultados[nome] = (False, repr(e))
+    return resultados
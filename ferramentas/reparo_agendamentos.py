@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""
+Reparo offline de `agendamentos` legados: status, data e hora com formatos
+antigos ou marcadores de conflito de merge são normalizados em lotes por id,
+cada lote lido e gravado na mesma transação curta (BEGIN IMMEDIATE). O
+último id processado fica em `reparo_progresso`, então uma execução
+interrompida continua de onde parou.
+"""
+import sqlite3
+from datetime import datetime
+
+from databaser import conectar, invalidar_ocupacao, recurso_em_conflito
+from normalizacao import (
+    STATUS_VALIDOS, normalizar_status, normalizar_data, normalizar_hora, data_valida, hora_valida
+)
+
+NOME_REPARO = "agendamentos"
+
+SQL_ATUALIZA = "UPDATE agendamentos SET status=?, data=?, hora=? WHERE id=?"
+
+
+def _normalizar_linha(row):
+    """(status, data, hora, id) normalizados da linha."""
+    return (
+        normalizar_status(row["status"], STATUS_VALIDOS),
+        normalizar_data(row["data"]),
+        normalizar_hora(row["hora"]),
+        row["id"],
+    )
+
+
+def _valida(valores):
+    status, data_, hora_, _id = valores
+    return status in STATUS_VALIDOS and data_valida(data_) and hora_valida(hora_)
+
+
+def _salvar_progresso(cur, ultimo_id):
+    cur.execute(
+        """INSERT INTO reparo_progresso (nome, ultimo_id, atualizado_em) VALUES (?, ?, ?)
+           ON CONFLICT(nome) DO UPDATE SET ultimo_id=excluded.ultimo_id,
+                                           atualizado_em=excluded.atualizado_em""",
+        (NOME_REPARO, ultimo_id, datetime.now().isoformat(timespec="seconds")),
+    )
+
+
+def _aplicar_linha_a_linha(cur, atualizacoes):
+    """
+    Fallback quando o lote esbarra num índice único: aplica uma a uma; a que
+    colidir com outro agendamento no mesmo horário é marcada como conflito
+    legado (sai dos índices únicos).
+    """
+    corrigidas = marcadas = 0
+    for valores in atualizacoes:
+        cur.execute("SAVEPOINT linha")
+        try:
+            cur.execute(SQL_ATUALIZA, valores)
+            corrigidas += 1
+        except sqlite3.IntegrityError as e:
+            cur.execute("ROLLBACK TO linha")
+            if recurso_em_conflito(e) is None:
+                raise
+            cur.execute("UPDATE agendamentos SET conflito_legado=1 WHERE id=?", (valores[-1],))
+            cur.execute(SQL_ATUALIZA, valores)
+            corrigidas += 1
+            marcadas += 1
+        cur.execute("RELEASE linha")
+    return corrigidas, marcadas
+
+
+def reparar_agendamentos(tamanho_lote=500, reiniciar=False, progresso=None):
+    """
+    Normaliza `agendamentos` em lotes de `tamanho_lote` ids. `progresso`, se
+    informado, recebe o dict de totais após cada lote. Devolve os totais.
+    """
+    conn = conectar()
+    cur = conn.cursor()
+    if reiniciar:
+        cur.execute("DELETE FROM reparo_progresso WHERE nome=?", (NOME_REPARO,))
+        conn.commit()
+
+    cur.execute("SELECT ultimo_id FROM reparo_progresso WHERE nome=?", (NOME_REPARO,))
+    row = cur.fetchone()
+    ultimo_id = row["ultimo_id"] if row else 0
+    cur.execute("SELECT COUNT(*) FROM agendamentos WHERE id > ?", (ultimo_id,))
+    totais = {
+        "pendentes": cur.fetchone()[0],
+        "lidas": 0,
+        "corrigidas": 0,
+        "marcadas_conflito": 0,
+        "revisao_manual": 0,  # continuam inválidas mesmo normalizadas; ficam como estão
+        "ultimo_id": ultimo_id,
+    }
+
+    try:
+        while True:
+            # leitura já dentro da transação de escrita: entre o SELECT e o
+            # UPDATE ninguém altera o lote (sem isso a escrita de outra conexão
+            # seria sobrescrita pelos valores lidos antes dela)
+            cur.execute("BEGIN IMMEDIATE")
+            try:
+                cur.execute(
+                    "SELECT id, status, data, hora FROM agendamentos WHERE id > ? ORDER BY id LIMIT ?",
+                    (ultimo_id, tamanho_lote),
+                )
+                linhas = cur.fetchall()
+                if not linhas:
+                    conn.commit()
+                    break
+                atualizacoes = []
+                revisao_manual = 0
+                for row in linhas:
+                    valores = _normalizar_linha(row)
+                    if not _valida(valores):
+                        revisao_manual += 1
+                    elif valores != (row["status"], row["data"], row["hora"], row["id"]):
+                        atualizacoes.append(valores)
+
+                corrigidas = marcadas = 0
+                if atualizacoes:
+                    try:
+                        cur.execute("SAVEPOINT lote")
+                        cur.executemany(SQL_ATUALIZA, atualizacoes)
+                        cur.execute("RELEASE lote")
+                        corrigidas = len(atualizacoes)
+                    except sqlite3.IntegrityError:
+                        cur.execute("ROLLBACK TO lote")
+                        cur.execute("RELEASE lote")
+                        corrigidas, marcadas = _aplicar_linha_a_linha(cur, atualizacoes)
+                ultimo_id = linhas[-1]["id"]
+                _salvar_progresso(cur, ultimo_id)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+            totais["corrigidas"] += corrigidas
+            totais["marcadas_conflito"] += marcadas
+            totais["revisao_manual"] += revisao_manual
+            totais["lidas"] += len(linhas)
+            totais["ultimo_id"] = ultimo_id
+            if progresso:
+                progresso(dict(totais))
+    finally:
+        conn.close()
+
+    if totais["corrigidas"]:
+        invalidar_ocupacao()
+    return totais
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+"""
+Servidor WSGI usado pelo teste de carga (`flask --app main carga`), num
+processo separado do gerador de carga. A configuração vem das variáveis
+FLASK_* do ambiente (ex.: FLASK_DB_PATH aponta para a cópia do banco).
+
+    python -m ferramentas.servidor_carga --porta 8765 [--processos 4]
+"""
+import argparse
+
+from werkzeug.serving import make_server
+
+
+def servir():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--porta", type=int, required=True)
+    parser.add_argument("--processos", type=int, default=0, help="0: uma thread por requisição")
+    args = parser.parse_args()
+
+    import main as aplicacao  # só aqui: o import aplica migrações e lê FLASK_*
+    import senhas
+
+    senhas.pool.aquecer()  # a carga não mede o spawn dos processos de senha
+
+    servidor = make_server(
+        "127.0.0.1", args.porta, aplicacao.main,
+        threaded=args.processos <= 1, processes=max(args.processos, 1),
+    )
+    print("pronto", flush=True)
+    servidor.serve_forever()
+
+
+if __name__ == "__main__":  # o pool de senhas (spawn) reimporta este módulo
+    servir()
@@ -1,12 +1,44 @@
 from flask import Flask, render_template
-from databaser import criar_tabelas
+import chamadas
+import databaser
+import ferramentas
+import metricas
+import perfis
+import rastreio_sql
+import relatorios_cache
+import senhas
 from routes.user import user_bp
 
-# garante estrutura + seeds idempotentes
-criar_tabelas()
-
 main = Flask(__name__)
 main.secret_key = 'minha_chave_super_secreta_123'  # troque em produção
+main.config.from_prefixed_env()  # ex.: FLASK_DB_BUSY_TIMEOUT_MS=10000
+
+# pool de conexões SQLite (pragmas e tamanho via chaves DB_* do config)
+databaser.init_app(main)
+
+# hash/verificação de senhas num pool de processos (SENHAS_* no config)
+senhas.init_app(main)
+
+# cache em disco dos CSVs exportados (RELATORIOS_CACHE_* no config)
+relatorios_cache.init_app(main)
+
+# fluxo SSE das chamadas de pacientes (CHAMADAS_SSE_* no config)
+chamadas.init_app(main)
+
+# latência, status e SQL por endpoint em /metrics (METRICAS_* no config)
+metricas.init_app(main)
+
+# trace/log de SQL lento, desligado por padrão (SQL_RASTREIO_* no config)
+rastreio_sql.init_app(main)
+
+# cProfile por amostragem ou a pedido do admin (PERFIS_* no config)
+perfis.init_app(main)
+
+# comandos de operação (flask --app main <comando>)
+ferramentas.init_app(main)
+
+# aplica migrações pendentes uma única vez no boot (rotas não executam DDL)
+databaser.migrar()
 
 @main.route('/')
 def telaInicial():
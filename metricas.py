@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""
+Métricas por endpoint no formato de exposição do Prometheus (`/metrics`).
+
+Cada requisição soma, no próprio processo e sob um lock curto: histograma de
+latência, contagem de respostas por status e número/tempo de comandos SQL
+(contados por databaser.CursorMedido via `medicao_sql`). Com vários workers,
+cada processo grava de tempos em tempos um instantâneo em
+`METRICAS_DIR/<pid>.json` (`.tmp` + rename) e quem atende `/metrics` soma
+todos os arquivos; o próprio processo entra com os números em memória.
+Arquivos de processos que não gravam há `retencao_s` são descartados.
+"""
+import json
+import os
+import threading
+import time
+import uuid
+
+from flask import Response, g, request
+
+from databaser import BASE_DIR, medicao_sql
+
+PREFIXO = "clinica"
+# limites (segundos) do histograma de latência; +Inf é implícito
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Metricas:
+    def __init__(self, diretorio=None, intervalo_s=2.0, retencao_s=24 * 3600):
+        self.diretorio = diretorio
+        self.intervalo_s = intervalo_s
+        self.retencao_s = retencao_s
+        self._lock = threading.Lock()
+        self._ultima_gravacao = 0.0
+        self._zerar()
+
+    def _zerar(self):
+        self.latencia = {}   # (endpoint, metodo) -> [contagens por bucket..., +Inf, soma]
+        self.respostas = {}  # (endpoint, status) -> total
+        self.sql = {}        # endpoint -> [comandos, segundos]
+
+    # ---------- coleta ----------
+    def registrar(self, endpoint, metodo, status, duracao, sql_comandos, sql_segundos):
+        with self._lock:
+            serie = self.latencia.get((endpoint, metodo))
+            if serie is None:
+                serie = self.latencia[(endpoint, metodo)] = [0] * (len(BUCKETS) + 1) + [0.0]
+            for i, limite in enumerate(BUCKETS):
+                if duracao <= limite:
+                    serie[i] += 1
+                    break
+            else:
+                serie[len(BUCKETS)] += 1
+            serie[-1] += duracao
+            chave = (endpoint, str(status))
+            self.respostas[chave] = self.respostas.get(chave, 0) + 1
+            sql = self.sql.setdefault(endpoint, [0, 0.0])
+            sql[0] += sql_comandos
+            sql[1] += sql_segundos
+        if self.diretorio and time.monotonic() - self._ultima_gravacao >= self.intervalo_s:
+            self.gravar()
+
+    def instantaneo(self):
+        with self._lock:
+            return {
+                "latencia": [[*k, *v] for k, v in self.latencia.items()],
+                "respostas": [[*k, v] for k, v in self.respostas.items()],
+                "sql": [[k, *v] for k, v in self.sql.items()],
+            }
+
+    # ---------- vários processos ----------
+    def _arquivo(self, pid=None):
+        return os.path.join(self.diretorio, f"{pid or os.getpid()}.json")
+
+    def gravar(self):
+        self._ultima_gravacao = time.monotonic()
+        os.makedirs(self.diretorio, exist_ok=True)
+        temporario = os.path.join(self.diretorio, f".{uuid.uuid4().hex}.tmp")
+        with open(temporario, "w", encoding="utf-8") as destino:
+            json.dump(self.instantaneo(), destino)
+        os.replace(temporario, self._arquivo())
+
+    def agregado(self):
+        """Soma o instantâneo deste processo com os gravados pelos demais."""
+        partes = [self.instantaneo()]
+        if self.diretorio and os.path.isdir(self.diretorio):
+            proprio = os.path.basename(self._arquivo())
+            limite = time.time() - self.retencao_s
+            with os.scandir(self.diretorio) as it:
+                for item in it:
+                    if not item.name.endswith(".json") or item.name == proprio:
+                        continue
+                    try:
+                        if item.stat().st_mtime < limite:
+                            os.remove(item.path)  # processo encerrado há muito tempo
+                            continue
+                        with open(item.path, encoding="utf-8") as origem:
+                            partes.append(json.load(origem))
+                    except (OSError, ValueError):
+                        continue  # arquivo sendo trocado ou removido por outro processo
+
+        latencia, respostas, sql = {}, {}, {}
+        for parte in partes:
+            for endpoint, metodo, *valores in parte["latencia"]:
+                atual = latencia.setdefault((endpoint, metodo), [0] * len(valores))
+                for i, valor in enumerate(valores):
+                    atual[i] += valor
+            for endpoint, status, total in parte["respostas"]:
+                respostas[(endpoint, status)] = respostas.get((endpoint, status), 0) + total
+            for endpoint, comandos, segundos in parte["sql"]:
+                atual = sql.setdefault(endpoint, [0, 0.0])
+                atual[0] += comandos
+                atual[1] += segundos
+        return latencia, respostas, sql
+
+    def limpar(self):
+        with self._lock:
+            self._zerar()
+
+
+def _rotulos(**pares):
+    def escapar(valor):
+        return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{chave}="{escapar(valor)}"' for chave, valor in pares.items()) + "}"
+
+
+def texto_prometheus(latencia, respostas, sql):
+    nome = f"{PREFIXO}_requisicao_duracao_segundos"
+    linhas = [
+        f"# HELP {nome} Latência das requisições por endpoint.",
+        f"# TYPE {nome} histogram",
+    ]
+    for (endpoint, metodo), valores in sorted(latencia.items()):
+        acumulado = 0
+        for limite, contagem in zip((*map(str, BUCKETS), "+Inf"), valores):
+            acumulado += contagem
+            linhas.append(f"{nome}_bucket{_rotulos(endpoint=endpoint, metodo=metodo, le=limite)} {acumulado}")
+        linhas.append(f"{nome}_sum{_rotulos(endpoint=endpoint, metodo=metodo)} {valores[-1]:.6f}")
+        linhas.append(f"{nome}_count{_rotulos(endpoint=endpoint, metodo=metodo)} {acumulado}")
+
+    nome = f"{PREFIXO}_respostas_total"
+    linhas += [f"# HELP {nome} Respostas por endpoint e código HTTP.", f"# TYPE {nome} counter"]
+    for (endpoint, status), total in sorted(respostas.items()):
+        linhas.append(f"{nome}{_rotulos(endpoint=endpoint, status=status)} {total}")
+
+    comandos = f"{PREFIXO}_sql_comandos_total"
+    segundos = f"{PREFIXO}_sql_segundos_total"
+    linhas += [f"# HELP {comandos} Comandos SQL executados por endpoint.", f"# TYPE {comandos} counter"]
+    linhas += [f"{comandos}{_rotulos(endpoint=e)} {v[0]}" for e, v in sorted(sql.items())]
+    linhas += [f"# HELP {segundos} Tempo gasto em SQL (execute + fetch) por endpoint.", f"# TYPE {segundos} counter"]
+    linhas += [f"{segundos}{_rotulos(endpoint=e)} {v[1]:.6f}" for e, v in sorted(sql.items())]
+    return "\n".join(linhas) + "\n"
+
+
+metricas = Metricas()
+
+
+def init_app(app):
+    app.config.setdefault("METRICAS_DIR", os.path.join(BASE_DIR, "metricas"))  # vazio: só este processo
+    app.config.setdefault("METRICAS_INTERVALO_S", 2)
+    metricas.diretorio = app.config["METRICAS_DIR"] or None
+    metricas.intervalo_s = float(app.config["METRICAS_INTERVALO_S"])
+
+    @app.before_request
+    def _iniciar_medicao():
+        g._metricas_inicio = time.perf_counter()
+        g._metricas_sql = [0, 0.0]
+        g._metricas_token = medicao_sql.set(g._metricas_sql)
+
+    @app.after_request
+    def _registrar_medicao(resposta):
+        inicio = g.pop("_metricas_inicio", None)
+        if inicio is not None:
+            medicao_sql.reset(g.pop("_metricas_token"))
+            sql_comandos, sql_segundos = g.pop("_metricas_sql")
+            metricas.registrar(
+                request.endpoint or "sem_rota",
+                request.method,
+                resposta.status_code,
+                time.perf_counter() - inicio,
+                sql_comandos,
+                sql_segundos,
+            )
+        return resposta
+
+    @app.route("/metrics", endpoint="metrics")
+    def metrics():
+        return Response(
+            texto_prometheus(*metricas.agregado()),
+            mimetype="text/plain; version=0.0.4; charset=utf-8",
+        )
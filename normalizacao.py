@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""
+Normalização de valores legados de `agendamentos` (status, data e hora com
+formatos antigos ou marcadores de conflito de merge). Usada pelo reparo
+offline (`flask --app main reparar-agendamentos`) e pela validação de escrita.
+"""
+import re
+import string
+from datetime import datetime
+
+STATUS_AGENDAMENTO = [
+    ("agendado", "Agendado"),
+    ("em atendimento", "Em atendimento"),
+    ("concluido", "Concluído"),
+    ("cancelado", "Cancelado"),
+]
+STATUS_LABELS = {valor: rotulo for valor, rotulo in STATUS_AGENDAMENTO}
+STATUS_VALIDOS = frozenset(STATUS_LABELS)
+# código inteiro da coluna gerada agendamentos.status_codigo (migração 8)
+STATUS_CODIGO = {valor: codigo for codigo, (valor, _rotulo) in enumerate(STATUS_AGENDAMENTO)}
+ROTULO_POR_CODIGO = {codigo: rotulo for codigo, (_valor, rotulo) in enumerate(STATUS_AGENDAMENTO)}
+STATUS_CONCLUIDO = STATUS_CODIGO["concluido"]
+STATUS_CANCELADO = STATUS_CODIGO["cancelado"]
+CONFLICT_TOKENS = ("<<<<<<<", "=======", ">>>>>>>")
+
+
+def remover_marcadores_conflito(valor):
+    if not isinstance(valor, str):
+        return valor
+    texto = valor.strip()
+    if not texto:
+        return texto
+    if not any(token in texto for token in CONFLICT_TOKENS):
+        return texto
+
+    blocos = []
+    trecho_atual = []
+    for linha in texto.splitlines():
+        if linha.startswith("<<<<<<<"):
+            trecho_atual = []
+            continue
+        if linha.startswith("======="):
+            blocos.append("\n".join(trecho_atual).strip())
+            trecho_atual = []
+            continue
+        if linha.startswith(">>>>>>>"):
+            blocos.append("\n".join(trecho_atual).strip())
+            trecho_atual = []
+            continue
+        trecho_atual.append(linha)
+
+    if trecho_atual:
+        blocos.append("\n".join(trecho_atual).strip())
+
+    for bloco in blocos:
+        if bloco:
+            return bloco
+
+    return texto.replace("<<<<<<<", "").replace("=======", "").replace(">>>>>>>", "").strip()
+
+
+def normalizar_status(valor, validos):
+    texto = (remover_marcadores_conflito(valor) or "").strip().lower()
+    if not texto:
+        return "agendado" if "agendado" in validos else (next(iter(validos)) if validos else texto)
+
+    if texto in validos:
+        return texto
+
+    for candidato in validos:
+        if candidato in texto:
+            return candidato
+
+    return texto
+
+
+def normalizar_data(valor):
+    texto = (remover_marcadores_conflito(valor) or "").strip()
+    if not texto:
+        return texto
+
+    match_iso = re.search(r"\b\d{4}-\d{2}-\d{2}\b", texto)
+    if match_iso:
+        return match_iso.group(0)
+
+    match_br = re.search(r"\b\d{2}/\d{2}/\d{4}\b", texto)
+    if match_br:
+        dia, mes, ano = match_br.group(0).split("/")
+        return f"{ano}-{mes}-{dia}"
+
+    return texto
+
+
+def normalizar_hora(valor):
+    texto = (remover_marcadores_conflito(valor) or "").strip()
+    if not texto:
+        return texto
+
+    match_hora = re.search(r"\b\d{2}:\d{2}\b", texto)
+    if match_hora:
+        return match_hora.group(0)
+
+    return texto
+
+
+# nome_busca (migração 11): acentos do português trocados pela letra base e
+# A-Z em minúsculas, exatamente como a expressão SQL gerada abaixo (o LOWER
+# do SQLite só trata ASCII). Mudar o mapa exige uma nova migração; o parser
+# do SQLite aceita ~29 REPLACE aninhados, por isso só os acentos do português.
+ACENTOS = {
+    "á": "a", "à": "a", "â": "a", "ã": "a",
+    "é": "e", "ê": "e",
+    "í": "i",
+    "ó": "o", "ô": "o", "õ": "o",
+    "ú": "u", "ü": "u",
+    "ç": "c",
+}
+_TABELA_BUSCA = str.maketrans({
+    **ACENTOS,
+    **{acento.upper(): base for acento, base in ACENTOS.items()},
+    **dict(zip(string.ascii_uppercase, string.ascii_lowercase)),
+})
+
+
+def nome_busca(texto):
+    """Forma normalizada de um nome para busca por prefixo (ver usuarios.nome_busca)."""
+    return (texto or "").strip(" ").translate(_TABELA_BUSCA)
+
+
+def sql_nome_busca(coluna):
+    """Expressão SQL equivalente a nome_busca() sobre `coluna`."""
+    expressao = f"TRIM({coluna})"
+    for acento, base in ACENTOS.items():
+        expressao = f"REPLACE(REPLACE({expressao}, '{acento}', '{base}'), '{acento.upper()}', '{base}')"
+    return f"LOWER({expressao})"
+
+
+EPOCA = datetime(1970, 1, 1)
+
+
+def minutos_desde_epoca(data, hora="00:00"):
+    """
+    'AAAA-MM-DD' + 'HH:MM' em minutos desde 1970-01-01 00:00, como horário de
+    parede (sem fuso), igual à coluna agendamentos.inicio_min. ValueError se inválido.
+    """
+    return int((datetime.strptime(f"{data} {hora}", "%Y-%m-%d %H:%M") - EPOCA).total_seconds()) // 60
+
+
+def data_valida(valor):
+    try:
+        return datetime.strptime(valor or "", "%Y-%m-%d").strftime("%Y-%m-%d") == valor
+    except ValueError:
+        return False
+
+
+def hora_valida(valor):
+    try:
+        return datetime.strptime(valor or "", "%H:%M").strftime("%H:%M") == valor
+    except ValueError:
+        return False
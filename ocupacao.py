@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""
+Índice em memória da ocupação de salas e médicos por dia.
+
+Cada (recurso, dia) é guardado como um inteiro em que o bit `i` indica o
+i-ésimo slot da grade de 30 minutos ocupado; os horários livres de um par
+médico+sala são `~(mascara_sala | mascara_medico)`. As entradas são
+carregadas sob demanda (databaser.horarios_disponiveis_periodo), atualizadas
+pelas rotas que gravam em `agendamentos` e descartadas por LRU. Cada
+entrada guarda a versão de `agendamentos` (versoes_cache) que reflete:
+consultada com outra versão ela conta como ausente, então escritas de outra
+conexão ou processo nunca servem um corpo mais velho que o ETag da resposta.
+A escrita local (`mover`) carimba nas entradas que atualiza a versão lida
+logo após o commit, e elas continuam válidas.
+"""
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+
+SALA = "s"
+MEDICO = "m"
+
+
+class Entrada:
+    """Ocupação de um recurso em um dia: máscara da grade + {agendamento_id: 'HH:MM'}."""
+    __slots__ = ("mascara", "horas", "carregada_em", "versao")
+
+    def __init__(self, mascara, horas, carregada_em, versao=None):
+        self.mascara = mascara
+        self.horas = horas
+        self.carregada_em = carregada_em
+        self.versao = versao
+
+
+class IndiceOcupacao:
+    def __init__(self, grade, capacidade=4096, ttl_s=30.0):
+        self.grade = tuple(grade)
+        self._slot = {hora: i for i, hora in enumerate(self.grade)}
+        self.capacidade = capacidade
+        self.ttl_s = ttl_s
+        self._entradas = OrderedDict()  # (tipo, recurso_id, dia) -> Entrada
+        self._lock = threading.Lock()
+        # incrementada a cada escrita; cargas iniciadas antes de uma escrita
+        # não são guardadas (evita reinserir uma leitura já desatualizada)
+        self.geracao = 0
+
+    # ---------- leitura ----------
+    def mascara_de(self, horas):
+        mascara = 0
+        for hora in horas.values():
+            slot = self._slot.get(hora)
+            if slot is not None:
+                mascara |= 1 << slot
+        return mascara
+
+    def consultar(self, chaves, versao=None):
+        """
+        Devolve {chave: Entrada} das chaves presentes e ainda válidas; com
+        `versao`, entradas lidas em outra versão de `agendamentos` são descartadas.
+        """
+        agora = time.monotonic()
+        achadas = {}
+        with self._lock:
+            for chave in chaves:
+                entrada = self._entradas.get(chave)
+                if entrada is None:
+                    continue
+                if (self.ttl_s and agora - entrada.carregada_em > self.ttl_s) or (
+                    versao is not None and entrada.versao != versao
+                ):
+                    del self._entradas[chave]
+                    continue
+                self._entradas.move_to_end(chave)
+                achadas[chave] = entrada
+        return achadas
+
+    def livres(self, entradas, ignorar_id=None, grade=None):
+        """Horários livres da grade dadas as entradas de sala e médico do dia."""
+        if grade is None or grade == self.grade:
+            mascara = 0
+            for entrada in entradas:
+                if ignorar_id is not None and ignorar_id in entrada.horas:
+                    mascara |= self.mascara_de(
+                        {k: v for k, v in entrada.horas.items() if k != ignorar_id}
+                    )
+                else:
+                    mascara |= entrada.mascara
+            return list(_livres_por_mascara(self.grade, mascara))
+
+        # grade diferente (outro passo): compara pelos horários textuais
+        ocupados = set()
+        for entrada in entradas:
+            ocupados.update(h for k, h in entrada.horas.items() if k != ignorar_id)
+        return [hora for hora in grade if hora not in ocupados]
+
+    # ---------- carga ----------
+    def guardar(self, geracao, horas_por_chave, versao=None):
+        """
+        Converte {chave: {agendamento_id: hora}} em Entradas da `versao` de
+        `agendamentos` e as guarda se nenhuma escrita ocorreu desde `geracao`.
+        Retorna as Entradas criadas.
+        """
+        agora = time.monotonic()
+        novas = {
+            chave: Entrada(self.mascara_de(horas), horas, agora, versao)
+            for chave, horas in horas_por_chave.items()
+        }
+        with self._lock:
+            if geracao == self.geracao:
+                for chave, entrada in novas.items():
+                    self._entradas[chave] = entrada
+                    self._entradas.move_to_end(chave)
+                while len(self._entradas) > self.capacidade:
+                    self._entradas.popitem(last=False)
+        return novas
+
+    # ---------- escrita (write-through) ----------
+    def mover(self, agendamento_id, antes=None, depois=None, versao=None):
+        """
+        Reflete uma gravação já confirmada em `agendamentos`.
+        `antes`/`depois` são (medico_id, sala_id, dia, hora) ou None;
+        `versao` é a de `agendamentos` depois do commit.
+        """
+        agendamento_id = int(agendamento_id)
+        alteracoes = []
+        if antes:
+            medico_id, sala_id, dia, _hora = antes
+            alteracoes += [((SALA, int(sala_id), dia), None), ((MEDICO, int(medico_id), dia), None)]
+        if depois:
+            medico_id, sala_id, dia, hora = depois
+            alteracoes += [((SALA, int(sala_id), dia), hora), ((MEDICO, int(medico_id), dia), hora)]
+
+        with self._lock:
+            self.geracao += 1
+            for chave, hora in alteracoes:
+                entrada = self._entradas.get(chave)
+                if entrada is None:
+                    continue
+                # copy-on-write: leitores fora do lock nunca veem o dict mudando
+                horas = dict(entrada.horas)
+                if hora is None:
+                    horas.pop(agendamento_id, None)
+                else:
+                    horas[agendamento_id] = hora
+                self._entradas[chave] = Entrada(self.mascara_de(horas), horas, entrada.carregada_em, versao)
+
+    def invalidar(self):
+        with self._lock:
+            self.geracao += 1
+            self._entradas.clear()
+
+    def __len__(self):
+        return len(self._entradas)
+
+
+@lru_cache(maxsize=4096)
+def _livres_por_mascara(grade, mascara):
+    return tuple(hora for i, hora in enumerate(grade) if not (mascara >> i) & 1)
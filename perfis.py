@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+"""
+Perfis cProfile de requisições, por amostragem ou a pedido (opt-in).
+
+Uma fração `PERFIS_AMOSTRA` das requisições, ou qualquer requisição de um
+recepcionista master com o cabeçalho `PERFIS_CABECALHO`, roda sob cProfile
+até o after_request (o corpo de respostas em streaming fica de fora). Cada
+perfil vira três arquivos em `PERFIS_DIR`: `.prof` (pstats, snakeviz),
+`.txt` em pilhas colapsadas (flamegraph.pl, speedscope) e `.json` com o
+resumo mostrado em /user/recepcionista/perfis: tempo em SQL, em templates
+Jinja e nos helpers de normalização. O diretório é limitado em número de
+perfis e em bytes; os mais antigos saem primeiro.
+"""
+import cProfile
+import json
+import os
+import pstats
+import random
+import re
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from flask import g, request, session
+
+from databaser import BASE_DIR
+
+ADMIN = "recepcionista master"
+EXTENSOES = ("json", "prof", "txt")
+NOME_VALIDO = re.compile(r"^[0-9]{8}-[0-9]{6}-[0-9]{6}-[0-9a-f]{8}$")
+PROFUNDIDADE_MAX = 64
+TEMPO_MIN_PILHA = 1e-6  # ramos abaixo disso (s) não entram nas pilhas colapsadas
+
+# um perfil por processo de cada vez: no Python 3.12+ o cProfile usa
+# sys.monitoring e um segundo enable() simultâneo levanta ValueError
+_perfilando = threading.Lock()
+
+
+def _e_modulo(arquivo, *partes):
+    return arquivo.replace("\\", "/").endswith("/".join(partes))
+
+
+# função pstats (arquivo, linha, nome) -> pertence à categoria?
+CATEGORIAS = {
+    "sql": lambda f: _e_modulo(f[0], "databaser.py") and f[2] == "_medir",
+    "templates": lambda f: _e_modulo(f[0], "flask", "templating.py") and f[2] == "_render",
+    "normalizacao": lambda f: _e_modulo(f[0], "normalizacao.py") or (
+        _e_modulo(f[0], "routes", "user.py") and f[2].startswith(("_normalizar", "_formatar"))
+    ),
+}
+
+
+def tempo_categoria(stats, pertence):
+    """Tempo cumulativo das funções da categoria, sem contar chamadas internas a ela."""
+    total = 0.0
+    for func, (_cc, _nc, _tt, ct, chamadores) in stats.stats.items():
+        if not pertence(func):
+            continue
+        if not chamadores:
+            total += ct
+            continue
+        total += sum(aresta[3] for chamador, aresta in chamadores.items() if not pertence(chamador))
+    return total
+
+
+def _rotulo(func):
+    arquivo, linha, nome = func
+    rotulo = f"{nome} ({os.path.basename(arquivo)}:{linha})" if linha else nome
+    return rotulo.replace(";", ",")
+
+
+def pilhas_colapsadas(stats):
+    """
+    Converte o grafo chamador->chamado do cProfile em pilhas colapsadas
+    (`a;b;c microssegundos`). O cProfile não guarda pilhas completas: o tempo
+    de cada aresta é repartido proporcionalmente, como fazem os conversores
+    usuais (flameprof, gprof2dot).
+    """
+    chamados = {}
+    for func, (_cc, _nc, _tt, _ct, chamadores) in stats.stats.items():
+        for chamador, aresta in chamadores.items():
+            chamados.setdefault(chamador, []).append((func, aresta[3]))
+
+    pilhas = {}
+
+    def visitar(func, tempo, pilha, vistos):
+        _cc, _nc, tt, ct, _chamadores = stats.stats[func]
+        pilha = pilha + (_rotulo(func),)
+        fator = min(tempo / ct, 1.0) if ct else 0.0
+        chave = ";".join(pilha)
+        pilhas[chave] = pilhas.get(chave, 0.0) + tt * fator
+        if len(pilha) >= PROFUNDIDADE_MAX:
+            return
+        for filho, tempo_aresta in chamados.get(func, ()):
+            if filho in vistos or tempo_aresta * fator < TEMPO_MIN_PILHA:
+                continue  # recursão ou ramo desprezível
+            visitar(filho, tempo_aresta * fator, pilha, vistos | {filho})
+
+    for func, (_cc, _nc, _tt, ct, chamadores) in stats.stats.items():
+        if not chamadores:
+            visitar(func, ct, (), {func})
+    return "".join(
+        f"{pilha} {round(segundos * 1e6)}\n"
+        for pilha, segundos in sorted(pilhas.items())
+        if round(segundos * 1e6) > 0
+    )
+
+
+class Perfis:
+    def __init__(self, diretorio=None, amostra=0.0, cabecalho="X-Perfil",
+                 max_perfis=100, max_bytes=64 * 1024 * 1024):
+        self.diretorio = diretorio
+        self.amostra = amostra
+        self.cabecalho = cabecalho
+        self.max_perfis = max_perfis
+        self.max_bytes = max_bytes
+
+    def deve_perfilar(self):
+        if not self.diretorio:
+            return False
+        if self.cabecalho and request.headers.get(self.cabecalho) and session.get("usuario_tipo") == ADMIN:
+            return True
+        return self.amostra > 0 and random.random() < self.amostra
+
+    # ---------- gravação ----------
+    def gravar(self, perfilador, duracao, status):
+        stats = pstats.Stats(perfilador)
+        nome = datetime.now().strftime("%Y%m%d-%H%M%S-%f") + "-" + uuid.uuid4().hex[:8]
+        categorias = {cat: round(tempo_categoria(stats, pertence) * 1000, 3) for cat, pertence in CATEGORIAS.items()}
+        resumo = {
+            "nome": nome,
+            "criado_em": time.time(),
+            "endpoint": request.endpoint or "sem_rota",
+            "metodo": request.method,
+            "caminho": request.full_path.rstrip("?"),
+            "status": status,
+            "duracao_ms": round(duracao * 1000, 3),
+            "perfilado_ms": round(stats.total_tt * 1000, 3),
+            "categorias_ms": categorias,
+            "chamadas": stats.total_calls,
+        }
+        os.makedirs(self.diretorio, exist_ok=True)
+        conteudos = (
+            ("prof", None),
+            ("txt", pilhas_colapsadas(stats)),
+            ("json", json.dumps(resumo, ensure_ascii=False)),  # por último: é o que a listagem lê
+        )
+        for extensao, texto in conteudos:
+            temporario = os.path.join(self.diretorio, f".{uuid.uuid4().hex}.tmp")
+            if texto is None:
+                stats.dump_stats(temporario)
+            else:
+                with open(temporario, "w", encoding="utf-8") as destino:
+                    destino.write(texto)
+            os.replace(temporario, os.path.join(self.diretorio, f"{nome}.{extensao}"))
+        self.podar()
+        return nome
+
+    def podar(self):
+        """Descarta os perfis mais antigos além de max_perfis / max_bytes."""
+        grupos = {}
+        with os.scandir(self.diretorio) as it:
+            for item in it:
+                nome, _, extensao = item.name.rpartition(".")
+                if extensao not in EXTENSOES or not NOME_VALIDO.match(nome):
+                    continue
+                try:
+                    tamanho = item.stat().st_size
+                except OSError:
+                    continue
+                grupos[nome] = grupos.get(nome, 0) + tamanho
+
+        total = 0
+        removidos = 0
+        # o nome começa pelo horário: ordem alfabética = ordem cronológica
+        for i, nome in enumerate(sorted(grupos, reverse=True)):
+            total += grupos[nome]
+            if i < self.max_perfis and total <= self.max_bytes:
+                continue
+            for extensao in EXTENSOES:
+                try:
+                    os.remove(os.path.join(self.diretorio, f"{nome}.{extensao}"))
+                except OSError:
+                    pass
+            removidos += 1
+        return removidos
+
+    # ---------- leitura ----------
+    def listar(self, limite=50):
+        """Resumos dos perfis mais recentes."""
+        if not self.diretorio or not os.path.isdir(self.diretorio):
+            return []
+        nomes = sorted(
+            (n[:-5] for n in os.listdir(self.diretorio) if n.endswith(".json") and NOME_VALIDO.match(n[:-5])),
+            reverse=True,
+        )
+        resumos = []
+        for nome in nomes[:limite]:
+            try:
+                with open(os.path.join(self.diretorio, f"{nome}.json"), encoding="utf-8") as origem:
+                    resumos.append(json.load(origem))
+            except (OSError, ValueError):
+                continue  # removido pela poda de outro worker
+        return resumos
+
+    def caminho(self, nome, extensao):
+        """Caminho do arquivo do perfil, ou None se o nome/extensão não é válido ou não existe."""
+        if not self.diretorio or extensao not in EXTENSOES or not NOME_VALIDO.match(nome):
+            return None
+        caminho = os.path.join(self.diretorio, f"{nome}.{extensao}")
+        return caminho if os.path.isfile(caminho) else None
+
+
+perfis = Perfis()
+
+
+def init_app(app):
+    app.config.setdefault("PERFIS_DIR", os.path.join(BASE_DIR, "perfis"))  # vazio desliga
+    app.config.setdefault("PERFIS_AMOSTRA", 0.0)         # fração das requisições (0.01 = 1%)
+    app.config.setdefault("PERFIS_CABECALHO", "X-Perfil")  # força o perfil (só recepcionista master)
+    app.config.setdefault("PERFIS_MAX_ARQUIVOS", 100)    # perfis guardados (cada um com 3 arquivos)
+    app.config.setdefault("PERFIS_MAX_MB", 64)
+    perfis.diretorio = app.config["PERFIS_DIR"] or None
+    perfis.amostra = float(app.config["PERFIS_AMOSTRA"])
+    perfis.cabecalho = app.config["PERFIS_CABECALHO"]
+    perfis.max_perfis = int(app.config["PERFIS_MAX_ARQUIVOS"])
+    perfis.max_bytes = int(app.config["PERFIS_MAX_MB"]) * 1024 * 1024
+
+    # o perfilador nunca derruba a requisição: sem vaga, ou se o enable()
+    # falhar, a requisição só não é perfilada
+    @app.before_request
+    def _iniciar_perfil():
+        if not perfis.deve_perfilar() or not _perfilando.acquire(blocking=False):
+            return
+        perfilador = cProfile.Profile()
+        try:
+            perfilador.enable()
+        except ValueError:  # outro profiler ativo (sys.monitoring)
+            _perfilando.release()
+            return
+        g._perfil = perfilador
+        g._perfil_inicio = time.perf_counter()
+
+    def _encerrar():
+        perfilador = g.pop("_perfil", None)
+        if perfilador is not None:
+            perfilador.disable()
+            _perfilando.release()
+        return perfilador
+
+    @app.after_request
+    def _gravar_perfil(resposta):
+        perfilador = _encerrar()
+        if perfilador is not None:
+            duracao = time.perf_counter() - g.pop("_perfil_inicio")
+            try:
+                resposta.headers["X-Perfil-Id"] = perfis.gravar(perfilador, duracao, resposta.status_code)
+            except Exception:  # o perfil é acessório: a resposta sai mesmo sem ele
+                app.logger.exception("perfil não gravado")
+        return resposta
+
+    @app.teardown_request
+    def _descartar_perfil(_exc=None):
+        # exceção antes do after_request: não deixa o cProfile ligado na thread
+        _encerrar()
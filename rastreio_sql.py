@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+"""
+Rastreamento opcional de SQL (SQL_RASTREIO) e log de comandos lentos.
+
+Ligado, cada conexão aberta pelo pool ganha um Rastreador: o
+`set_trace_callback` conta os sub-comandos que o SQLite executa por conta
+própria (corpos de triggers) e o progress handler conta os passos da VM.
+O tempo vem de databaser.CursorMedido (execute + fetch do mesmo cursor).
+Por comando guardamos o texto, a forma dos parâmetros (só tipos: valores
+como hashes de senha nunca saem do processo), o endpoint e a duração. Um
+comando entra no log rotativo uma única vez, quando o tempo acumulado
+passa de `SQL_RASTREIO_LENTA_MS`; com `SQL_RASTREIO_EXPLAIN` o log leva
+também o EXPLAIN QUERY PLAN (um por texto de SQL, por processo).
+"""
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+from logging.handlers import RotatingFileHandler
+
+import click
+from flask import has_request_context, request
+
+import databaser
+from databaser import BASE_DIR
+
+log = logging.getLogger("clinica.sql_lenta")
+log.propagate = False
+
+MAX_ESTATISTICAS = 2000  # textos de SQL distintos acompanhados por processo
+MAX_EXPLICADOS = 500
+
+
+class Configuracao:
+    ativo = False
+    lenta_s = 0.1
+    explain = False
+    passos = 1000  # instruções da VM entre chamadas do progress handler
+
+
+config = Configuracao()
+
+
+def forma_parametros(params):
+    """Tipos dos parâmetros, sem os valores: `(int, str)` ou `{medico:int}`."""
+    if params is None:
+        return "()"
+    if isinstance(params, dict):
+        return "{" + ", ".join(f"{k}:{type(v).__name__}" for k, v in params.items()) + "}"
+    if isinstance(params, (tuple, list)):
+        return "(" + ", ".join(type(v).__name__ for v in params) + ")"
+    return type(params).__name__
+
+
+def _compactar(sql):
+    return re.sub(r"\s+", " ", sql).strip()
+
+
+def _endpoint():
+    if has_request_context():
+        return request.endpoint or "sem_rota"
+    return "fora_de_requisicao"
+
+
+class Registro:
+    """Um comando em andamento num cursor."""
+    __slots__ = ("sql", "params", "forma", "endpoint", "duracao", "passos", "subcomandos", "logado")
+
+    def __init__(self, sql, params, forma, endpoint):
+        self.sql = sql
+        self.params = params
+        self.forma = forma
+        self.endpoint = endpoint
+        self.duracao = 0.0
+        self.passos = 0
+        self.subcomandos = -1  # o próprio comando também passa pelo trace
+        self.logado = False
+
+
+class Estatisticas:
+    """Totais por (endpoint, sql) deste processo."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.itens = {}  # (endpoint, sql) -> [execucoes, segundos, maximo, lentas]
+        self.explicados = set()
+
+    def contar(self, chave):
+        with self._lock:
+            item = self.itens.get(chave)
+            if item is None:
+                if len(self.itens) >= MAX_ESTATISTICAS:
+                    return
+                item = self.itens[chave] = [0, 0.0, 0.0, 0]
+            item[0] += 1
+
+    def somar(self, chave, duracao, total, lenta):
+        with self._lock:
+            item = self.itens.get(chave)
+            if item is not None:
+                item[1] += duracao
+                item[2] = max(item[2], total)
+                item[3] += lenta
+
+    def primeira_explicacao(self, sql):
+        with self._lock:
+            if sql in self.explicados or len(self.explicados) >= MAX_EXPLICADOS:
+                return False
+            self.explicados.add(sql)
+            return True
+
+    def maiores(self, limite=50):
+        with self._lock:
+            itens = [
+                {"endpoint": e, "sql": _compactar(s), "execucoes": n, "segundos": round(t, 6),
+                 "maximo_ms": round(m * 1000, 3), "lentas": lentas}
+                for (e, s), (n, t, m, lentas) in self.itens.items()
+            ]
+        itens.sort(key=lambda item: item["segundos"], reverse=True)
+        return itens[:limite]
+
+    def limpar(self):
+        with self._lock:
+            self.itens.clear()
+            self.explicados.clear()
+
+
+estatisticas = Estatisticas()
+
+
+class Rastreador:
+    """Instalado em cada conexão do pool enquanto SQL_RASTREIO está ligado."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.atual = None  # Registro cujo statement está rodando agora
+        conn.set_trace_callback(self._trace)
+        conn.set_progress_handler(self._progresso, config.passos)
+
+    def _trace(self, _texto):
+        # o texto vem com os parâmetros já substituídos: só contamos
+        if self.atual is not None:
+            self.atual.subcomandos += 1
+
+    def _progresso(self):
+        if self.atual is not None:
+            self.atual.passos += 1
+        return 0  # nunca interrompe o comando
+
+    # ---------- chamados por CursorMedido ----------
+    def iniciar(self, sql, params=None, lote=False):
+        forma = "lote" if lote else forma_parametros(params)
+        registro = Registro(sql, None if lote else params, forma, _endpoint())
+        estatisticas.contar((registro.endpoint, sql))
+        return registro
+
+    def concluir_trecho(self, registro, duracao):
+        """Soma mais um execute/fetch ao registro e loga se ele virou lento."""
+        registro.duracao += duracao
+        lenta = not registro.logado and registro.duracao >= config.lenta_s
+        estatisticas.somar((registro.endpoint, registro.sql), duracao, registro.duracao, lenta)
+        if lenta:
+            registro.logado = True
+            self._logar(registro)
+
+    def _plano(self, registro):
+        if not (config.explain and registro.params is not None
+                and registro.sql.lstrip()[:6].upper() in ("SELECT", "WITH")
+                and estatisticas.primeira_explicacao(registro.sql)):
+            return None
+        anterior, self.atual = self.atual, None
+        try:
+            # direto no sqlite3.Connection: não passa pelo CursorMedido
+            linhas = sqlite3.Connection.execute(
+                self.conn, "EXPLAIN QUERY PLAN " + registro.sql, registro.params
+            ).fetchall()
+            return [linha[3] for linha in linhas]
+        except sqlite3.Error as erro:
+            return [f"indisponível: {erro}"]
+        finally:
+            self.atual = anterior
+
+    def _logar(self, registro):
+        entrada = {
+            "endpoint": registro.endpoint,
+            "duracao_ms": round(registro.duracao * 1000, 3),
+            "passos_vm": registro.passos * config.passos,
+            "subcomandos": max(registro.subcomandos, 0),
+            "parametros": registro.forma,
+            "sql": _compactar(registro.sql),
+        }
+        plano = self._plano(registro)
+        if plano is not None:
+            entrada["plano"] = plano
+        log.warning(json.dumps(entrada, ensure_ascii=False))
+
+
+def instalar(conn):
+    """Gancho de databaser: roda para cada conexão nova do pool."""
+    if config.ativo:
+        conn._rastreador = Rastreador(conn)
+
+
+def init_app(app):
+    app.config.setdefault("SQL_RASTREIO", False)            # liga trace/progress handler nas conexões
+    app.config.setdefault("SQL_RASTREIO_LENTA_MS", 100)     # a partir daqui o comando vai para o log
+    app.config.setdefault("SQL_RASTREIO_EXPLAIN", False)    # anexa EXPLAIN QUERY PLAN às lentas
+    app.config.setdefault("SQL_RASTREIO_PASSOS", 1000)
+    app.config.setdefault("SQL_RASTREIO_LOG", os.path.join(BASE_DIR, "logs", "sql_lentas.log"))
+    app.config.setdefault("SQL_RASTREIO_LOG_MAX_MB", 10)
+    app.config.setdefault("SQL_RASTREIO_LOG_ARQUIVOS", 5)
+
+    config.ativo = str(app.config["SQL_RASTREIO"]).lower() in ("1", "true", "sim", "on")
+    config.lenta_s = float(app.config["SQL_RASTREIO_LENTA_MS"]) / 1000
+    config.explain = str(app.config["SQL_RASTREIO_EXPLAIN"]).lower() in ("1", "true", "sim", "on")
+    config.passos = max(int(app.config["SQL_RASTREIO_PASSOS"]), 1)
+
+    if instalar not in databaser.ganchos_conexao:
+        databaser.ganchos_conexao.append(instalar)
+
+    for handler in list(log.handlers):
+        log.removeHandler(handler)
+        handler.close()
+    if config.ativo:
+        arquivo = app.config["SQL_RASTREIO_LOG"]
+        os.makedirs(os.path.dirname(arquivo) or ".", exist_ok=True)
+        handler = RotatingFileHandler(
+            arquivo,
+            maxBytes=int(float(app.config["SQL_RASTREIO_LOG_MAX_MB"]) * 1024 * 1024),
+            backupCount=int(app.config["SQL_RASTREIO_LOG_ARQUIVOS"]),
+            encoding="utf-8",
+            delay=True,
+        )
+        handler.setFormatter(logging.Formatter("%(asctime)s %(process)d %(message)s"))
+        log.addHandler(handler)
+        log.setLevel(logging.WARNING)
+
+    @app.cli.command("sql-rastreio")
+    def sql_rastreio_comando():
+        """Mostra as últimas linhas do log de SQL lento."""
+        arquivo = app.config["SQL_RASTREIO_LOG"]
+        if not os.path.exists(arquivo):
+            click.echo(f"sem log em {arquivo} (SQL_RASTREIO desligado ou nada lento ainda)")
+            return
+        with open(arquivo, encoding="utf-8") as origem:
+            for linha in origem.readlines()[-50:]:
+                click.echo(linha.rstrip())
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+Séries de consultas recorrentes (pacientes crônicos): expansão da regra de
+recorrência em datas e, para as ocorrências em conflito, o horário livre
+mais próximo de sala e médico. A gravação da série fica em
+databaser.inserir_serie.
+"""
+import calendar
+from datetime import date, datetime, timedelta
+
+from databaser import horarios_disponiveis_periodo
+from normalizacao import minutos_desde_epoca
+
+# passo em dias; a mensal segue o calendário
+FREQUENCIAS = {"semanal": 7, "quinzenal": 14, "mensal": None}
+MAX_OCORRENCIAS = 52
+JANELA_ALTERNATIVA_DIAS = 7  # alternativa procurada até uma semana antes/depois
+
+
+def _somar_meses(dia, meses):
+    indice = dia.month - 1 + meses
+    ano, mes = dia.year + indice // 12, indice % 12 + 1
+    return date(ano, mes, min(dia.day, calendar.monthrange(ano, mes)[1]))
+
+
+def expandir(inicio, frequencia, ocorrencias=None, ate=None):
+    """
+    Datas da série a partir de `inicio` (inclusive): `ocorrencias` datas e/ou
+    até a data `ate`. Na mensal o dia do mês se mantém (31 vira o último dia
+    dos meses mais curtos). ValueError se a regra é inválida, se não sobra
+    nenhuma data ou se a série passa de MAX_OCORRENCIAS.
+    """
+    if frequencia not in FREQUENCIAS:
+        raise ValueError("Frequência inválida (use semanal, quinzenal ou mensal).")
+    if ocorrencias is None and ate is None:
+        raise ValueError("Informe o número de ocorrências ou a data final.")
+    if ocorrencias is not None and not 1 <= ocorrencias <= MAX_OCORRENCIAS:
+        raise ValueError(f"Número de ocorrências deve estar entre 1 e {MAX_OCORRENCIAS}.")
+
+    passo = FREQUENCIAS[frequencia]
+    datas = []
+    while ocorrencias is None or len(datas) < ocorrencias:
+        n = len(datas)
+        dia = inicio + timedelta(days=passo * n) if passo else _somar_meses(inicio, n)
+        if ate is not None and dia > ate:
+            break
+        if n >= MAX_OCORRENCIAS:
+            raise ValueError(f"A série passa de {MAX_OCORRENCIAS} ocorrências.")
+        datas.append(dia)
+    if not datas:
+        raise ValueError("A data final é anterior ao início da série.")
+    return datas
+
+
+def alternativa_mais_proxima(medico_id, sala_id, dia, hora, ocupados=(), agora=None,
+                             janela_dias=JANELA_ALTERNATIVA_DIAS):
+    """
+    Horário com sala e médico livres mais próximo de `dia` `hora`, até
+    `janela_dias` antes ou depois e nunca no passado; `ocupados` são
+    inicio_min a evitar (os da própria série e as outras consultas do
+    paciente, databaser.minutos_ocupados_paciente). Devolve {"data", "hora"} ou None.
+    """
+    agora = agora or datetime.now()
+    inicio = max(dia - timedelta(days=janela_dias), agora.date())
+    fim = dia + timedelta(days=janela_dias)
+    if fim < inicio:
+        return None
+
+    alvo = minutos_desde_epoca(dia.isoformat(), hora)
+    limite = minutos_desde_epoca(agora.date().isoformat(), agora.strftime("%H:%M"))
+    melhor = None
+    for data, livres in horarios_disponiveis_periodo(medico_id, sala_id, inicio, fim).items():
+        for livre in livres:
+            minuto = minutos_desde_epoca(data, livre)
+            if minuto <= limite or minuto in ocupados:
+                continue
+            chave = (abs(minuto - alvo), minuto)  # empate: o mais cedo
+            if melhor is None or chave < melhor[0]:
+                melhor = (chave, data, livre)
+    return {"data": melhor[1], "hora": melhor[2]} if melhor else None
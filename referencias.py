@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+Cache por processo das listas de referência pequenas (procedimentos, salas
+e convênios). Médicos e pacientes não entram aqui: crescem com a base e são
+buscados sob demanda (/user/api/usuarios).
+
+Cada lista fica associada à versão da sua tabela em `versoes_cache`, que os
+triggers da migração 5 incrementam a cada escrita. Como a versão mora no
+banco, vários workers enxergam a mesma invalidação; a leitura das versões
+é feita uma vez por requisição.
+"""
+import threading
+
+from databaser import conectar, versoes_dados
+
+# nome -> (versão de quem invalida, sql)
+LISTAS = {
+    "procedimentos": (
+        "procedimentos",
+        "SELECT id, nome, descricao FROM procedimentos ORDER BY nome",
+    ),
+    "salas": (
+        "salas",
+        "SELECT id, nome FROM salas ORDER BY nome",
+    ),
+    "convenios": (
+        "convenios",
+        "SELECT DISTINCT convenio FROM agendamentos WHERE convenio IS NOT NULL AND TRIM(convenio)<>'' ORDER BY convenio",
+    ),
+}
+
+
+class CacheReferencias:
+    def __init__(self):
+        self._dados = {}  # nome -> (versao, linhas)
+        self._lock = threading.Lock()
+        self.acertos = 0
+        self.falhas = 0
+
+    def obter(self, nome):
+        tabela, sql = LISTAS[nome]
+        conn = conectar()
+        try:
+            versao = versoes_dados(conn).get(tabela)
+            with self._lock:
+                guardado = self._dados.get(nome)
+                if guardado is not None and guardado[0] == versao:
+                    self.acertos += 1
+                    return guardado[1]
+                self.falhas += 1
+            linhas = conn.execute(sql).fetchall()
+        finally:
+            conn.close()
+        if nome == "convenios":
+            linhas = [row["convenio"] for row in linhas]
+        linhas = tuple(linhas)
+        with self._lock:
+            self._dados[nome] = (versao, linhas)
+        return linhas
+
+    def estatisticas(self):
+        with self._lock:
+            total = self.acertos + self.falhas
+            return {
+                "acertos": self.acertos,
+                "falhas": self.falhas,
+                "taxa_acerto": round(self.acertos / total, 4) if total else None,
+                "listas": {nome: versao for nome, (versao, _linhas) in self._dados.items()},
+            }
+
+    def limpar(self):
+        with self._lock:
+            self._dados.clear()
+
+
+cache = CacheReferencias()
+
+
+def listar(nome):
+    return cache.obter(nome)
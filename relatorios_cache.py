@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+Cache em disco dos corpos de relatórios gerados (CSV da exportação).
+
+A chave é o próprio ETag da resposta (filtros normalizados + versões dos
+dados), então uma entrada nunca fica desatualizada: quando os dados mudam a
+chave muda e a entrada antiga só espera ser descartada. O diretório é
+limitado em número de arquivos e em bytes, descartando os menos usados
+(mtime, atualizado a cada acerto). Arquivos são gravados em `.tmp` e
+renomeados no fim, então vários workers podem compartilhar o diretório.
+"""
+import os
+import threading
+import uuid
+
+from databaser import BASE_DIR
+
+
+class CacheRelatorios:
+    def __init__(self, diretorio=None, max_arquivos=64, max_bytes=64 * 1024 * 1024):
+        self.diretorio = diretorio
+        self.max_arquivos = max_arquivos
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.acertos = 0
+        self.falhas = 0
+
+    def _caminho(self, chave):
+        return os.path.join(self.diretorio, f"{chave}.csv")
+
+    # ---------- leitura ----------
+    def abrir(self, chave):
+        """Arquivo binário aberto do relatório `chave`, ou None se não está em cache."""
+        if not self.diretorio:
+            return None
+        caminho = self._caminho(chave)
+        try:
+            arquivo = open(caminho, "rb")
+        except OSError:
+            with self._lock:
+                self.falhas += 1
+            return None
+        try:
+            os.utime(caminho)  # marca como usado recentemente
+        except OSError:
+            pass
+        with self._lock:
+            self.acertos += 1
+        return arquivo
+
+    # ---------- escrita ----------
+    def gravando(self, chave, pedacos):
+        """
+        Repassa os pedaços (str) de `pedacos` e, se a geração chegar ao fim,
+        guarda o corpo completo sob `chave`. Uma geração interrompida (cliente
+        desconectou, erro) não deixa arquivo para trás.
+        """
+        if not self.diretorio:
+            yield from pedacos
+            return
+        os.makedirs(self.diretorio, exist_ok=True)
+        temporario = os.path.join(self.diretorio, f".{uuid.uuid4().hex}.tmp")
+        completo = False
+        try:
+            with open(temporario, "w", encoding="utf-8", newline="") as destino:
+                for pedaco in pedacos:
+                    destino.write(pedaco)
+                    yield pedaco
+            os.replace(temporario, self._caminho(chave))
+            completo = True
+        finally:
+            if not completo:
+                try:
+                    os.remove(temporario)
+                except OSError:
+                    pass
+        self.podar()
+
+    def podar(self):
+        """Descarta os relatórios menos usados além de max_arquivos / max_bytes."""
+        if not self.diretorio:
+            return 0
+        entradas = []
+        with os.scandir(self.diretorio) as it:
+            for item in it:
+                if not item.name.endswith(".csv"):
+                    continue
+                try:
+                    info = item.stat()
+                except OSError:
+                    continue
+                entradas.append((info.st_mtime, info.st_size, item.path))
+        entradas.sort(reverse=True)  # mais recentes primeiro
+
+        removidos = 0
+        total = 0
+        for i, (_mtime, tamanho, caminho) in enumerate(entradas):
+            total += tamanho
+            if i < self.max_arquivos and total <= self.max_bytes:
+                continue
+            try:
+                os.remove(caminho)
+                removidos += 1
+            except OSError:
+                pass
+        return removidos
+
+    def limpar(self):
+        if not self.diretorio or not os.path.isdir(self.diretorio):
+            return
+        for nome in os.listdir(self.diretorio):
+            if nome.endswith(".csv"):
+                try:
+                    os.remove(os.path.join(self.diretorio, nome))
+                except OSError:
+                    pass
+
+    def estatisticas(self):
+        with self._lock:
+            return {"acertos": self.acertos, "falhas": self.falhas}
+
+
+cache = CacheRelatorios()
+
+
+def init_app(app):
+    app.config.setdefault("RELATORIOS_CACHE_DIR", os.path.join(BASE_DIR, "cache_relatorios"))
+    app.config.setdefault("RELATORIOS_CACHE_MAX_ARQUIVOS", 64)
+    app.config.setdefault("RELATORIOS_CACHE_MAX_MB", 64)
+    cache.diretorio = app.config["RELATORIOS_CACHE_DIR"] or None  # vazio desliga o cache
+    cache.max_arquivos = int(app.config["RELATORIOS_CACHE_MAX_ARQUIVOS"])
+    cache.max_bytes = int(app.config["RELATORIOS_CACHE_MAX_MB"]) * 1024 * 1024
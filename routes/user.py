@@ -1,63 +1,122 @@
 # -*- coding: utf-8 -*-
-import re
 import csv
 import io
+import json
+import base64
+import hashlib
 import sqlite3
 import calendar
 
 from flask import (
     Blueprint, redirect, render_template, request, session,
-    url_for, flash, jsonify
+    url_for, flash, jsonify, Response, stream_with_context, send_file
 )
 from functools import wraps
 from datetime import datetime, date, timedelta
-from werkzeug.security import check_password_hash, generate_password_hash
 
 from databaser import (
-    conectar, criar_tabelas, horarios_disponiveis
+    conectar, horarios_disponiveis, horarios_disponiveis_periodo,
+    registrar_ocupacao, versoes_dados, SQL_AGENDA_MEDICO_DIA, SQL_TOTAIS_GERAIS, FONTES_CONSULTAS_QUENTES,
+    inserir_agendamento, inserir_serie, minutos_ocupados_paciente, recurso_em_conflito, ConflitoHorario
 )
+from referencias import listar, cache as cache_referencias
+from relatorios_cache import cache as cache_relatorios
+import busca
+import chamadas
+import recorrencia
+import rastreio_sql
+from perfis import perfis
+import senhas
+from normalizacao import (
+    STATUS_AGENDAMENTO, STATUS_LABELS, STATUS_CODIGO, ROTULO_POR_CODIGO, STATUS_CONCLUIDO, STATUS_CANCELADO,
+    normalizar_hora, data_valida, hora_valida, minutos_desde_epoca
+)
+
+MSG_CONFLITO = {
+    "sala": "Já existe uma consulta para essa sala nesse horário.",
+    "medico": "O médico já possui uma consulta nesse horário.",
+    "paciente": "Você já possui uma consulta nesse horário.",
+}
+
+
+# ---------- GET condicional (ETag) ----------
+def _etag(nome, partes, tabelas):
+    """
+    ETag forte de uma resposta derivada de `partes` (parâmetros já
+    normalizados) e das versões atuais de `tabelas` em versoes_cache.
+    """
+    versoes = versoes_dados()
+    chave = json.dumps([nome, partes, [versoes.get(t) for t in tabelas]], sort_keys=True, default=str)
+    return hashlib.sha256(chave.encode("utf-8")).hexdigest()[:32]
+
+
+def _nao_modificado(etag):
+    """Resposta 304 se o cliente já tem `etag`, senão None."""
+    if etag in request.if_none_match:
+        resposta = Response(status=304)
+        return _com_etag(resposta, etag)
+    return None
+
+
+def _com_etag(resposta, etag):
+    resposta.set_etag(etag)
+    # conteúdo por usuário: só o navegador guarda e sempre revalida
+    resposta.headers["Cache-Control"] = "private, no-cache"
+    return resposta
+
 
-STATUS_AGENDAMENTO = [
-    ("agendado", "Agendado"),
-    ("em atendimento", "Em atendimento"),
-    ("concluido", "Concluído"),
-    ("cancelado", "Cancelado"),
-]
-STATUS_LABELS = {valor: rotulo for valor, rotulo in STATUS_AGENDAMENTO}
-CONFLICT_TOKENS = ("<<<<<<<", "=======", ">>>>>>>")
+def _json_disponibilidade(nome, partes, produzir):
+    """jsonify(produzir()) com ETag pela versão de agendamentos; 304 se inalterado."""
+    etag = _etag(nome, partes, ("agendamentos",))
+    return _nao_modificado(etag) or _com_etag(jsonify(produzir()), etag)
+
+
+def _intervalo_do_mes(mes):
+    """(primeiro, último dia) de um mês AAAA-MM; None se inválido."""
+    try:
+        ano_str, mes_str = mes.split("-")
+        ano_i = int(ano_str)
+        mes_i = int(mes_str)
+        return date(ano_i, mes_i, 1), date(ano_i, mes_i, calendar.monthrange(ano_i, mes_i)[1])
+    except ValueError:
+        return None
+
+
+def _erro_periodo(filtros):
+    """Mensagem para inicio/fim/mes preenchidos em formato inválido; None se o período é válido."""
+    invalidos = [rotulo for campo, rotulo in (("inicio", "data inicial"), ("fim", "data final"))
+                 if filtros.get(campo) and not data_valida(filtros[campo])]
+    if filtros.get("mes") and _intervalo_do_mes(filtros["mes"]) is None:
+        invalidos.append("mês")
+    if not invalidos:
+        return None
+    return f"Filtro de período inválido ({', '.join(invalidos)}): use AAAA-MM-DD para datas e AAAA-MM para o mês."
 
 
 def _aplicar_intervalo_mes(filtros):
     inicio = filtros.get("inicio") or ""
     fim = filtros.get("fim") or ""
-    if filtros.get("mes"):
-        try:
-            ano_str, mes_str = filtros["mes"].split("-")
-            ano_i = int(ano_str)
-            mes_i = int(mes_str)
-            inicio_mes = date(ano_i, mes_i, 1)
-            fim_mes = date(ano_i, mes_i, calendar.monthrange(ano_i, mes_i)[1])
-            if not inicio:
-                inicio = inicio_mes.isoformat()
-            if not fim:
-                fim = fim_mes.isoformat()
-        except ValueError:
-            pass
+    intervalo = _intervalo_do_mes(filtros["mes"]) if filtros.get("mes") else None
+    if intervalo:
+        if not inicio:
+            inicio = intervalo[0].isoformat()
+        if not fim:
+            fim = intervalo[1].isoformat()
     filtros["inicio"] = inicio
     filtros["fim"] = fim
     return filtros
 
 
-def _buscar_agendamentos_filtrados(filtros):
-    filtros = _aplicar_intervalo_mes(dict(filtros))
+def _condicoes_filtros(filtros):
     condicoes = []
     params = []
-    if filtros.get("inicio"):
-        condicoes.append("a.data >= ?")
-        params.append(filtros["inicio"])
-    if filtros.get("fim"):
-        condicoes.append("a.data <= ?")
-        params.append(filtros["fim"])
+    # período em inicio_min (minutos), intervalo [inicio 00:00, fim + 1 dia)
+    if data_valida(filtros.get("inicio")):
+        condicoes.append("a.inicio_min >= ?")
+        params.append(minutos_desde_epoca(filtros["inicio"]))
+    if data_valida(filtros.get("fim")):
+        condicoes.append("a.inicio_min < ?")
+        params.append(minutos_desde_epoca(filtros["fim"]) + 24 * 60)
     if filtros.get("medico"):
         condicoes.append("a.medico_id = ?")
         params.append(filtros["medico"])
@@ -68,137 +127,254 @@ def _buscar_agendamentos_filtrados(filtros):
         condicoes.append("a.procedimento_id = ?")
         params.append(filtros["procedimento"])
     if filtros.get("convenio"):
-        condicoes.append("COALESCE(a.convenio, '') LIKE ?")
-        params.append(f"%{filtros['convenio']}%")
-
-    base_query = """
-        SELECT a.id, a.data, a.hora, a.status, a.convenio,
-               pac.nome AS paciente, med.nome AS medico, pr.nome AS procedimento
-        FROM agendamentos a
-        JOIN usuarios pac ON pac.id = a.paciente_id
-        JOIN usuarios med ON med.id = a.medico_id
-        JOIN procedimentos pr ON pr.id = a.procedimento_id
-    """
-    if condicoes:
-        base_query += " WHERE " + " AND ".join(condicoes)
-    base_query += " ORDER BY a.data, a.hora"
+        termo = busca.termo_fts(filtros["convenio"])
+        if termo:
+            # trecho do convênio pelo índice FTS5 (trigram) em vez de LIKE '%x%'
+            condicoes.append("a.id IN (SELECT rowid FROM busca_agendamentos WHERE convenio MATCH ?)")
+            params.append(termo)
+        else:
+            condicoes.append("COALESCE(a.convenio, '') LIKE ?")
+            params.append(f"%{filtros['convenio']}%")
+    return condicoes, params
 
-    conn = conectar()
-    cur = conn.cursor()
-    cur.execute(base_query, params)
-    linhas = cur.fetchall()
-    conn.close()
 
-    status_validos = {valor for valor, _rotulo in STATUS_AGENDAMENTO}
-    agendamentos_filtrados = []
-    for row in linhas:
-        registro = dict(row)
-        status_normalizado = _normalizar_status(registro.get("status", ""), status_validos)
-        registro["status"] = status_normalizado
-        if isinstance(status_normalizado, str):
-            registro["status_label"] = STATUS_LABELS.get(status_normalizado, status_normalizado.title())
-        else:
-            registro["status_label"] = status_normalizado
-        registro["data_display"] = _formatar_data_display(registro.get("data"))
-        registro["convenio"] = registro.get("convenio") or "—"
-        agendamentos_filtrados.append(registro)
+# ------------------ Paginação por keyset (inicio_min, id) ------------------
+POR_PAGINA_PADRAO = 50
+POR_PAGINA_MAX = 200
 
-    totais_filtrados = {
-        "total": len(agendamentos_filtrados),
-        "concluidos": 0,
-        "cancelados": 0,
-        "agendados": 0,
-    }
-    for item in agendamentos_filtrados:
-        status_val = (item.get("status") or "").lower()
-        if status_val == "concluido":
-            totais_filtrados["concluidos"] += 1
-        elif status_val == "cancelado":
-            totais_filtrados["cancelados"] += 1
-        elif status_val:
-            totais_filtrados["agendados"] += 1
-    totais_filtrados["realizados"] = totais_filtrados["concluidos"]
 
-    return agendamentos_filtrados, totais_filtrados, filtros
+def _codificar_cursor(registro):
+    # inicio_min NULL (legado não reparado) vai como null no cursor
+    bruto = json.dumps([registro["inicio_min"], registro["id"]])
+    return base64.urlsafe_b64encode(bruto.encode("utf-8")).decode("ascii").rstrip("=")
 
 
-def _remover_marcadores_conflito(valor):
-    if not isinstance(valor, str):
-        return valor
-    texto = valor.strip()
+def _decodificar_cursor(texto):
     if not texto:
-        return texto
-    if not any(token in texto for token in CONFLICT_TOKENS):
-        return texto
-
-    blocos = []
-    trecho_atual = []
-    for linha in texto.splitlines():
-        if linha.startswith("<<<<<<<"):
-            trecho_atual = []
-            continue
-        if linha.startswith("======="):
-            blocos.append("\n".join(trecho_atual).strip())
-            trecho_atual = []
-            continue
-        if linha.startswith(">>>>>>>"):
-            blocos.append("\n".join(trecho_atual).strip())
-            trecho_atual = []
-            continue
-        trecho_atual.append(linha)
+        return None
+    try:
+        bruto = base64.urlsafe_b64decode(texto + "=" * (-len(texto) % 4))
+        inicio_min, id_ = json.loads(bruto.decode("utf-8"))
+        return (None if inicio_min is None else int(inicio_min), int(id_))
+    except (ValueError, TypeError):
+        return None
 
-    if trecho_atual:
-        blocos.append("\n".join(trecho_atual).strip())
 
-    for bloco in blocos:
-        if bloco:
-            return bloco
+def _parametros_paginacao(args):
+    try:
+        por_pagina = int(args.get("por_pagina") or POR_PAGINA_PADRAO)
+    except ValueError:
+        por_pagina = POR_PAGINA_PADRAO
+    por_pagina = max(1, min(por_pagina, POR_PAGINA_MAX))
+    return {
+        "apos": _decodificar_cursor(args.get("apos")),
+        "antes": _decodificar_cursor(args.get("antes")),
+        "por_pagina": por_pagina,
+    }
 
-    return texto.replace("<<<<<<<", "").replace("=======", "").replace(">>>>>>>", "").strip()
 
+def _trechos_cursor(cursor, voltando):
+    """
+    Condições (sql, params) do seek em (a.inicio_min, a.id). No ORDER BY os
+    legados com inicio_min NULL vêm antes de tudo e NULL não se compara, então
+    a página que atravessa a fronteira sai de dois trechos, cada um no índice.
+    """
+    if cursor is None:
+        return [(None, [])]
+    inicio_min, id_ = cursor
+    if inicio_min is None:
+        legados = ("a.inicio_min IS NULL AND a.id %s ?" % ("<" if voltando else ">"), [id_])
+        return [legados] if voltando else [legados, ("a.inicio_min IS NOT NULL", [])]
+    if voltando:
+        return [("(a.inicio_min, a.id) < (?, ?)", [inicio_min, id_]), ("a.inicio_min IS NULL", [])]
+    return [("(a.inicio_min, a.id) > (?, ?)", [inicio_min, id_])]
+
+
+def _sql_pagina(select_sql, condicoes, params, pagina):
+    """SQL de uma página keyset de `select_sql`: (sql, params, voltando, cursor)."""
+    voltando = pagina.get("antes") is not None and pagina.get("apos") is None
+    cursor = pagina["antes"] if voltando else pagina.get("apos")
+    direcao = "DESC" if voltando else "ASC"
+    limite = pagina["por_pagina"] + 1
+
+    partes, valores = [], []
+    for condicao, params_condicao in _trechos_cursor(cursor, voltando):
+        todas = list(condicoes) + ([condicao] if condicao else [])
+        sql = select_sql
+        if todas:
+            sql += " WHERE " + " AND ".join(todas)
+        sql += f" ORDER BY a.inicio_min {direcao}, a.id {direcao} LIMIT ?"
+        partes.append(sql)
+        valores.extend(list(params) + params_condicao + [limite])
+    if len(partes) == 1:
+        return partes[0], valores, voltando, cursor
+    sql = " UNION ALL ".join(f"SELECT * FROM ({parte})" for parte in partes)
+    sql += f" ORDER BY inicio_min {direcao}, id {direcao} LIMIT ?"
+    return sql, valores + [limite], voltando, cursor
+
+
+def _paginar(cur, select_sql, condicoes, params, pagina):
+    """
+    Executa `select_sql` (que deve trazer a.id e a.inicio_min) com seek em
+    (a.inicio_min, a.id). Devolve (linhas, {"proximo", "anterior", "por_pagina"}).
+    """
+    limite = pagina["por_pagina"]
+    sql, params, voltando, cursor = _sql_pagina(select_sql, condicoes, params, pagina)
+    cur.execute(sql, params)
+    linhas = cur.fetchall()
+    ha_mais = len(linhas) > limite
+    linhas = linhas[:limite]
+    if voltando:
+        linhas.reverse()
+
+    paginacao = {"por_pagina": limite, "proximo": None, "anterior": None}
+    if linhas:
+        primeira, ultima = linhas[0], linhas[-1]
+        if voltando:
+            paginacao["anterior"] = _codificar_cursor(primeira) if ha_mais else None
+            paginacao["proximo"] = _codificar_cursor(ultima)
+        else:
+            paginacao["proximo"] = _codificar_cursor(ultima) if ha_mais else None
+            paginacao["anterior"] = _codificar_cursor(primeira) if cursor else None
+    return linhas, paginacao
+
+
+def _totais_por_codigo(por_codigo):
+    total = sum(por_codigo.values())
+    concluidos = por_codigo.get(STATUS_CONCLUIDO, 0)
+    cancelados = por_codigo.get(STATUS_CANCELADO, 0)
+    # "em aberto" inclui status legados ainda não reparados (código NULL)
+    return {
+        "total": total,
+        "concluidos": concluidos,
+        "cancelados": cancelados,
+        "realizados": concluidos,
+        "agendados": total - concluidos - cancelados,
+    }
 
-def _normalizar_status(valor, validos):
-    texto = (_remover_marcadores_conflito(valor) or "").strip().lower()
-    if not texto:
-        return "agendado" if "agendado" in validos else (next(iter(validos)) if validos else texto)
 
-    if texto in validos:
-        return texto
+def _sql_totais(condicoes, params):
+    if not condicoes:
+        # painel sem filtros: contadores dos triggers em vez de varrer agendamentos
+        return SQL_TOTAIS_GERAIS, []
+    sql = "SELECT a.status_codigo, COUNT(*) FROM agendamentos a WHERE " + " AND ".join(condicoes)
+    return sql + " GROUP BY a.status_codigo", list(params)
 
-    for candidato in validos:
-        if candidato in texto:
-            return candidato
 
-    return texto
+def _totais_agendamentos(cur, condicoes, params):
+    cur.execute(*_sql_totais(condicoes, params))
+    if condicoes:
+        return _totais_por_codigo(dict(cur.fetchall()))
+    por_codigo = {}
+    for row in cur.fetchall():
+        codigo = STATUS_CODIGO.get((row["status"] or "").strip())
+        por_codigo[codigo] = por_codigo.get(codigo, 0) + row["total"]
+    return _totais_por_codigo(por_codigo)
 
 
-def _normalizar_data(valor):
-    texto = (_remover_marcadores_conflito(valor) or "").strip()
-    if not texto:
-        return texto
+def _rotulo_status(row):
+    rotulo = ROTULO_POR_CODIGO.get(row["status_codigo"])
+    return rotulo if rotulo is not None else (row["status"] or "").title()
 
-    match_iso = re.search(r"\b\d{4}-\d{2}-\d{2}\b", texto)
-    if match_iso:
-        return match_iso.group(0)
 
-    match_br = re.search(r"\b\d{2}/\d{2}/\d{4}\b", texto)
-    if match_br:
-        dia, mes, ano = match_br.group(0).split("/")
-        return f"{ano}-{mes}-{dia}"
+SQL_RELATORIO = """
+    SELECT a.id, a.data, a.hora, a.inicio_min, a.status_codigo, a.status, a.convenio,
+           pac.nome AS paciente, med.nome AS medico, pr.nome AS procedimento
+    FROM agendamentos a
+    JOIN usuarios pac ON pac.id = a.paciente_id
+    JOIN usuarios med ON med.id = a.medico_id
+    JOIN procedimentos pr ON pr.id = a.procedimento_id
+"""
 
-    return texto
 
+def _buscar_agendamentos_filtrados(filtros, pagina):
+    """
+    Lista uma página (keyset, ver _parametros_paginacao) dos agendamentos dos
+    filtros. Os totais vêm de uma consulta agregada separada e não dependem
+    da página. Retorna (agendamentos, totais, filtros_normalizados, paginacao).
+    """
+    filtros = _aplicar_intervalo_mes(dict(filtros))
+    condicoes, params = _condicoes_filtros(filtros)
 
-def _normalizar_hora(valor):
-    texto = (_remover_marcadores_conflito(valor) or "").strip()
-    if not texto:
-        return texto
+    conn = conectar()
+    cur = conn.cursor()
+    linhas, paginacao = _paginar(cur, SQL_RELATORIO, condicoes, params, pagina)
+    totais_filtrados = _totais_agendamentos(cur, condicoes, params)
+    conn.close()
 
-    match_hora = re.search(r"\b\d{2}:\d{2}\b", texto)
-    if match_hora:
-        return match_hora.group(0)
+    agendamentos_filtrados = []
+    for row in linhas:
+        registro = dict(row)
+        registro["status_label"] = _rotulo_status(row)
+        registro["data_display"] = _formatar_data_display(row["data"])
+        registro["convenio"] = row["convenio"] or "—"
+        agendamentos_filtrados.append(registro)
+    return agendamentos_filtrados, totais_filtrados, filtros, paginacao
 
-    return texto
+
+EXPORTACAO_LOTE = 500  # linhas por fetchmany / pedaço enviado ao cliente
+CABECALHO_RELATORIO = ["Data", "Hora", "Paciente", "Médico", "Procedimento", "Convênio", "Status"]
+
+
+def _sql_relatorio(filtros):
+    """SQL completo da exportação (sem paginação): (sql, params)."""
+    condicoes, params = _condicoes_filtros(filtros)
+    sql = SQL_RELATORIO
+    if condicoes:
+        sql += " WHERE " + " AND ".join(condicoes)
+    return sql + " ORDER BY a.inicio_min, a.id", params
+
+
+def _gerar_csv_relatorio(filtros):
+    """
+    Gera o CSV do relatório em pedaços de EXPORTACAO_LOTE linhas, lendo o
+    cursor com fetchmany; os totais do rodapé são somados durante a leitura.
+    `filtros` já deve ter passado por _aplicar_intervalo_mes.
+    """
+    sql, params = _sql_relatorio(filtros)
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def despejar():
+        pedaco = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return pedaco
+
+    writer.writerow(CABECALHO_RELATORIO)
+    yield despejar()
+
+    por_codigo = {}
+    conn = conectar()
+    cur = conn.cursor()
+    cur.execute(sql, params)
+    try:
+        while True:
+            linhas = cur.fetchmany(EXPORTACAO_LOTE)
+            if not linhas:
+                break
+            for row in linhas:
+                codigo = row["status_codigo"]
+                por_codigo[codigo] = por_codigo.get(codigo, 0) + 1
+                writer.writerow([
+                    row["data"],
+                    row["hora"],
+                    row["paciente"],
+                    row["medico"],
+                    row["procedimento"],
+                    row["convenio"] or "—",
+                    _rotulo_status(row),
+                ])
+            yield despejar()
+    finally:
+        cur.close()
+        conn.close()
+
+    totais = _totais_por_codigo(por_codigo)
+    writer.writerow([])
+    writer.writerow(["Totais", totais["total"], "Realizados", totais["realizados"], "Cancelados", totais["cancelados"], "Em aberto", totais["agendados"]])
+    yield despejar()
 
 
 def _formatar_data_display(valor):
@@ -233,6 +409,13 @@ def login_required(role=None):
     return wrapper
 
 
+@user_bp.errorhandler(senhas.SenhaIndisponivel)
+def senha_indisponivel(_erro):
+    # pool de senhas cheio ou lento: falha rápido e devolve o usuário ao formulário
+    flash("Muitos acessos ao mesmo tempo. Tente novamente em alguns segundos.", "warning")
+    return redirect(request.referrer or url_for("user.user"))
+
+
 # ------------------ Login ------------------
 @user_bp.route("/", methods=["GET", "POST"], endpoint="user")
 def user():
@@ -247,14 +430,15 @@ def user():
 
         if usuario:
             senha_db = usuario["senha"]
-            ok = False
-            try:
-                ok = check_password_hash(senha_db, senha)
-            except Exception:
-                ok = False
-            if not ok:
-                # compatibilidade com alguma senha antiga salva sem hash
-                ok = (senha_db == senha)
+            ok = senhas.verificar(senha_db, senha)
+
+            if ok and not senhas.parece_hash(senha_db):
+                # senha antiga salva sem hash: troca pelo hash no primeiro login válido
+                cur.execute(
+                    "UPDATE usuarios SET senha=? WHERE id=? AND senha=?",
+                    (senhas.gerar_hash(senha), usuario["id"], senha_db),
+                )
+                conn.commit()
 
             if ok:
                 session["usuario_id"] = usuario["id"]
@@ -290,7 +474,7 @@ def register():
         email = request.form.get("email", "").strip().lower()
         senha = request.form.get("senha", "")
 
-        senha_hash = generate_password_hash(senha)
+        senha_hash = senhas.gerar_hash(senha)
 
         conn = conectar()
         cur = conn.cursor()
@@ -308,30 +492,64 @@ def register():
 
 
 # ------------------ Recepção: Agendar consulta ------------------
+def _resolver_procedimento(conn, procedimento_raw, convenio_informado, criar=True):
+    """
+    Converte o procedimento do formulário (id ou fallback textual) no id real
+    e deduz o convênio gravado no agendamento. Devolve (procedimento_id, convenio);
+    com `criar=False` o fallback ainda inexistente não é gravado e o id é None.
+    """
+    cur = conn.cursor()
+    procedimento_id = procedimento_raw
+    # procedimento fallback textual -> converte para ID real
+    if not procedimento_id.isdigit():
+        nome_map = {
+            "__particular__": "Consulta Particular",
+            "__convenio__":  "Consulta Convênio",
+            "__receita__":   "Solicitação de Receita",
+        }
+        nome = nome_map.get(procedimento_id, procedimento_id)
+        cur.execute("SELECT id FROM procedimentos WHERE nome = ?", (nome,))
+        row = cur.fetchone()
+        if row:
+            procedimento_id = str(row["id"])
+        elif not criar:
+            # simulação: nada é gravado, nem o procedimento novo
+            return None, _convenio_do_procedimento(nome, procedimento_raw, convenio_informado)
+        else:
+            cur.execute("INSERT INTO procedimentos (nome, descricao) VALUES (?, ?)", (nome, ""))
+            conn.commit()
+            procedimento_id = str(cur.lastrowid)
+
+    cur.execute("SELECT nome FROM procedimentos WHERE id = ?", (procedimento_id,))
+    row_proc = cur.fetchone()
+    procedimento_nome = (row_proc["nome"] if row_proc else "")
+    return procedimento_id, _convenio_do_procedimento(procedimento_nome, procedimento_raw, convenio_informado)
+
+
+def _convenio_do_procedimento(procedimento_nome, procedimento_raw, convenio_informado):
+    nome_lower = (procedimento_nome or "").lower()
+    convenio_valor = convenio_informado or None
+    if "convênio" in nome_lower or "convenio" in nome_lower or procedimento_raw == "__convenio__":
+        convenio_valor = convenio_informado or "Convênio"
+    elif "particular" in nome_lower or procedimento_raw == "__particular__":
+        convenio_valor = "Particular"
+    elif "receita" in nome_lower or procedimento_raw == "__receita__":
+        convenio_valor = "Receita"
+    return convenio_valor
+
+
 @user_bp.route("/agendar_consulta", methods=["GET", "POST"], endpoint="agendar_consulta")
 @login_required(role='recepcionista')
 def agendar_consulta():
-    criar_tabelas()  # garante estrutura + seeds (idempotente)
-
     conn = conectar()
-    cur = conn.cursor()
 
-    # Carrega dados para o GET (render) e também para recarregar após POST clássico
-    cur.execute("SELECT id, nome FROM usuarios WHERE tipo_usuario = 'paciente'")
-    pacientes = cur.fetchall()
-    cur.execute("SELECT id, nome FROM usuarios WHERE tipo_usuario IN ('medico','médico')")
-    medicos = cur.fetchall()
-    cur.execute("SELECT id, nome FROM procedimentos")
-    procedimentos = cur.fetchall()
-    cur.execute("SELECT id, nome FROM salas")
-    salas = cur.fetchall()
-
-    # Se for GET, só renderiza
+    # Se for GET, só renderiza (listas pequenas vêm do cache versionado;
+    # pacientes e médicos são buscados sob demanda em /user/api/usuarios)
     if request.method == "GET":
         conn.close()
         return render_template(
             "agendamentoConsulta.html",
-            pacientes=pacientes, medicos=medicos, procedimentos=procedimentos, salas=salas
+            procedimentos=listar("procedimentos"), salas=listar("salas"),
         )
 
     # POST: aceita tanto formulário normal quanto JSON/AJAX
@@ -341,15 +559,14 @@ def agendar_consulta():
     try:
         paciente_id       = (data_in.get("paciente_id") or "").strip()
         medico_id         = (data_in.get("medico_id") or "").strip()
-        procedimento_id   = (data_in.get("procedimento_id") or "").strip()
-        procedimento_raw  = procedimento_id
+        procedimento_raw  = (data_in.get("procedimento_id") or "").strip()
         sala_id           = (data_in.get("sala_id") or "").strip()
         data_             = (data_in.get("data") or "").strip()
         hora_             = (data_in.get("hora") or "").strip()
         convenio_informado = (data_in.get("convenio") or data_in.get("convenio_subtipo") or "").strip()
 
         # validações rápidas
-        if not (paciente_id and medico_id and sala_id and data_ and hora_ and procedimento_id):
+        if not (paciente_id and medico_id and sala_id and data_ and hora_ and procedimento_raw):
             if is_ajax:
                 conn.close()
                 return jsonify({"ok": False, "msg": "Preencha todos os campos."}), 400
@@ -357,53 +574,28 @@ def agendar_consulta():
             conn.close()
             return redirect(url_for("user.agendar_consulta"))
 
-        # procedimento fallback textual -> converte para ID real
-        if not procedimento_id.isdigit():
-            nome_map = {
-                "__particular__": "Consulta Particular",
-                "__convenio__":  "Consulta Convênio",
-                "__receita__":   "Solicitação de Receita",
-            }
-            nome = nome_map.get(procedimento_id, procedimento_id)
-            cur.execute("SELECT id FROM procedimentos WHERE nome = ?", (nome,))
-            row = cur.fetchone()
-            if row:
-                procedimento_id = str(row["id"])
-            else:
-                cur.execute("INSERT INTO procedimentos (nome, descricao) VALUES (?, ?)", (nome, ""))
-                conn.commit()
-                procedimento_id = str(cur.lastrowid)
-
-        cur.execute("SELECT nome FROM procedimentos WHERE id = ?", (procedimento_id,))
-        row_proc = cur.fetchone()
-        procedimento_nome = (row_proc["nome"] if row_proc else "")
-        nome_lower = (procedimento_nome or "").lower()
-        convenio_valor = convenio_informado or None
-        if "convênio" in nome_lower or "convenio" in nome_lower or procedimento_raw == "__convenio__":
-            convenio_valor = convenio_informado or "Convênio"
-        elif "particular" in nome_lower or procedimento_raw == "__particular__":
-            convenio_valor = "Particular"
-        elif "receita" in nome_lower or procedimento_raw == "__receita__":
-            convenio_valor = "Receita"
-
-        # conflito sala+data+hora
-        cur.execute("SELECT 1 FROM agendamentos WHERE data=? AND hora=? AND sala_id=?", (data_, hora_, sala_id))
-        if cur.fetchone():
-            if is_ajax:
-                conn.close()
-                return jsonify({"ok": False, "msg": "Já existe uma consulta para essa sala nesse horário."}), 409
-            flash("Já existe uma consulta marcada para essa sala nesse horário!", "danger")
+        if not (data_valida(data_) and hora_valida(hora_)):
             conn.close()
+            if is_ajax:
+                return jsonify({"ok": False, "msg": "Data ou horário em formato inválido."}), 400
+            flash("Data ou horário em formato inválido.", "danger")
             return redirect(url_for("user.agendar_consulta"))
 
-        # insere
-        cur.execute(
-            """INSERT INTO agendamentos
-               (paciente_id, medico_id, procedimento_id, sala_id, data, hora, convenio)
-               VALUES (?, ?, ?, ?, ?, ?, ?)""",
-            (paciente_id, medico_id, procedimento_id, sala_id, data_, hora_, convenio_valor)
-        )
-        conn.commit()
+        procedimento_id, convenio_valor = _resolver_procedimento(conn, procedimento_raw, convenio_informado)
+
+        # insere; conflito de sala/médico é barrado pelos índices únicos
+        try:
+            novo_id = inserir_agendamento(
+                conn, paciente_id, medico_id, procedimento_id, sala_id, data_, hora_, convenio_valor
+            )
+        except ConflitoHorario as conflito:
+            conn.close()
+            msg = MSG_CONFLITO[conflito.recurso]
+            if is_ajax:
+                return jsonify({"ok": False, "msg": msg}), 409
+            flash(msg, "danger")
+            return redirect(url_for("user.agendar_consulta"))
+        registrar_ocupacao(novo_id, depois=(medico_id, sala_id, data_, hora_))
         conn.close()
 
         if is_ajax:
@@ -419,74 +611,173 @@ def agendar_consulta():
         return redirect(url_for("user.agendar_consulta"))
 
 
+# ------------------ Recepção: Série de consultas recorrentes ------------------
+MSG_CONFLITO_SERIE = {
+    "sala": "Sala ocupada nesse horário.",
+    "medico": "Médico ocupado nesse horário.",
+    "paciente": "O paciente já possui uma consulta nesse horário.",
+}
+
+
+@user_bp.route("/recepcionista/agendar_serie", methods=["POST"], endpoint="agendar_serie")
+@login_required(role='recepcionista')
+def agendar_serie():
+    """
+    Agenda a mesma consulta em série (semanal, quinzenal ou mensal) numa única
+    transação (databaser.inserir_serie) e responde, por ocorrência, o que foi
+    agendado e o que conflitou, com o horário livre mais próximo de cada conflito.
+    """
+    dados = request.get_json(silent=True) or {}
+
+    def campo(nome):
+        return str(dados.get(nome) or "").strip()
+
+    paciente_id, medico_id, sala_id = campo("paciente_id"), campo("medico_id"), campo("sala_id")
+    procedimento_raw = campo("procedimento_id")
+    inicio_, hora_, ate_ = campo("inicio") or campo("data"), campo("hora"), campo("ate")
+    ocorrencias = campo("ocorrencias")
+
+    if not (paciente_id and medico_id and sala_id and procedimento_raw and inicio_ and hora_
+            and campo("frequencia") and (ocorrencias or ate_)):
+        return jsonify({"ok": False, "msg": "Preencha todos os campos."}), 400
+    if not (paciente_id.isdigit() and medico_id.isdigit() and sala_id.isdigit()):
+        return jsonify({"ok": False, "msg": "Paciente, médico ou sala inválido."}), 400
+    if not (data_valida(inicio_) and hora_valida(hora_) and (not ate_ or data_valida(ate_))
+            and (not ocorrencias or ocorrencias.isdigit())):
+        return jsonify({"ok": False, "msg": "Data, horário ou número de ocorrências em formato inválido."}), 400
+    if datetime.strptime(f"{inicio_} {hora_}", "%Y-%m-%d %H:%M") <= datetime.now():
+        return jsonify({"ok": False, "msg": "A série deve começar num horário futuro."}), 400
+    try:
+        datas = recorrencia.expandir(
+            date.fromisoformat(inicio_), campo("frequencia"),
+            ocorrencias=int(ocorrencias) if ocorrencias else None,
+            ate=date.fromisoformat(ate_) if ate_ else None,
+        )
+    except ValueError as e:
+        return jsonify({"ok": False, "msg": str(e)}), 400
+
+    simular = bool(dados.get("simular"))
+    conn = conectar()
+    try:
+        procedimento_id, convenio_valor = _resolver_procedimento(
+            conn, procedimento_raw, campo("convenio") or campo("convenio_subtipo"), criar=not simular,
+        )
+        reservas, conflitos = inserir_serie(
+            conn, paciente_id, medico_id, procedimento_id, sala_id,
+            [d.isoformat() for d in datas], hora_, convenio_valor,
+            tudo_ou_nada=bool(dados.get("tudo_ou_nada")), simular=simular,
+        )
+    except ConflitoHorario as conflito:
+        conn.close()
+        return jsonify({"ok": False, "msg": MSG_CONFLITO_SERIE[conflito.recurso]}), 409
+    except Exception as e:
+        conn.close()
+        return jsonify({"ok": False, "msg": f"Erro ao agendar: {e}"}), 500
+    for data_, novo_id in reservas:
+        if novo_id is not None:
+            registrar_ocupacao(novo_id, depois=(medico_id, sala_id, data_, hora_))
+    conn.close()
+
+    # alternativas não colidem com a própria série, entre si nem com outras
+    # consultas do paciente (sala e médico livres não bastam)
+    ocupados = {minutos_desde_epoca(data_, hora_) for data_, _ in reservas}
+    if conflitos:
+        janela = timedelta(days=recorrencia.JANELA_ALTERNATIVA_DIAS)
+        ocupados |= minutos_ocupados_paciente(int(paciente_id), datas[0] - janela, datas[-1] + janela)
+    relatorio_conflitos = []
+    for dia in datas:
+        recurso = conflitos.get(dia.isoformat())
+        if recurso is None:
+            continue
+        alternativa = recorrencia.alternativa_mais_proxima(int(medico_id), int(sala_id), dia, hora_, ocupados)
+        if alternativa:
+            ocupados.add(minutos_desde_epoca(alternativa["data"], alternativa["hora"]))
+        relatorio_conflitos.append({
+            "data": dia.isoformat(), "hora": hora_, "recurso": recurso,
+            "msg": MSG_CONFLITO_SERIE[recurso], "alternativa": alternativa,
+        })
+
+    gravados = [{"data": data_, "hora": hora_, "id": novo_id} for data_, novo_id in reservas if novo_id is not None]
+    livres = [{"data": data_, "hora": hora_} for data_, novo_id in reservas if novo_id is None]
+    if simular:
+        msg = f"Simulação: {len(livres)} de {len(datas)} ocorrências livres."
+    elif gravados:
+        msg = f"{len(gravados)} de {len(datas)} consultas agendadas."
+    else:
+        msg = "Nenhuma consulta da série foi agendada."
+    corpo = {
+        "ok": simular or bool(gravados),
+        "msg": msg,
+        "ocorrencias": len(datas),
+        "agendados": gravados,
+        "livres": livres,
+        "conflitos": relatorio_conflitos,
+    }
+    return jsonify(corpo), 200 if corpo["ok"] else 409
+
+
 
 # ------------------ Painéis ------------------
+SQL_AJUSTES_PENDENTES_CONTAGEM = "SELECT COUNT(1) AS q FROM agendamento_ajustes WHERE status='pendente'"
+
+SQL_CONTAGEM_DIA = "SELECT status, SUM(total) AS total FROM resumo_diario WHERE data=? GROUP BY status"
+
+SQL_CONCLUIDOS_POR_MEDICO = """
+    SELECT med.nome AS medico, r.total
+    FROM resumo_medico r
+    JOIN usuarios med ON med.id = r.medico_id
+    WHERE r.status = 'concluido' AND r.total > 0
+    ORDER BY r.total DESC, med.nome ASC
+"""
+
+SQL_CHAMADAS_PENDENTES = """
+    SELECT c.id, a.data, a.hora, pac.nome AS paciente, med.nome AS medico,
+           pr.nome AS procedimento
+    FROM chamadas_pacientes c
+    JOIN agendamentos a ON a.id = c.agendamento_id
+    JOIN usuarios pac ON pac.id = c.paciente_id
+    JOIN usuarios med ON med.id = c.medico_id
+    JOIN procedimentos pr ON pr.id = a.procedimento_id
+    WHERE c.status = 'pendente'
+    ORDER BY a.inicio_min, c.id
+"""
+
+
 @user_bp.route("/recepcionista", endpoint="visao_recepcionista")
 @login_required(role='recepcionista')
 def visao_recepcionista():
-    criar_tabelas()
     conn = conectar()
     cur = conn.cursor()
-    cur.execute("SELECT COUNT(1) AS q FROM agendamento_ajustes WHERE status='pendente'")
+    cur.execute(SQL_AJUSTES_PENDENTES_CONTAGEM)
     pend = cur.fetchone()["q"]
     hoje = date.today().isoformat()
 
-    cur.execute("SELECT COUNT(1) AS total FROM agendamentos WHERE data=?", (hoje,))
-    total_hoje = cur.fetchone()["total"]
-    cur.execute("SELECT COUNT(1) AS total FROM agendamentos WHERE data=? AND LOWER(status)='cancelado'", (hoje,))
-    cancelados_hoje = cur.fetchone()["total"]
-    cur.execute("SELECT COUNT(1) AS total FROM agendamentos WHERE data=? AND LOWER(status)='concluido'", (hoje,))
-    concluidos_hoje = cur.fetchone()["total"]
+    # contadores mantidos por triggers (resumo_diario / resumo_medico)
+    cur.execute(SQL_CONTAGEM_DIA, (hoje,))
+    por_status = {row["status"]: row["total"] for row in cur.fetchall()}
 
     dashboard_totais = {
-        "agendados_hoje": total_hoje,
-        "cancelados_hoje": cancelados_hoje,
-        "realizados_hoje": concluidos_hoje,
+        "agendados_hoje": sum(por_status.values()),
+        "cancelados_hoje": por_status.get("cancelado", 0),
+        "realizados_hoje": por_status.get("concluido", 0),
     }
 
-    cur.execute(
-        """
-        SELECT med.nome AS medico, COUNT(*) AS total
-        FROM agendamentos a
-        JOIN usuarios med ON med.id = a.medico_id
-        WHERE LOWER(a.status) = 'concluido'
-        GROUP BY med.id
-        ORDER BY total DESC, med.nome ASC
-        """
-    )
+    cur.execute(SQL_CONCLUIDOS_POR_MEDICO)
     consultas_medico = [dict(row) for row in cur.fetchall()]
 
-    cur.execute("SELECT id, nome FROM usuarios WHERE tipo_usuario IN ('medico','médico') ORDER BY nome")
-    medicos = cur.fetchall()
-    cur.execute("SELECT id, nome FROM usuarios WHERE tipo_usuario = 'paciente' ORDER BY nome")
-    pacientes = cur.fetchall()
-    cur.execute("SELECT id, nome FROM procedimentos ORDER BY nome")
-    procedimentos = cur.fetchall()
-    cur.execute(
-        "SELECT DISTINCT convenio FROM agendamentos WHERE convenio IS NOT NULL AND TRIM(convenio)<>'' ORDER BY convenio"
-    )
-    convenios = [row["convenio"] for row in cur.fetchall()]
+    procedimentos = listar("procedimentos")
+    convenios = listar("convenios")
 
-    cur.execute(
-        """
-        SELECT c.id, a.data, a.hora, pac.nome AS paciente, med.nome AS medico,
-               pr.nome AS procedimento
-        FROM chamadas_pacientes c
-        JOIN agendamentos a ON a.id = c.agendamento_id
-        JOIN usuarios pac ON pac.id = c.paciente_id
-        JOIN usuarios med ON med.id = c.medico_id
-        JOIN procedimentos pr ON pr.id = a.procedimento_id
-        WHERE c.status = 'pendente'
-        ORDER BY a.data, a.hora, c.id
-        """
-    )
+    cur.execute(SQL_CHAMADAS_PENDENTES)
     chamadas_rows = cur.fetchall()
     chamadas_pendentes = []
     for row in chamadas_rows:
         registro = dict(row)
         registro["data_display"] = _formatar_data_display(registro.get("data"))
-        registro["hora_display"] = _normalizar_hora(registro.get("hora"))
+        registro["hora_display"] = normalizar_hora(registro.get("hora"))
         chamadas_pendentes.append(registro)
+    # o fluxo SSE da página começa depois do último evento já refletido acima
+    _menor, ultimo_evento_chamadas = chamadas.limites_eventos(conn)
 
     filtros = {
         "inicio": (request.args.get("inicio") or "").strip(),
@@ -498,7 +789,16 @@ def visao_recepcionista():
         "convenio": (request.args.get("convenio") or "").strip(),
     }
 
-    agendamentos_filtrados, totais_filtrados, filtros = _buscar_agendamentos_filtrados(filtros)
+    erro_periodo = _erro_periodo(filtros)
+    if erro_periodo:
+        # a lista abaixo sai sem o período: avisa em vez de mostrar tudo calado
+        flash(erro_periodo + " O período não foi aplicado.", "danger")
+    agendamentos_filtrados, totais_filtrados, filtros, paginacao = _buscar_agendamentos_filtrados(
+        filtros, pagina=_parametros_paginacao(request.args)
+    )
+    # seletores carregam opções sob demanda; só a escolha atual vem renderizada
+    medico_filtro = busca.usuario_por_id(filtros["medico"], "medico") if filtros["medico"] else None
+    paciente_filtro = busca.usuario_por_id(filtros["paciente"], "paciente") if filtros["paciente"] else None
 
     conn.close()
     return render_template(
@@ -509,11 +809,13 @@ def visao_recepcionista():
         filtros=filtros,
         agendamentos_filtrados=agendamentos_filtrados,
         totais_filtrados=totais_filtrados,
-        medicos=medicos,
-        pacientes=pacientes,
+        paginacao=paginacao,
+        medico_filtro=medico_filtro,
+        paciente_filtro=paciente_filtro,
         procedimentos=procedimentos,
         convenios=convenios,
         chamadas_pendentes=chamadas_pendentes,
+        ultimo_evento_chamadas=ultimo_evento_chamadas,
     )
 
 
@@ -544,54 +846,41 @@ def exportar_relatorio():
     elif escopo == "mensal" and not filtros.get("mes"):
         filtros["mes"] = hoje.strftime("%Y-%m")
 
-    agendamentos, totais, filtros_norm = _buscar_agendamentos_filtrados(filtros)
-
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow([
-        "Data",
-        "Hora",
-        "Paciente",
-        "Médico",
-        "Procedimento",
-        "Convênio",
-        "Status",
-    ])
-    for linha in agendamentos:
-        writer.writerow([
-            linha.get("data"),
-            linha.get("hora"),
-            linha.get("paciente"),
-            linha.get("medico"),
-            linha.get("procedimento"),
-            linha.get("convenio"),
-            linha.get("status_label"),
-        ])
-    writer.writerow([])
-    writer.writerow(["Totais", totais.get("total"), "Realizados", totais.get("realizados"), "Cancelados", totais.get("cancelados"), "Em aberto", totais.get("agendados")])
-
-    conteudo = output.getvalue()
-    output.close()
+    erro_periodo = _erro_periodo(filtros)
+    if erro_periodo:
+        return erro_periodo, 400, {"Content-Type": "text/plain; charset=utf-8"}
+    filtros_norm = _aplicar_intervalo_mes(filtros)
+    # nomes de paciente/médico/procedimento também aparecem no CSV
+    etag = _etag("relatorio", filtros_norm, ("agendamentos", "usuarios", "procedimentos"))
+    nao_modificado = _nao_modificado(etag)
+    if nao_modificado:
+        return nao_modificado
 
     inicio_disp = filtros_norm.get("inicio") or ""
     fim_disp = filtros_norm.get("fim") or ""
     label_escopo = escopo or "personalizado"
     filename = f"relatorio_{label_escopo}_{inicio_disp.replace('-', '')}_{fim_disp.replace('-', '') or hoje.strftime('%Y%m%d')}".strip("_") + ".csv"
 
-    return (
-        conteudo,
-        200,
-        {
-            "Content-Type": "text/csv; charset=utf-8",
-            "Content-Disposition": f"attachment; filename={filename}",
-        },
+    # mesmo relatório já gerado (por qualquer worker): serve do disco sem consultar o banco
+    arquivo = cache_relatorios.abrir(etag)
+    if arquivo is not None:
+        resposta = send_file(
+            arquivo, mimetype="text/csv", as_attachment=True, download_name=filename, etag=False
+        )
+        return _com_etag(resposta, etag)
+
+    # transmitido em pedaços: a memória não cresce com o tamanho do período
+    resposta = Response(
+        stream_with_context(cache_relatorios.gravando(etag, _gerar_csv_relatorio(filtros_norm))),
+        mimetype="text/csv",
+        headers={"Content-Disposition": f"attachment; filename={filename}"},
     )
+    return _com_etag(resposta, etag)
 
 
 @user_bp.route("/recepcionista/chamadas/<int:chamada_id>/encaminhar", methods=["POST"], endpoint="encaminhar_chamada")
 @login_required(role='recepcionista')
 def encaminhar_chamada(chamada_id):
-    criar_tabelas()
     conn = conectar()
     cur = conn.cursor()
     cur.execute(
@@ -617,86 +906,111 @@ def encaminhar_chamada(chamada_id):
     )
     conn.commit()
     conn.close()
+    chamadas.publicar()
 
     flash("Paciente liberado para atendimento.", "success")
     return redirect(url_for("user.visao_recepcionista"))
 
 
-@user_bp.route("/recepcionista/procedimentos", methods=["GET"], endpoint="procedimentos")
-@login_required(role='recepcionista')
-def procedimentos():
-    criar_tabelas()
+@user_bp.route("/chamadas/eventos", endpoint="eventos_chamadas")
+@login_required()
+def eventos_chamadas():
+    """
+    Fluxo SSE das chamadas (criada, encaminhada, encerrada). Recepção recebe
+    todas; o médico, só as próprias. Retoma por Last-Event-ID (ou ?apos=id
+    na primeira conexão da página).
+    """
+    perfil = (session.get("usuario_tipo") or "").lower()
+    if perfil == "medico":
+        medico_id = session["usuario_id"]
+    elif perfil in ("recepcionista", "recepcionista master"):
+        medico_id = None
+    else:
+        return jsonify({"ok": False, "msg": "Acesso negado."}), 403
 
-    conn = conectar()
-    cur = conn.cursor()
+    try:
+        apos = int(request.headers.get("Last-Event-ID") or request.args.get("apos") or "")
+    except ValueError:
+        apos = None
 
-    cur.execute("SELECT id, nome, descricao FROM procedimentos ORDER BY nome")
-    procedimentos = cur.fetchall()
+    # sem stream_with_context: a conexão da requisição não fica presa ao fluxo
+    resposta = Response(chamadas.fluxo(apos, medico_id), mimetype="text/event-stream")
+    resposta.headers["Cache-Control"] = "no-cache"
+    resposta.headers["X-Accel-Buffering"] = "no"  # nginx: não acumular o fluxo
+    return resposta
 
+
+@user_bp.route("/recepcionista/painel_chamadas", endpoint="painel_chamadas")
+@login_required(role='recepcionista')
+def painel_chamadas():
+    """Painel da sala de espera: últimos pacientes encaminhados hoje, atualizado por SSE."""
+    conn = conectar()
+    cur = conn.cursor()
+    hoje = date.today()
     cur.execute(
         """
-        SELECT a.id, a.data, a.hora, a.status,
-               a.medico_id, a.sala_id, a.procedimento_id,
-               pac.nome AS paciente, med.nome AS medico,
-               pr.nome AS procedimento, s.nome AS sala
-        FROM agendamentos a
-        JOIN usuarios pac ON pac.id = a.paciente_id
-        JOIN usuarios med ON med.id = a.medico_id
-        JOIN procedimentos pr ON pr.id = a.procedimento_id
+        SELECT c.id, pac.nome AS paciente, med.nome AS medico, s.nome AS sala, c.encaminhado_em
+        FROM chamadas_pacientes c
+        JOIN agendamentos a ON a.id = c.agendamento_id
+        JOIN usuarios pac ON pac.id = c.paciente_id
+        JOIN usuarios med ON med.id = c.medico_id
         JOIN salas s ON s.id = a.sala_id
-        ORDER BY a.data, a.hora
-        """
+        WHERE c.status = 'encaminhado' AND a.inicio_min >= ? AND a.inicio_min < ?
+        ORDER BY c.encaminhado_em DESC
+        LIMIT 8
+        """,
+        (minutos_desde_epoca(hoje.isoformat()), minutos_desde_epoca(hoje.isoformat()) + 24 * 60),
+    )
+    encaminhados = [dict(row) for row in cur.fetchall()]
+    _menor, ultimo_evento_chamadas = chamadas.limites_eventos(conn)
+    conn.close()
+    return render_template(
+        "painel_chamadas.html",
+        encaminhados=encaminhados,
+        ultimo_evento_chamadas=ultimo_evento_chamadas,
     )
-    agendamentos_brutos = cur.fetchall()
 
-    colunas_agendamento = agendamentos_brutos[0].keys() if agendamentos_brutos else []
-    possui_coluna_status = "status" in colunas_agendamento
-    status_validos = {valor for valor, _ in STATUS_AGENDAMENTO}
 
-    agendamentos = []
-    atualizacoes = []
+SQL_PAINEL_PROCEDIMENTOS = """
+    SELECT a.id, a.data, a.hora, a.inicio_min, a.status,
+           a.medico_id, a.sala_id, a.procedimento_id,
+           pac.nome AS paciente, med.nome AS medico,
+           pr.nome AS procedimento, s.nome AS sala
+    FROM agendamentos a
+    JOIN usuarios pac ON pac.id = a.paciente_id
+    JOIN usuarios med ON med.id = a.medico_id
+    JOIN procedimentos pr ON pr.id = a.procedimento_id
+    JOIN salas s ON s.id = a.sala_id
+"""
 
-    for row in agendamentos_brutos:
-        linha = dict(row)
 
-        status_original = linha.get("status", "")
-        data_original = linha.get("data", "")
-        hora_original = linha.get("hora", "")
+SQL_TOTAL_GERAL = "SELECT COALESCE(SUM(total), 0) AS total FROM resumo_medico"
 
-        status_normalizado = _normalizar_status(status_original, status_validos)
-        data_normalizada = _normalizar_data(data_original)
-        hora_normalizada = _normalizar_hora(hora_original)
 
-        linha["status"] = status_normalizado
-        linha["status_label"] = STATUS_LABELS.get(status_normalizado, status_normalizado.title() if isinstance(status_normalizado, str) else status_normalizado)
-        linha["data"] = data_normalizada
-        linha["data_display"] = _formatar_data_display(data_normalizada) if data_normalizada else data_original
-        linha["hora"] = hora_normalizada
+@user_bp.route("/recepcionista/procedimentos", methods=["GET"], endpoint="procedimentos")
+@login_required(role='recepcionista')
+def procedimentos():
+    conn = conectar()
+    cur = conn.cursor()
 
-        agendamentos.append(linha)
+    procedimentos = listar("procedimentos")
 
-        if linha.get("id") is not None and (
-            status_normalizado != status_original
-            or data_normalizada != data_original
-            or hora_normalizada != hora_original
-        ):
-            if possui_coluna_status:
-                atualizacoes.append((status_normalizado, data_normalizada, hora_normalizada, linha["id"]))
-            else:
-                atualizacoes.append((data_normalizada, hora_normalizada, linha["id"]))
+    agendamentos_brutos, paginacao = _paginar(
+        cur, SQL_PAINEL_PROCEDIMENTOS, [], [], _parametros_paginacao(request.args),
+    )
+    # total geral sem varrer agendamentos (contadores mantidos por triggers)
+    cur.execute(SQL_TOTAL_GERAL)
+    total_agendamentos = cur.fetchone()["total"]
 
-    if atualizacoes:
-        if possui_coluna_status:
-            cur.executemany(
-                "UPDATE agendamentos SET status=?, data=?, hora=? WHERE id=?",
-                atualizacoes,
-            )
-        else:
-            cur.executemany(
-                "UPDATE agendamentos SET data=?, hora=? WHERE id=?",
-                atualizacoes,
-            )
-        conn.commit()
+    # valores legados são corrigidos offline (flask --app main reparar-agendamentos);
+    # a leitura só formata para exibição
+    agendamentos = []
+    for row in agendamentos_brutos:
+        linha = dict(row)
+        status = linha.get("status") or ""
+        linha["status_label"] = STATUS_LABELS.get(status, status.title())
+        linha["data_display"] = _formatar_data_display(linha.get("data"))
+        agendamentos.append(linha)
 
     conn.close()
 
@@ -704,6 +1018,8 @@ def procedimentos():
         "recep_procedimentos.html",
         procedimentos=procedimentos,
         agendamentos=agendamentos,
+        total_agendamentos=total_agendamentos,
+        paginacao=paginacao,
         status_opcoes=STATUS_AGENDAMENTO,
     )
 
@@ -817,10 +1133,7 @@ def atualizar_agendamento(agendamento_id):
     alterar_horario = False
 
     if nova_data and nova_hora:
-        try:
-            datetime.strptime(nova_data, "%Y-%m-%d")
-            datetime.strptime(nova_hora, "%H:%M")
-        except ValueError:
+        if not (data_valida(nova_data) and hora_valida(nova_hora)):
             conn.close()
             flash("Formato de data ou hora inválido.", "danger")
             return redirect(url_for("user.procedimentos"))
@@ -849,9 +1162,36 @@ def atualizar_agendamento(agendamento_id):
         flash("Nenhuma alteração informada.", "info")
         return redirect(url_for("user.procedimentos"))
 
+    if alterar_horario:
+        # remarcado: volta a ser protegido pelos índices únicos de horário
+        campos.append("conflito_legado=0")
+
     valores.append(agendamento_id)
-    cur.execute(f"UPDATE agendamentos SET {', '.join(campos)} WHERE id=?", valores)
-    conn.commit()
+    try:
+        cur.execute(f"UPDATE agendamentos SET {', '.join(campos)} WHERE id=?", valores)
+        conn.commit()
+    except sqlite3.IntegrityError as e:
+        conn.rollback()
+        conn.close()
+        recurso = recurso_em_conflito(e)
+        if recurso is None:
+            raise
+        flash(MSG_CONFLITO[recurso], "danger")
+        return redirect(url_for("user.procedimentos"))
+
+    if STATUS_CODIGO.get(status) in (STATUS_CONCLUIDO, STATUS_CANCELADO):
+        chamadas.publicar()  # trigger pode ter encerrado a chamada da consulta
+
+    status_final = status or atual["status"]
+    ocupava = atual["status"] != "cancelado"
+    ocupa = status_final != "cancelado"
+    if alterar_horario or ocupava != ocupa:
+        registrar_ocupacao(
+            agendamento_id,
+            antes=(atual["medico_id"], atual["sala_id"], atual["data"], atual["hora"]) if ocupava else None,
+            depois=(atual["medico_id"], atual["sala_id"], nova_data or atual["data"],
+                    nova_hora or atual["hora"]) if ocupa else None,
+        )
     conn.close()
 
     flash("Agendamento atualizado com sucesso!", "success")
@@ -860,100 +1200,48 @@ def atualizar_agendamento(agendamento_id):
 @user_bp.route("/medico", endpoint="visao_medico")
 @login_required(role='medico')
 def visao_medico():
-    criar_tabelas()
     medico_id = session["usuario_id"]
     hoje = date.today().isoformat()
 
     conn = conectar()
     cur = conn.cursor()
 
+    # agenda do dia, chamada mais recente de cada consulta e contadores do
+    # painel numa única consulta (databaser.SQL_AGENDA_MEDICO_DIA)
+    inicio_dia = minutos_desde_epoca(hoje)
     cur.execute(
-        "SELECT COUNT(1) AS total FROM agendamentos WHERE medico_id=? AND data=?",
-        (medico_id, hoje),
-    )
-    total_hoje = cur.fetchone()["total"]
-
-    cur.execute(
-        """SELECT COUNT(1) AS total FROM agendamentos
-            WHERE medico_id=? AND data=? AND LOWER(status)='concluido'""",
-        (medico_id, hoje),
-    )
-    concluidos_hoje = cur.fetchone()["total"]
-
-    cur.execute(
-        """SELECT COUNT(1) AS total FROM agendamentos
-            WHERE medico_id=? AND data=? AND LOWER(status)='cancelado'""",
-        (medico_id, hoje),
-    )
-    cancelados_hoje = cur.fetchone()["total"]
-
-    cur.execute(
-        "SELECT COUNT(1) AS total FROM agendamentos WHERE medico_id=? AND LOWER(status)='concluido'",
-        (medico_id,),
-    )
-    concluidos_totais = cur.fetchone()["total"]
-
-    cur.execute(
-        """
-        SELECT a.id, a.data, a.hora, a.status, a.notas, a.convenio,
-               pac.nome AS paciente, pr.nome AS procedimento, s.nome AS sala
-        FROM agendamentos a
-        JOIN usuarios pac ON pac.id = a.paciente_id
-        JOIN procedimentos pr ON pr.id = a.procedimento_id
-        JOIN salas s ON s.id = a.sala_id
-        WHERE a.medico_id=? AND a.data=?
-        ORDER BY a.hora
-        """,
-        (medico_id, hoje),
-    )
-    consultas_brutas = cur.fetchall()
-
-    cur.execute(
-        """SELECT agendamento_id, status, criado_em, encaminhado_em
-            FROM chamadas_pacientes
-            WHERE medico_id=?
-            ORDER BY id DESC""",
-        (medico_id,),
+        SQL_AGENDA_MEDICO_DIA,
+        {
+            "medico": medico_id,
+            "inicio": inicio_dia,
+            "fim": inicio_dia + 24 * 60,
+            "concluido": STATUS_CONCLUIDO,
+            "cancelado": STATUS_CANCELADO,
+        },
     )
-    chamadas = cur.fetchall()
-    chamadas_por_agendamento = {}
-    for row in chamadas:
-        agendamento_id = row["agendamento_id"]
-        if agendamento_id not in chamadas_por_agendamento:
-            chamadas_por_agendamento[agendamento_id] = dict(row)
+    linhas = cur.fetchall()
+    conn.close()
 
-    status_validos = {valor for valor, _ in STATUS_AGENDAMENTO}
+    # sempre há ao menos uma linha (a base com os totais); sem consultas no dia, id é NULL
+    base = linhas[0]
+    # status/hora já vêm canônicos do reparo em lote (reparar-agendamentos);
+    # o rótulo sai da coluna gerada status_codigo
     consultas = []
-    for row in consultas_brutas:
+    for row in linhas:
+        if row["id"] is None:
+            continue
         registro = dict(row)
-        status_normalizado = _normalizar_status(registro.get("status", ""), status_validos)
-        registro["status"] = status_normalizado
-        registro["status_label"] = STATUS_LABELS.get(
-            status_normalizado,
-            status_normalizado.title() if isinstance(status_normalizado, str) and status_normalizado else status_normalizado,
-        )
+        registro["status_label"] = _rotulo_status(row)
         registro["data_display"] = _formatar_data_display(registro.get("data"))
-        registro["hora_display"] = _normalizar_hora(registro.get("hora"))
         registro["notas"] = registro.get("notas") or ""
         registro["convenio"] = registro.get("convenio") or "—"
-        chamada_info = chamadas_por_agendamento.get(registro["id"])
-        if chamada_info:
-            registro["chamada_status"] = chamada_info.get("status")
-            registro["chamada_criada"] = chamada_info.get("criado_em")
-            registro["chamada_encaminhada"] = chamada_info.get("encaminhado_em")
-        else:
-            registro["chamada_status"] = None
-            registro["chamada_criada"] = None
-            registro["chamada_encaminhada"] = None
         consultas.append(registro)
 
-    conn.close()
-
     dashboard = {
-        "total_hoje": total_hoje,
-        "cancelados_hoje": cancelados_hoje,
-        "concluidos_hoje": concluidos_hoje,
-        "concluidos_totais": concluidos_totais,
+        "total_hoje": base["total_hoje"] or 0,
+        "cancelados_hoje": base["cancelados_hoje"] or 0,
+        "concluidos_hoje": base["concluidos_hoje"] or 0,
+        "concluidos_totais": base["concluidos_totais"],
     }
 
     return render_template(
@@ -961,13 +1249,13 @@ def visao_medico():
         dashboard=dashboard,
         consultas=consultas,
         data_hoje=_formatar_data_display(hoje),
+        ultimo_evento_chamadas=base["ultimo_evento"],
     )
 
 
 @user_bp.route("/medico/agendamentos/<int:agendamento_id>/nota", methods=["POST"], endpoint="salvar_nota_medico")
 @login_required(role='medico')
 def salvar_nota_medico(agendamento_id):
-    criar_tabelas()
     nota = request.form.get("nota", "")
     if nota is None:
         nota = ""
@@ -999,7 +1287,6 @@ def salvar_nota_medico(agendamento_id):
 @user_bp.route("/medico/agendamentos/<int:agendamento_id>/chamar", methods=["POST"], endpoint="chamar_paciente")
 @login_required(role='medico')
 def chamar_paciente(agendamento_id):
-    criar_tabelas()
     medico_id = session["usuario_id"]
     conn = conectar()
     cur = conn.cursor()
@@ -1043,10 +1330,33 @@ def chamar_paciente(agendamento_id):
     )
     conn.commit()
     conn.close()
+    chamadas.publicar()
 
     flash("Chamada enviada à recepção.", "success")
     return redirect(url_for("user.visao_medico"))
 
+SQL_AGENDA_PACIENTE = """
+    SELECT a.id, a.data, a.hora, a.medico_id, a.sala_id,
+           s.nome AS sala, u.nome AS medico, p.nome AS procedimento
+    FROM agendamentos a
+    JOIN salas s ON s.id=a.sala_id
+    JOIN usuarios u ON u.id=a.medico_id
+    JOIN procedimentos p ON p.id=a.procedimento_id
+    WHERE a.paciente_id=?
+    ORDER BY a.inicio_min
+"""
+
+# CROSS JOIN fixa a ordem: agendamentos do paciente primeiro, sem depender
+# de estatísticas (sem ANALYZE o planner preferia varrer os ajustes por id)
+SQL_AJUSTES_PACIENTE = """
+    SELECT j.*, a.data AS data_atual, a.hora AS hora_atual
+    FROM agendamentos a
+    CROSS JOIN agendamento_ajustes j ON j.agendamento_id=a.id
+    WHERE a.paciente_id=?
+    ORDER BY j.id DESC
+"""
+
+
 @user_bp.route("/paciente", endpoint="visao_paciente")
 @login_required(role='paciente')
 def visao_paciente():
@@ -1054,52 +1364,25 @@ def visao_paciente():
     conn = conectar()
     cur = conn.cursor()
 
-    cur.execute("""
-        SELECT a.id, a.data, a.hora, a.medico_id, a.sala_id,
-               s.nome AS sala, u.nome AS medico, p.nome AS procedimento
-        FROM agendamentos a
-        JOIN salas s ON s.id=a.sala_id
-        JOIN usuarios u ON u.id=a.medico_id
-        JOIN procedimentos p ON p.id=a.procedimento_id
-        WHERE a.paciente_id=?
-        ORDER BY a.data, a.hora
-    """, (pid,))
+    cur.execute(SQL_AGENDA_PACIENTE, (pid,))
     ags = cur.fetchall()
 
-    cur.execute("""
-        SELECT j.*, a.data AS data_atual, a.hora AS hora_atual
-        FROM agendamento_ajustes j
-        JOIN agendamentos a ON a.id=j.agendamento_id
-        WHERE a.paciente_id=?
-        ORDER BY j.id DESC
-    """, (pid,))
+    cur.execute(SQL_AJUSTES_PACIENTE, (pid,))
     ajustes = cur.fetchall()
 
     cur.execute("SELECT nome, email FROM usuarios WHERE id=?", (pid,))
     perfil_row = cur.fetchone()
     perfil = {"nome": perfil_row["nome"], "email": perfil_row["email"]} if perfil_row else {"nome": "", "email": ""}
 
-    cur.execute("SELECT id, nome FROM usuarios WHERE tipo_usuario IN ('medico','médico') ORDER BY nome")
-    medicos = cur.fetchall()
-    cur.execute("SELECT id, nome FROM procedimentos ORDER BY nome")
-    procedimentos = cur.fetchall()
-    cur.execute("SELECT id, nome FROM salas ORDER BY nome")
-    salas = cur.fetchall()
-    cur.execute(
-        "SELECT DISTINCT convenio FROM agendamentos WHERE convenio IS NOT NULL AND TRIM(convenio)<>'' ORDER BY convenio"
-    )
-    convenios = [row["convenio"] for row in cur.fetchall()]
-
     conn.close()
     return render_template(
         "paciente.html",
         agendamentos=ags,
         ajustes=ajustes,
         perfil=perfil,
-        medicos=medicos,
-        procedimentos=procedimentos,
-        salas=salas,
-        convenios=convenios,
+        procedimentos=listar("procedimentos"),
+        salas=listar("salas"),
+        convenios=listar("convenios"),
     )
 
 
@@ -1125,7 +1408,7 @@ def atualizar_perfil_paciente():
 
     try:
         if senha:
-            senha_hash = generate_password_hash(senha)
+            senha_hash = senhas.gerar_hash(senha)
             cur.execute(
                 "UPDATE usuarios SET nome=?, email=?, senha=? WHERE id=?",
                 (nome, email, senha_hash, usuario_id),
@@ -1151,7 +1434,6 @@ def atualizar_perfil_paciente():
 @user_bp.route("/paciente/agendar", methods=["POST"], endpoint="agendar_consulta_paciente")
 @login_required(role='paciente')
 def agendar_consulta_paciente():
-    criar_tabelas()
     paciente_id = session["usuario_id"]
     medico_id = (request.form.get("medico_id") or "").strip()
     procedimento_id = (request.form.get("procedimento_id") or "").strip()
@@ -1164,10 +1446,7 @@ def agendar_consulta_paciente():
         flash("Preencha todos os campos para agendar.", "danger")
         return redirect(url_for("user.visao_paciente"))
 
-    try:
-        datetime.strptime(data_, "%Y-%m-%d")
-        datetime.strptime(hora_, "%H:%M")
-    except ValueError:
+    if not (data_valida(data_) and hora_valida(hora_)):
         flash("Data ou horário em formato inválido.", "danger")
         return redirect(url_for("user.visao_paciente"))
 
@@ -1177,22 +1456,19 @@ def agendar_consulta_paciente():
         return redirect(url_for("user.visao_paciente"))
 
     conn = conectar()
-    cur = conn.cursor()
-    cur.execute(
-        "SELECT 1 FROM agendamentos WHERE paciente_id=? AND data=? AND hora=?",
-        (paciente_id, data_, hora_),
-    )
-    if cur.fetchone():
+    try:
+        novo_id = inserir_agendamento(
+            conn, paciente_id, medico_id, procedimento_id, sala_id, data_, hora_, convenio,
+            checar_paciente=True,
+        )
+    except ConflitoHorario as conflito:
         conn.close()
-        flash("Você já possui uma consulta nesse horário.", "warning")
+        if conflito.recurso == "paciente":
+            flash(MSG_CONFLITO["paciente"], "warning")
+        else:
+            flash("Horário indisponível para o médico ou sala escolhidos.", "danger")
         return redirect(url_for("user.visao_paciente"))
-
-    cur.execute(
-        """INSERT INTO agendamentos (paciente_id, medico_id, procedimento_id, sala_id, data, hora, convenio)
-            VALUES (?, ?, ?, ?, ?, ?, ?)""",
-        (paciente_id, medico_id, procedimento_id, sala_id, data_, hora_, convenio),
-    )
-    conn.commit()
+    registrar_ocupacao(novo_id, depois=(medico_id, sala_id, data_, hora_))
     conn.close()
 
     flash("Consulta agendada com sucesso!", "success")
@@ -1228,6 +1504,11 @@ def solicitar_ajuste(agendamento_id):
         flash("Informe novo dia e horário.", "danger")
         return redirect(url_for("user.visao_paciente"))
 
+    if not (data_valida(novo_dia) and hora_valida(nova_hora)):
+        conn.close()
+        flash("Data ou horário em formato inválido.", "danger")
+        return redirect(url_for("user.visao_paciente"))
+
     livres = horarios_disponiveis(agendamento["medico_id"], agendamento["sala_id"], novo_dia)
     if not (novo_dia == agendamento["data"] and nova_hora == agendamento["hora"]):
         if nova_hora not in livres:
@@ -1247,22 +1528,25 @@ def solicitar_ajuste(agendamento_id):
 
 
 # ------------------ Recepção: lista & decisão de ajustes ------------------
+SQL_AJUSTES_PENDENTES = """
+    SELECT j.*, a.paciente_id, a.medico_id, a.sala_id, a.data AS data_atual, a.hora AS hora_atual,
+           p.nome AS paciente, m.nome AS medico, s.nome AS sala
+    FROM agendamento_ajustes j
+    JOIN agendamentos a ON a.id=j.agendamento_id
+    JOIN usuarios p ON p.id=a.paciente_id
+    JOIN usuarios m ON m.id=a.medico_id
+    JOIN salas s ON s.id=a.sala_id
+    WHERE j.status='pendente'
+    ORDER BY j.id ASC
+"""
+
+
 @user_bp.route("/recepcionista/ajustes", endpoint="lista_ajustes")
 @login_required(role='recepcionista')
 def lista_ajustes():
     conn = conectar()
     cur = conn.cursor()
-    cur.execute("""
-        SELECT j.*, a.paciente_id, a.medico_id, a.sala_id, a.data AS data_atual, a.hora AS hora_atual,
-               p.nome AS paciente, m.nome AS medico, s.nome AS sala
-        FROM agendamento_ajustes j
-        JOIN agendamentos a ON a.id=j.agendamento_id
-        JOIN usuarios p ON p.id=a.paciente_id
-        JOIN usuarios m ON m.id=a.medico_id
-        JOIN salas s ON s.id=a.sala_id
-        WHERE j.status='pendente'
-        ORDER BY j.id ASC
-    """)
+    cur.execute(SQL_AJUSTES_PENDENTES)
     pendentes = cur.fetchall()
     conn.close()
     return render_template("recep_ajustes.html", pendentes=pendentes)
@@ -1275,7 +1559,8 @@ def decidir_ajuste(ajuste_id):
     conn = conectar()
     cur = conn.cursor()
     cur.execute("""
-        SELECT j.*, a.medico_id, a.sala_id
+        SELECT j.*, a.medico_id, a.sala_id, a.data AS data_atual, a.hora AS hora_atual,
+               a.status AS status_atual
         FROM agendamento_ajustes j
         JOIN agendamentos a ON a.id=j.agendamento_id
         WHERE j.id=? AND j.status='pendente'
@@ -1302,9 +1587,27 @@ def decidir_ajuste(ajuste_id):
         return redirect(url_for("user.lista_ajustes"))
 
     # aplica ajuste
-    cur.execute("UPDATE agendamentos SET data=?, hora=? WHERE id=?", (row["novo_dia"], row["nova_hora"], row["agendamento_id"]))
-    cur.execute("UPDATE agendamento_ajustes SET status='aceito' WHERE id=?", (ajuste_id,))
-    conn.commit()
+    try:
+        cur.execute(
+            "UPDATE agendamentos SET data=?, hora=?, conflito_legado=0 WHERE id=?",
+            (row["novo_dia"], row["nova_hora"], row["agendamento_id"]),
+        )
+        cur.execute("UPDATE agendamento_ajustes SET status='aceito' WHERE id=?", (ajuste_id,))
+        conn.commit()
+    except sqlite3.IntegrityError as e:
+        conn.rollback()
+        conn.close()
+        if recurso_em_conflito(e) is None:
+            raise
+        flash("Horário indisponível. Escolha outro horário.", "danger")
+        return redirect(url_for("user.lista_ajustes"))
+    if row["status_atual"] != "cancelado":
+        # cancelado não ocupa horário: nada a liberar nem a marcar no índice
+        registrar_ocupacao(
+            row["agendamento_id"],
+            antes=(row["medico_id"], row["sala_id"], row["data_atual"], row["hora_atual"]),
+            depois=(row["medico_id"], row["sala_id"], row["novo_dia"], row["nova_hora"]),
+        )
     conn.close()
     flash("Solicitação aceita e agendamento atualizado.", "success")
     return redirect(url_for("user.lista_ajustes"))
@@ -1330,13 +1633,15 @@ def horarios_api():
     except ValueError:
         ignorar_id_int = None
 
-    return jsonify(
-        horarios_disponiveis(
+    return _json_disponibilidade(
+        "horarios",
+        [medico_id, sala_id, dia, ignorar_id_int],
+        lambda: horarios_disponiveis(
             medico_id,
             sala_id,
             dia,
             ignorar_agendamento_id=ignorar_id_int,
-        )
+        ),
     )
 
 
@@ -1352,6 +1657,11 @@ def paciente_horarios_api():
     if not dia:
         return jsonify({"ok": False, "msg": "Informe o dia."}), 400
 
+    etag = _etag("horarios_paciente", [session["usuario_id"], agendamento_id, dia], ("agendamentos",))
+    nao_modificado = _nao_modificado(etag)
+    if nao_modificado:
+        return nao_modificado
+
     conn = conectar()
     cur = conn.cursor()
     cur.execute(
@@ -1365,7 +1675,7 @@ def paciente_horarios_api():
         return jsonify({"ok": False, "msg": "Agendamento não encontrado."}), 404
 
     livres = horarios_disponiveis(agendamento["medico_id"], agendamento["sala_id"], dia)
-    return jsonify(livres)
+    return _com_etag(jsonify(livres), etag)
 
 
 @user_bp.route("/paciente/horarios_novo", endpoint="paciente_horarios_novo")
@@ -1381,7 +1691,141 @@ def paciente_horarios_novo():
     if not (medico_id and sala_id and dia):
         return jsonify([])
 
-    return jsonify(horarios_disponiveis(medico_id, sala_id, dia))
+    return _json_disponibilidade(
+        "horarios", [medico_id, sala_id, dia, None],
+        lambda: horarios_disponiveis(medico_id, sala_id, dia),
+    )
+
+
+@user_bp.route("/horarios_periodo", endpoint="horarios_periodo_api")
+@login_required()
+def horarios_periodo_api():
+    """Horários livres de vários dias (até semanas) em uma única requisição."""
+    try:
+        medico_id = int(request.args.get("medico_id", "0"))
+        sala_id = int(request.args.get("sala_id", "0"))
+        inicio = datetime.strptime((request.args.get("inicio") or "").strip(), "%Y-%m-%d").date()
+        fim_str = (request.args.get("fim") or "").strip()
+        fim = datetime.strptime(fim_str, "%Y-%m-%d").date() if fim_str else inicio
+    except ValueError:
+        return jsonify({"ok": False, "msg": "Parâmetros inválidos."}), 400
+
+    if not (medico_id and sala_id):
+        return jsonify({"ok": False, "msg": "Informe médico e sala."}), 400
+
+    ignorar_id = request.args.get("ignorar_id")
+    try:
+        ignorar_id_int = int(ignorar_id) if ignorar_id is not None else None
+    except ValueError:
+        ignorar_id_int = None
+
+    etag = _etag("horarios_periodo", [medico_id, sala_id, inicio, fim, ignorar_id_int], ("agendamentos",))
+    nao_modificado = _nao_modificado(etag)
+    if nao_modificado:
+        return nao_modificado
+
+    try:
+        dias = horarios_disponiveis_periodo(
+            medico_id, sala_id, inicio, fim, ignorar_agendamento_id=ignorar_id_int
+        )
+    except ValueError as e:
+        return jsonify({"ok": False, "msg": f"Intervalo inválido: {e}."}), 400
+
+    resposta = jsonify({"ok": True, "inicio": inicio.isoformat(), "fim": fim.isoformat(), "dias": dias})
+    return _com_etag(resposta, etag)
+
+
+@user_bp.route("/recepcionista/cache_referencias", endpoint="cache_referencias_api")
+@login_required(role='recepcionista')
+def cache_referencias_api():
+    """Acertos/falhas do cache de listas de referência deste processo."""
+    return jsonify({"ok": True, **cache_referencias.estatisticas()})
+
+
+@user_bp.route("/recepcionista/sql_rastreio", endpoint="sql_rastreio_api")
+@login_required(role='recepcionista')
+def sql_rastreio_api():
+    """Comandos SQL que mais somaram tempo neste processo (requer SQL_RASTREIO)."""
+    limite = min(max(request.args.get("limit", 50, type=int), 1), 500)
+    return jsonify({
+        "ok": True,
+        "ativo": rastreio_sql.config.ativo,
+        "lenta_ms": rastreio_sql.config.lenta_s * 1000,
+        "comandos": rastreio_sql.estatisticas.maiores(limite),
+    })
+
+
+@user_bp.route("/recepcionista/perfis", endpoint="perfis_lista")
+@login_required(role='recepcionista master')
+def perfis_lista():
+    """Perfis cProfile mais recentes (amostragem ou cabeçalho PERFIS_CABECALHO)."""
+    return render_template(
+        "perfis.html",
+        itens=perfis.listar(limite=100),
+        ativo=bool(perfis.diretorio),
+        amostra=perfis.amostra,
+        cabecalho=perfis.cabecalho,
+    )
+
+
+@user_bp.route("/recepcionista/perfis/<nome>.<extensao>", endpoint="perfis_arquivo")
+@login_required(role='recepcionista master')
+def perfis_arquivo(nome, extensao):
+    caminho = perfis.caminho(nome, extensao)
+    if caminho is None:
+        return jsonify({"ok": False, "msg": "Perfil não encontrado."}), 404
+    mimetype = {"prof": "application/octet-stream", "txt": "text/plain", "json": "application/json"}[extensao]
+    return send_file(caminho, mimetype=mimetype, as_attachment=extensao == "prof", download_name=f"{nome}.{extensao}")
+
+
+@user_bp.route("/api/usuarios", endpoint="usuarios_api")
+@login_required()
+def usuarios_api():
+    """
+    Seletor sob demanda: ?tipo=paciente|medico&q=prefixo&limit=20&apos=cursor.
+    Pacientes só podem listar médicos.
+    """
+    tipo = (request.args.get("tipo") or "").strip().lower()
+    if tipo not in ("paciente", "medico"):
+        return jsonify({"ok": False, "msg": "Tipo inválido."}), 400
+    perfil = (session.get("usuario_tipo") or "").lower()
+    if perfil not in ("recepcionista", "recepcionista master") and tipo != "medico":
+        return jsonify({"ok": False, "msg": "Acesso negado."}), 403
+
+    itens, proximo = busca.usuarios_por_prefixo(
+        tipo,
+        request.args.get("q") or "",
+        apos=request.args.get("apos"),
+        limite=request.args.get("limit", busca.LIMITE_PADRAO),
+    )
+    return jsonify({"ok": True, "itens": itens, "proximo": proximo})
+
+
+@user_bp.route("/api/busca", endpoint="busca_api")
+@login_required(role='recepcionista')
+def busca_api():
+    """
+    Busca textual (FTS5): ?q=texto&em=pacientes|medicos|usuarios|convenios|notas&limit=20.
+    Exige ao menos busca.MIN_CARACTERES caracteres.
+    """
+    texto = (request.args.get("q") or "").strip()
+    em = (request.args.get("em") or "usuarios").strip().lower()
+    limite = request.args.get("limit", busca.LIMITE_PADRAO)
+
+    if busca.termo_fts(texto) is None:
+        return jsonify({"ok": False, "msg": f"Digite ao menos {busca.MIN_CARACTERES} caracteres."}), 400
+
+    if em in ("pacientes", "medicos"):
+        itens = busca.buscar_usuarios(texto, tipo=em[:-1], limite=limite)
+    elif em == "usuarios":
+        itens = busca.buscar_usuarios(texto, limite=limite)
+    elif em == "convenios":
+        itens = busca.buscar_convenios(texto, limite=limite)
+    elif em == "notas":
+        itens = busca.buscar_notas(texto, limite=limite)
+    else:
+        return jsonify({"ok": False, "msg": "Parâmetro 'em' inválido."}), 400
+    return jsonify({"ok": True, "itens": itens})
 
 
 # ------------------ Recepção: criar usuários ------------------
@@ -1394,7 +1838,7 @@ def cadastrar_usuarios():
         senha = request.form.get("senha", "")
         tipo_usuario = request.form.get("tipo_usuario", "").lower()
 
-        senha_hash = generate_password_hash(senha)
+        senha_hash = senhas.gerar_hash(senha)
 
         conn = conectar()
         cur = conn.cursor()
@@ -1467,7 +1911,7 @@ def editar_usuario(usuario_id):
 
         try:
             if senha:
-                senha_hash = generate_password_hash(senha)
+                senha_hash = senhas.gerar_hash(senha)
                 cur.execute(
                     "UPDATE usuarios SET nome=?, email=?, senha=? WHERE id=?",
                     (nome, email, senha_hash, usuario_id),
@@ -1491,5 +1935,49 @@ def editar_usuario(usuario_id):
     conn.close()
     return render_template("editar_usuario.html", usuario=usuario)
 
-app = Flask(__name__)
 
+# ------------------ Consultas quentes (verificar-planos) ------------------
+# filtros representativos da recepção e da exportação, passados pelos mesmos
+# construtores das rotas; inclui o painel e o relatório sem filtro
+FILTROS_REPRESENTATIVOS = {
+    "sem_filtro": {},
+    "mes": {"mes": "2025-01"},
+    "mes_medico": {"mes": "2025-01", "medico": "1"},
+    "medico": {"medico": "1"},
+    "paciente": {"paciente": "1"},
+    "procedimento": {"procedimento": "1"},
+    "mes_convenio": {"mes": "2025-01", "convenio": "unimed"},
+}
+PAGINAS_REPRESENTATIVAS = {
+    "": {"por_pagina": POR_PAGINA_PADRAO, "apos": None, "antes": None},
+    "_apos": {"por_pagina": POR_PAGINA_PADRAO, "apos": (28928640, 1), "antes": None},
+    "_antes": {"por_pagina": POR_PAGINA_PADRAO, "apos": None, "antes": (28928640, 1)},
+    "_apos_legado": {"por_pagina": POR_PAGINA_PADRAO, "apos": (None, 1), "antes": None},
+    "_antes_legado": {"por_pagina": POR_PAGINA_PADRAO, "apos": None, "antes": (None, 1)},
+}
+
+
+def _consultas_quentes():
+    consultas = {
+        "ajustes_pendentes_contagem": (SQL_AJUSTES_PENDENTES_CONTAGEM, ()),
+        "ajustes_pendentes": (SQL_AJUSTES_PENDENTES, ()),
+        "visao_recepcionista_contagem_dia": (SQL_CONTAGEM_DIA, ("2025-01-01",)),
+        "visao_recepcionista_concluidos_medico": (SQL_CONCLUIDOS_POR_MEDICO, ()),
+        "visao_recepcionista_chamadas_pendentes": (SQL_CHAMADAS_PENDENTES, ()),
+        "procedimentos_total": (SQL_TOTAL_GERAL, ()),
+        "visao_paciente": (SQL_AGENDA_PACIENTE, (1,)),
+        "visao_paciente_ajustes": (SQL_AJUSTES_PACIENTE, (1,)),
+    }
+    for sufixo, pagina in PAGINAS_REPRESENTATIVAS.items():
+        consultas[f"procedimentos_pagina{sufixo}"] = _sql_pagina(SQL_PAINEL_PROCEDIMENTOS, [], [], pagina)[:2]
+    for nome, filtros in FILTROS_REPRESENTATIVOS.items():
+        filtros = _aplicar_intervalo_mes(dict(filtros))
+        condicoes, params = _condicoes_filtros(filtros)
+        for sufixo, pagina in PAGINAS_REPRESENTATIVAS.items():
+            consultas[f"recepcao_{nome}_pagina{sufixo}"] = _sql_pagina(SQL_RELATORIO, condicoes, params, pagina)[:2]
+        consultas[f"recepcao_{nome}_totais"] = _sql_totais(condicoes, params)
+        consultas[f"exportacao_{nome}"] = _sql_relatorio(filtros)
+    return consultas
+
+
+FONTES_CONSULTAS_QUENTES.append(_consultas_quentes)
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""
+Hash e verificação de senhas fora do processo web.
+
+O KDF do werkzeug é lento de propósito e segura o GIL enquanto roda; em um
+pico de logins ele trava todas as outras requisições do worker. Aqui o
+trabalho vai para um pool de processos com fila limitada: quando processos
+e fila estão cheios, ou o hash não termina em `timeout_s`, a chamada
+falha rápido com SenhaIndisponivel em vez de acumular requisições.
+
+Só `processos` pedidos ficam no executor por vez; os demais esperam a vez
+na fila (até `fila_max`), então `timeout_s` mede o hash e não a espera. Os
+processos sobem na primeira requisição (`aquecer`), não no primeiro login.
+"""
+import hmac
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as TempoEsgotado
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+METODOS_HASH = ("scrypt:", "pbkdf2:")
+
+
+class SenhaIndisponivel(Exception):
+    """Pool de senhas saturado ou sem resposta dentro do timeout."""
+
+
+def parece_hash(valor):
+    """True se `valor` está no formato do werkzeug (método$salt$hash)."""
+    return bool(valor) and valor.startswith(METODOS_HASH) and valor.count("$") >= 2
+
+
+def _pronto():
+    return os.getpid()
+
+
+class PoolSenhas:
+    def __init__(self, processos=None, fila_max=32, timeout_s=10.0):
+        self.processos = (os.cpu_count() or 1) if processos is None else processos
+        self.fila_max = fila_max
+        self.timeout_s = timeout_s
+        self._executor = None
+        self._vagas = None
+        self._em_execucao = None
+        self._lock = threading.Lock()
+        self._aquecimento = None
+        self.recusadas = 0
+
+    def _obter_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # spawn: o filho não herda conexões SQLite nem locks do processo web
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.processos,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+                self._vagas = threading.BoundedSemaphore(self.processos + self.fila_max)
+                self._em_execucao = threading.BoundedSemaphore(self.processos)
+            return self._executor, self._vagas, self._em_execucao
+
+    def aquecer(self, esperar=True):
+        """
+        Sobe os processos do pool com uma tarefa vazia por processo. Com
+        `esperar=False` roda numa thread e volta na hora; chamadas repetidas
+        não sobem nada de novo.
+        """
+        if self.processos <= 0 or (not esperar and self._aquecimento is not None):
+            return
+        with self._lock:
+            if self._aquecimento is None:
+                self._aquecimento = threading.Thread(target=self._subir_processos, daemon=True)
+                self._aquecimento.start()
+            aquecimento = self._aquecimento
+        if esperar:
+            aquecimento.join()
+
+    def _subir_processos(self):
+        executor = self._obter_executor()[0]
+        # submetidas de uma vez: sem processo ocioso, cada uma sobe um novo
+        try:
+            for futuro in [executor.submit(_pronto) for _ in range(self.processos)]:
+                futuro.result()
+        except (BrokenProcessPool, RuntimeError):
+            self._descartar(executor)
+
+    def _executar(self, fn, *args):
+        if self.processos <= 0:  # 0 desliga o pool (roda na própria thread)
+            return fn(*args)
+        executor, vagas, em_execucao = self._obter_executor()
+        if not vagas.acquire(blocking=False):
+            with self._lock:
+                self.recusadas += 1
+            raise SenhaIndisponivel("fila de senhas cheia")
+        # espera a vez na fila; no pior caso a fila inteira à frente estoura o timeout
+        espera_max = self.timeout_s * (self.fila_max // self.processos + 1)
+        if not em_execucao.acquire(timeout=espera_max):
+            vagas.release()
+            raise SenhaIndisponivel("tempo esgotado na fila de senhas")
+        try:
+            futuro = executor.submit(fn, *args)
+        except (BrokenProcessPool, RuntimeError):
+            em_execucao.release()
+            vagas.release()
+            self._descartar(executor)
+            raise SenhaIndisponivel("pool de senhas reiniciado")
+
+        # vaga e processo só voltam quando o hash termina de fato, mesmo após um timeout
+        def liberar(_futuro):
+            em_execucao.release()
+            vagas.release()
+        futuro.add_done_callback(liberar)
+        try:
+            return futuro.result(timeout=self.timeout_s)
+        except TempoEsgotado:
+            futuro.cancel()
+            raise SenhaIndisponivel("tempo esgotado ao processar a senha")
+        except BrokenProcessPool:
+            self._descartar(executor)
+            raise SenhaIndisponivel("pool de senhas reiniciado")
+
+    def _descartar(self, executor):
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+                self._aquecimento = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    # ---------- API ----------
+    def gerar_hash(self, senha):
+        return self._executar(generate_password_hash, senha)
+
+    def verificar(self, senha_armazenada, senha):
+        """
+        Confere `senha` com o valor salvo. Valores legados sem hash são
+        comparados em tempo constante, sem passar pelo pool.
+        """
+        if not parece_hash(senha_armazenada):
+            return hmac.compare_digest((senha_armazenada or "").encode(), senha.encode())
+        return self._executar(check_password_hash, senha_armazenada, senha)
+
+    def encerrar(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+            self._aquecimento = None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def estatisticas(self):
+        return {"processos": self.processos, "fila_max": self.fila_max, "recusadas": self.recusadas}
+
+
+pool = PoolSenhas()
+
+
+def configurar(processos=None, fila_max=32, timeout_s=10.0):
+    """Substitui o pool global (o antigo é encerrado)."""
+    global pool
+    antigo = pool
+    pool = PoolSenhas(processos, fila_max, timeout_s)
+    antigo.encerrar()
+    return pool
+
+
+def init_app(app):
+    app.config.setdefault("SENHAS_PROCESSOS", os.cpu_count() or 1)  # 0 = na própria thread
+    app.config.setdefault("SENHAS_FILA_MAX", 32)                    # pedidos aguardando processo
+    app.config.setdefault("SENHAS_TIMEOUT_S", 10)
+    configurar(
+        int(app.config["SENHAS_PROCESSOS"]),
+        int(app.config["SENHAS_FILA_MAX"]),
+        float(app.config["SENHAS_TIMEOUT_S"]),
+    )
+
+    @app.before_request
+    def _aquecer_pool_senhas():
+        # sobe os processos em segundo plano na primeira requisição (comandos
+        # `flask ...` não pagam o spawn); o pool atual, mesmo se reconfigurado
+        pool.aquecer(esperar=False)
+
+
+def gerar_hash(senha):
+    return pool.gerar_hash(senha)
+
+
+def verificar(senha_armazenada, senha):
+    return pool.verificar(senha_armazenada, senha)